@@ -0,0 +1,1476 @@
+"""
+Offline benchmarks for the pollen scraper
+
+The benchmarks replay the recorded pages in fixtures/ from a local HTTP
+server, so they never touch wetteronline.de.
+
+Usage:
+    python benchmark.py fetch --cities 400 --latency 0.02
+    python benchmark.py cache --cities 100
+    python benchmark.py parse
+    python benchmark.py parse-workers --pages 400 --workers 0,1,2,4,8,16
+    python benchmark.py render --emails 3000
+    python benchmark.py mime --recipients 10000 --per-transaction 1,50
+    python benchmark.py matrix --cities 10000
+    python benchmark.py rules --subscribers 100000
+    python benchmark.py sources --latency 0.02
+    python benchmark.py outbox --recipients 5000
+    python benchmark.py smtp --messages 500
+    python benchmark.py e2e --sizes 1,10,100,1000 --output results.json
+    python benchmark.py compare old.json new.json
+    python benchmark.py startup --repeat 10
+    python benchmark.py faults --cities 50
+    python benchmark.py stream --cities 50 --tail-kb 200
+    python benchmark.py serve --concurrency 50 --duration 5
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import logging
+import os
+import platform
+import socket
+import socketserver
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Bytes the stub server writes at a time when its bandwidth is limited
+STUB_CHUNK_SIZE = 4096
+
+def load_fixtures():
+    """
+    Load all recorded pages from the fixtures directory
+
+    Returns:
+        list: Page contents (bytes), sorted by file name
+    """
+    return [load_fixture(os.path.basename(path)) for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html')))]
+
+def load_fixture(name='pollen_berlin.html'):
+    """
+    Load a recorded page from the fixtures directory
+
+    Args:
+        name (str): Fixture file name
+
+    Returns:
+        bytes: Page content
+    """
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    # Clients that time out or give up close their connection early, that is expected here
+    def handle_error(self, request, client_address):
+        pass
+
+class StubPollenServer:
+    """
+    Local HTTP server that serves recorded pollen pages
+
+    Every /pollen/<city> request gets one of the pages, always the same one
+    for a given city. Pages carry an ETag, and conditional requests that
+    match it are answered with 304 Not Modified.
+
+    A `fault` callback can inject failures. It gets the request path and
+    the number of requests seen for that path so far (starting at 1) and
+    returns None to answer normally, or a dict with any of 'delay'
+    (seconds to stall first), 'status' and 'headers' (answer with that
+    status and an empty body), 'close' (drop the connection without
+    answering) and 'truncate' (send only that many bytes of the page and
+    drop the connection).
+
+    Args:
+        body (bytes): Page served for every city, defaults to the Berlin fixture
+        latency (float): Seconds to wait before answering each request
+        pages (list): Pages to spread over the cities, overrides `body`
+        fault (callable): Fault injection callback, see above
+        bandwidth (float): Bytes per second per response, None for no limit
+    """
+
+    def __init__(self, body=None, latency=0.0, pages=None, fault=None, bandwidth=None):
+        self.pages = pages or [body if body is not None else load_fixture()]
+        self.etags = ['"%s"' % hashlib.sha1(page).hexdigest() for page in self.pages]
+        self.latency = latency
+        self.fault = fault
+        self.bandwidth = bandwidth
+        self.path_requests = {}
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    count = stub.path_requests[self.path] = stub.path_requests.get(self.path, 0) + 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                fault = stub.fault(self.path, count) if stub.fault else None
+                if fault:
+                    if fault.get('delay'):
+                        time.sleep(fault['delay'])
+                    if fault.get('close'):
+                        self.close_connection = True
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                        return
+                    if fault.get('status'):
+                        self.send_response(fault['status'])
+                        for name, value in fault.get('headers', {}).items():
+                            self.send_header(name, value)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                index = zlib.crc32(self.path.encode('utf-8')) % len(stub.pages)
+                body, etag = stub.pages[index], stub.etags[index]
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                if fault and fault.get('truncate') is not None:
+                    self.wfile.write(body[:fault['truncate']])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                if not stub.bandwidth:
+                    self.wfile.write(body)
+                    with stub._lock:
+                        stub.bytes_sent += len(body)
+                    return
+                # Trickle the page out, clients may hang up before the end
+                for start in range(0, len(body), STUB_CHUNK_SIZE):
+                    chunk = body[start:start + STUB_CHUNK_SIZE]
+                    try:
+                        self.wfile.write(chunk)
+                    except OSError:
+                        self.close_connection = True
+                        return
+                    with stub._lock:
+                        stub.bytes_sent += len(chunk)
+                    time.sleep(len(chunk) / stub.bandwidth)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _QuietHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/pollen"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+class SMTPSink:
+    """
+    Local SMTP server that accepts and discards every message
+
+    It speaks enough SMTP for smtplib: EHLO/HELO, AUTH PLAIN (any
+    credentials), MAIL, RCPT, DATA, RSET, NOOP and QUIT. No TLS, so clients
+    must connect without SSL and STARTTLS.
+
+    Args:
+        latency (float): Seconds to wait before every reply, to mimic network round trips
+        drop_after (int): Answer 421 and close the connection after this many
+            messages on one connection, None to never drop
+    """
+
+    def __init__(self, latency=0.0, drop_after=None):
+        self.latency = latency
+        self.drop_after = drop_after
+        self.connections = 0
+        self.logins = 0
+        self.messages = 0
+        self.recipients = 0
+        self._lock = threading.Lock()
+
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                if sink.latency:
+                    time.sleep(sink.latency)
+                self.wfile.write(line.encode('ascii') + b'\r\n')
+
+            def handle(self):
+                with sink._lock:
+                    sink.connections += 1
+                sent = 0
+                self.reply('220 sink ESMTP')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode('ascii', 'replace').strip()
+                    verb = command.split(' ', 1)[0].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-sink\r\n250-8BITMIME\r\n250 AUTH PLAIN')
+                    elif verb == 'HELO':
+                        self.reply('250 sink')
+                    elif verb == 'AUTH':
+                        with sink._lock:
+                            sink.logins += 1
+                        self.reply('235 Authentication successful')
+                    elif verb == 'MAIL':
+                        if sink.drop_after is not None and sent >= sink.drop_after:
+                            self.reply('421 Too many messages, closing connection')
+                            return
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        with sink._lock:
+                            sink.recipients += 1
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        while self.rfile.readline() not in (b'.\r\n', b''):
+                            pass
+                        sent += 1
+                        with sink._lock:
+                            sink.messages += 1
+                        self.reply('250 OK queued')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('250 OK')
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def email_config(self, **overrides):
+        """
+        Email configuration for sending to this sink
+
+        Returns:
+            dict: Email configuration
+        """
+        config = {
+            'email_from': 'alert@example.com',
+            'email_to': 'someone@example.com',
+            'email_password': 'secret',
+            'smtp_server': '127.0.0.1',
+            'smtp_port': str(self.port),
+            'use_ssl': False,
+            'use_starttls': False,
+            'smtp_auth_required': True,
+            'sender_name': 'Pollen Alert',
+            'city': 'berlin',
+            'language': 'en',
+        }
+        config.update(overrides)
+        return config
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def bench_fetch(n_cities=100, latency=0.02, max_workers=16):
+    """
+    Compare the one-city-at-a-time loop with scrape_many
+
+    Args:
+        n_cities (int): Number of cities to scrape
+        latency (float): Simulated server latency per request in seconds
+        max_workers (int): Worker threads for scrape_many
+
+    Returns:
+        dict: Timings and connection counts for both modes
+    """
+    import requests
+    import pollen_scraper
+
+    cities = [f"city{i}" for i in range(n_cities)]
+    results = {}
+
+    with StubPollenServer(latency=latency) as stub:
+        pollen_scraper.POLLEN_BASE_URL = stub.base_url
+
+        # Old behaviour: one bare requests.get per city, one after another
+        start = time.perf_counter()
+        for city in cities:
+            pollen_scraper.scrape_pollen_data(city, session=requests)
+        results['loop'] = {'seconds': time.perf_counter() - start, 'connections': stub.connections}
+
+        stub.connections = 0
+        start = time.perf_counter()
+        pollen_scraper.scrape_many(cities, max_workers=max_workers)
+        results['scrape_many'] = {'seconds': time.perf_counter() - start, 'connections': stub.connections}
+
+    return results
+
+def bench_faults(n_cities=50, max_workers=8):
+    """
+    Run scrape_many against injected server faults, with and without the fetch policy
+
+    Scenarios:
+        flaky: every third page answers 503 twice before it works
+        throttled: every page answers 429 with Retry-After: 1 once
+        stalled: every fifth page stalls for 5 seconds once
+        dropped: every fourth page drops the connection once
+        down: every request answers 500
+        deadline: every request takes 0.5 seconds, with a 2 second deadline
+
+    Args:
+        n_cities (int): Cities per scenario
+        max_workers (int): Worker threads for scrape_many
+
+    Returns:
+        dict: Per scenario and mode ('policy' or 'no retries') the seconds,
+            pages scraped, failed pages and requests the server saw
+    """
+    import pollen_fetch
+    import pollen_scraper
+
+    def every(k, path):
+        return zlib.crc32(path.encode('utf-8')) % k == 0
+
+    scenarios = {
+        'flaky': (0.0, lambda path, n: {'status': 503} if n <= 2 and every(3, path) else None, None),
+        'throttled': (0.0, lambda path, n: {'status': 429, 'headers': {'Retry-After': '1'}} if n == 1 else None, None),
+        'stalled': (0.0, lambda path, n: {'delay': 5} if n == 1 and every(5, path) else None, None),
+        'dropped': (0.0, lambda path, n: {'close': True} if n == 1 and every(4, path) else None, None),
+        'down': (0.0, lambda path, n: {'status': 500}, None),
+        'deadline': (0.5, None, 2.0),
+    }
+    cities = [f"city{i}" for i in range(n_cities)]
+    results = {}
+    for name, (latency, fault, deadline) in scenarios.items():
+        results[name] = {}
+        policies = {
+            'policy': pollen_fetch.FetchPolicy(connect_timeout=1, read_timeout=1, max_retries=3, backoff=0.05,
+                                               deadline=deadline, breaker=pollen_fetch.CircuitBreaker()),
+            'no retries': pollen_fetch.FetchPolicy(connect_timeout=1, read_timeout=1, max_retries=0, deadline=deadline),
+        }
+        for mode, policy in policies.items():
+            with StubPollenServer(latency=latency, fault=fault) as stub:
+                pollen_scraper.POLLEN_BASE_URL = stub.base_url
+                # A fresh session per run, so connections dropped by one scenario do not leak into the next
+                pollen_scraper._http_session = None
+                start = time.perf_counter()
+                scraped = pollen_scraper.scrape_many(cities, max_workers=max_workers, policy=policy)
+                results[name][mode] = {
+                    'seconds': time.perf_counter() - start,
+                    'ok': sum(1 for data in scraped if 'error' not in data),
+                    'failed': sum(1 for data in scraped if 'error' in data),
+                    'requests': stub.requests,
+                }
+    return results
+
+def bench_parse_workers(n_pages=400, workers=(0, 1, 2, 4, 8, 16), latency=0.02, max_workers=16):
+    """
+    Parse throughput and scrape_many wall time by number of parse processes
+
+    The recorded fixture pages are parsed `n_pages` times in total, first in
+    this thread (0 workers) and then spread over the process pool. The pool
+    is started and warmed up before the clock starts. Then the same number
+    of cities is scraped from the stub server, with parsing in the download
+    threads and in the pool. Every run must produce the same results,
+    otherwise an AssertionError is raised.
+
+    Args:
+        n_pages (int): Pages parsed per run, also the number of cities
+        workers (tuple): Worker process counts to try, 0 parses in-thread
+        latency (float): Simulated server latency per request in seconds
+        max_workers (int): Download threads for scrape_many
+
+    Returns:
+        dict: Worker count -> 'parse' (pages/s) and 'scrape' (seconds)
+    """
+    import pollen_parser
+    import pollen_scraper
+
+    fixtures = [page.decode('utf-8') for page in load_fixtures()]
+    pages = [fixtures[i % len(fixtures)] for i in range(n_pages)]
+    engine = pollen_parser.resolve_engine()
+    expected = [pollen_parser.parse_pollen_page(page, engine) for page in fixtures]
+    cities = [f"city{i}" for i in range(n_pages)]
+    results = {}
+    reference = None
+
+    with StubPollenServer(latency=latency, pages=load_fixtures()) as stub:
+        pollen_scraper.POLLEN_BASE_URL = stub.base_url
+        for count in workers:
+            pool = pollen_parser.get_pool(count)
+            if pool is None:
+                start = time.perf_counter()
+                parsed = [pollen_parser.parse_pollen_page(page, engine) for page in pages]
+            else:
+                # Start and warm up every worker (imports, engine) outside the measurement
+                list(pool.map(pollen_parser.parse_in_worker, fixtures * count, [engine] * (len(fixtures) * count)))
+                start = time.perf_counter()
+                parsed = [page for page, _, _ in pool.map(pollen_parser.parse_in_worker, pages, [engine] * n_pages,
+                                                           chunksize=4)]
+            parse_seconds = time.perf_counter() - start
+            assert parsed == [expected[i % len(fixtures)] for i in range(n_pages)], count
+
+            start = time.perf_counter()
+            scraped = pollen_scraper.scrape_many(cities, max_workers=max_workers, parse_workers=count)
+            scrape_seconds = time.perf_counter() - start
+            if reference is None:
+                reference = scraped
+            assert scraped == reference, count
+            results[count] = {'parse': n_pages / parse_seconds, 'scrape': scrape_seconds}
+    pollen_parser.shutdown_pool()
+    return results
+
+def bench_stream(n_cities=50, bandwidth=2_000_000, tail_kb=0, max_workers=8):
+    """
+    Compare full downloads with streaming that stops after the pollen section
+
+    Both modes must produce the same results, otherwise an AssertionError
+    is raised.
+
+    Args:
+        n_cities (int): Number of cities to scrape
+        bandwidth (float): Bytes per second the stub sends per response
+        tail_kb (int): Kilobytes of markup appended to every fixture page,
+            like the scripts and footer after the pollen section of a live page
+        max_workers (int): Worker threads for scrape_many
+
+    Returns:
+        dict: Mode -> 'seconds', 'bytes_sent' (by the server) and
+            'bytes_per_city' (downloaded per city, from the metrics)
+    """
+    import pollen_fetch
+    import pollen_scraper
+    from pollen_metrics import METRICS
+
+    tail = ('<script>' + 'x' * 1000 + '</script>\n').encode('utf-8') * tail_kb
+    pages = [page.replace(b'</body>', tail + b'</body>') for page in load_fixtures()]
+    cities = [f"city{i}" for i in range(n_cities)]
+    results = {}
+    reference = None
+
+    for mode, stream in (('full', False), ('stream', True)):
+        with StubPollenServer(pages=pages, bandwidth=bandwidth) as stub:
+            pollen_scraper.POLLEN_BASE_URL = stub.base_url
+            pollen_scraper._http_session = None
+            METRICS.reset()
+            policy = pollen_fetch.FetchPolicy(stream=stream)
+            start = time.perf_counter()
+            scraped = pollen_scraper.scrape_many(cities, max_workers=max_workers, policy=policy)
+            seconds = time.perf_counter() - start
+            downloaded = sum(c['value'] for c in METRICS.snapshot()['counters'] if c['name'] == 'download_bytes')
+            results[mode] = {'seconds': seconds, 'bytes_sent': stub.bytes_sent, 'bytes_per_city': downloaded / n_cities}
+        if reference is None:
+            reference = scraped
+        assert scraped == reference, mode
+    return results
+
+def bench_matrix(n_cities=10000, repeat=10):
+    """
+    Compare aggregating scrape results as dicts with the pollen matrix
+
+    The fixture pages are parsed once and repeated to `n_cities` results,
+    spread over the cities of the index so every federal state has some.
+    Both ways compute the highest and mean level per state and pollen type
+    and the top 10 cities per type, and must agree.
+
+    Args:
+        n_cities (int): Scrape results to aggregate
+        repeat (int): Runs of every aggregation
+
+    Returns:
+        dict: Milliseconds per operation, and the size of the results as
+            JSON and as a matrix file
+    """
+    import json
+    import tempfile
+    import pollen_cities
+    import pollen_scraper
+    from pollen_matrix import POLLEN_TYPES, PollenMatrix
+
+    pages = [pollen_scraper.extract_pollen_data(page.decode('utf-8'), 'berlin') for page in load_fixtures()]
+    slugs = sorted(pollen_cities.load_index()['cities'])
+    results = [dict(pages[i % len(pages)], city=slugs[i % len(slugs)]) for i in range(n_cities)]
+    timings = {}
+
+    def timed(name, fn):
+        value = fn()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        timings[name] = (time.perf_counter() - start) * 1000 / repeat
+        return value
+
+    def dict_states():
+        levels = {}
+        for data in results:
+            state = pollen_cities.city_info(data['city'])['state']
+            for item in data['pollen_items']:
+                levels.setdefault((state, item['type']), []).append(int(item['concentration']))
+        return {key: (max(values), sum(values) / len(values)) for key, values in levels.items()}
+
+    def dict_hotspots():
+        return {
+            pollen_type: sorted(((data['city'], int(item['concentration'])) for data in results
+                                 for item in data['pollen_items'] if item['type'] == pollen_type and item['concentration'] != '0'),
+                                key=lambda pair: -pair[1])[:10]
+            for pollen_type in POLLEN_TYPES
+        }
+
+    reference = timed('dicts: state max and mean', dict_states)
+    hotspots = timed('dicts: top 10 per type', dict_hotspots)
+    matrix = timed('matrix: build from results', lambda: PollenMatrix.from_results(results))
+    matrix.states()
+    states, highest = timed('matrix: state max', matrix.state_max)
+    _, means = timed('matrix: state mean', matrix.state_mean)
+    assert timed('matrix: top 10 per type', matrix.hotspots) == hotspots
+    for (state, pollen_type), (top, mean) in reference.items():
+        row, column = states.index(state), POLLEN_TYPES.index(pollen_type)
+        assert highest[row, column] == top and abs(means[row, column] - mean) < 1e-4, (state, pollen_type)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'results.json')
+        matrix_path = os.path.join(tmp, 'national.pollen')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False)
+        matrix.save(matrix_path)
+
+        def read_json():
+            with open(json_path, encoding='utf-8') as f:
+                return json.load(f)
+
+        timed('json: load results', read_json)
+        timed('matrix: open memory map', lambda: PollenMatrix.load(matrix_path))
+        sizes = {'json_bytes': os.path.getsize(json_path), 'matrix_bytes': os.path.getsize(matrix_path)}
+    return {'ms': timings, 'sizes': sizes}
+
+def bench_rules(n_subscribers=100000, repeat=5):
+    """
+    Compare evaluating every subscriber's alert rule with the rule index
+
+    Subscribers are spread over the cities of the index with rules drawn
+    from a fixed mix (one condition, "or", "and", and no rule at all), and
+    every city gets random levels. Both ways must select the same subscribers.
+
+    Args:
+        n_subscribers (int): Subscribers with (mostly) a rule
+        repeat (int): Runs of every matching pass
+
+    Returns:
+        dict: Milliseconds per operation, and the number of matched subscribers
+    """
+    import random
+    import pollen_cities
+    from pollen_rules import RuleIndex, city_levels, parse_rule, rule_matches
+    from pollen_templates import POLLEN_TRANSLATIONS
+
+    rng = random.Random(0)
+    types = sorted(POLLEN_TRANSLATIONS)
+    slugs = sorted(pollen_cities.load_index()['cities'])
+    patterns = [
+        lambda: f"{rng.choice(types)} >= {rng.randint(1, 3)}",
+        lambda: f"{rng.choice(types)} ≥ {rng.randint(1, 3)} or {rng.choice(types)} ≥ {rng.randint(1, 3)}",
+        lambda: f"{rng.choice(types)} > {rng.randint(0, 2)} and {rng.choice(types)} >= {rng.randint(1, 3)}",
+        lambda: None,
+    ]
+    subscribers = []
+    for i in range(n_subscribers):
+        subscriber = {'email': f"user{i}@example.com", 'city': rng.choice(slugs), 'language': 'de'}
+        rules = rng.choice(patterns)()
+        if rules:
+            subscriber['rules'] = rules
+        subscribers.append(subscriber)
+    pollen_data = {
+        city: {'city': city, 'pollen_items': [{'type': pollen_type, 'concentration': str(rng.choice([0, 0, 1, 1, 2, 3]))}
+                                              for pollen_type in types]}
+        for city in slugs
+    }
+    timings = {}
+
+    def timed(name, fn, runs=repeat):
+        start = time.perf_counter()
+        for _ in range(runs):
+            value = fn()
+        timings[name] = (time.perf_counter() - start) * 1000 / runs
+        return value
+
+    def naive():
+        levels = {city: city_levels(data) for city, data in pollen_data.items()}
+        return [subscriber for subscriber in subscribers
+                if not subscriber.get('rules') or rule_matches(parse_rule(subscriber['rules']), levels[subscriber['city']])]
+
+    parse_rule.cache_clear()
+    timed('parse rules (cold)', lambda: [parse_rule(s['rules']) for s in subscribers if 'rules' in s], runs=1)
+    reference = timed('every rule per subscriber', naive)
+    index = timed('index: compile', lambda: RuleIndex(subscribers))
+    matched = timed('index: match', lambda: index.match(pollen_data))
+    assert matched == reference
+    return {'ms': timings, 'matched': len(matched)}
+
+def bench_sources(latency=0.02, max_workers=16):
+    """
+    Compare the wetteronline pages with the DWD feed for every city of the index
+
+    Both sources are served locally, the pages from the recorded fixtures
+    and the feed from the saved copy in fixtures/dwd_s31fg.json.
+
+    Args:
+        latency (float): Simulated server latency per request in seconds
+        max_workers (int): Worker threads for scrape_many
+
+    Returns:
+        dict: Per source the time, requests and bytes of one batch, and the
+            number of cities that came back with pollen data
+    """
+    import datetime
+    import pollen_cities
+    import pollen_scraper
+    from pollen_dwd import DWDSource
+
+    cities = sorted(pollen_cities.load_index()['cities'])
+    with open(os.path.join(FIXTURES_DIR, 'dwd_s31fg.json'), 'rb') as f:
+        feed = f.read()
+    issued = datetime.date.fromisoformat(json.loads(feed)['last_update'].split()[0])
+    results = {}
+
+    def run(name, stub, source):
+        start = time.perf_counter()
+        scraped = source.scrape_many(cities, max_workers=max_workers)
+        results[name] = {'seconds': time.perf_counter() - start, 'requests': stub.requests,
+                         'bytes': stub.bytes_sent, 'ok': sum('error' not in data for data in scraped)}
+        stub.requests = stub.bytes_sent = 0
+
+    with StubPollenServer(pages=load_fixtures(), latency=latency) as stub:
+        pollen_scraper.POLLEN_BASE_URL = stub.base_url
+        run('wetteronline', stub, pollen_scraper.WetterOnlineSource())
+
+    with StubPollenServer(body=feed, latency=latency) as stub:
+        source = DWDSource(url=f"{stub.base_url}/s31fg.json", today=issued)
+        run('dwd', stub, source)
+        run('dwd (loaded)', stub, source)
+    return results
+
+def bench_cache(n_cities=100, latency=0.02):
+    """
+    Measure cold, revalidating and fresh runs through the response cache
+
+    Args:
+        n_cities (int): Number of cities to scrape
+        latency (float): Simulated server latency per request in seconds
+
+    Returns:
+        dict: Timings, bytes downloaded and cache counters per run
+    """
+    import tempfile
+    import pollen_scraper
+    from pollen_cache import ResponseCache
+
+    cities = [f"city{i}" for i in range(n_cities)]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp, StubPollenServer(latency=latency) as stub:
+        pollen_scraper.POLLEN_BASE_URL = stub.base_url
+        cache = ResponseCache(os.path.join(tmp, 'cache.sqlite'))
+
+        # cold: empty cache, revalidate: every entry is stale, fresh: served from disk
+        for run, fresh_for in (('cold', 0), ('revalidate', 0), ('fresh', 3600)):
+            cache.fresh_for = fresh_for
+            cache.stats = dict.fromkeys(cache.stats, 0)
+            stub.bytes_sent = stub.requests = 0
+            start = time.perf_counter()
+            for city in cities:
+                pollen_scraper.scrape_pollen_data(city, cache=cache)
+            results[run] = {
+                'seconds': time.perf_counter() - start,
+                'requests': stub.requests,
+                'bytes_downloaded': stub.bytes_sent,
+                'cache': dict(cache.stats),
+            }
+        cache.close()
+
+    return results
+
+def bench_parse(repeat=50):
+    """
+    Time every parser engine on the recorded fixture pages
+
+    The engines must agree on every page, otherwise an AssertionError is raised.
+
+    Args:
+        repeat (int): Number of parses per page and engine
+
+    Returns:
+        dict: Milliseconds per page for each engine
+    """
+    import pollen_parser
+
+    pages = [page.decode('utf-8') for page in load_fixtures()]
+    engines = [name for name in pollen_parser.ENGINES if name != 'lxml' or pollen_parser.resolve_engine('auto') == 'lxml']
+
+    expected = [pollen_parser.parse_pollen_page(page, engine='html.parser') for page in pages]
+    results = {}
+    for engine in engines:
+        for page, reference in zip(pages, expected):
+            assert pollen_parser.parse_pollen_page(page, engine=engine) == reference, engine
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                pollen_parser.parse_pollen_page(page, engine=engine)
+        results[engine] = (time.perf_counter() - start) * 1000 / (repeat * len(pages))
+    return results
+
+def bench_smtp(n_messages=500, latency=0.002, connections=(1, 2, 4), messages_per_connection=100):
+    """
+    Compare one connection per email with the SMTP connection pool
+
+    Args:
+        n_messages (int): Number of emails to send
+        latency (float): Simulated delay before every SMTP reply in seconds
+        connections (tuple): Pool sizes to measure
+        messages_per_connection (int): Messages per pooled connection
+
+    Returns:
+        dict: Seconds, messages per second, connections and logins per mode
+    """
+    import pollen_scraper
+    from pollen_smtp import SMTPPool
+
+    data = pollen_scraper.extract_pollen_data(load_fixture().decode('utf-8'), 'berlin')
+    content = pollen_scraper.format_email_content(data, 'en')
+    results = {}
+
+    def measure(mode, send_all):
+        with SMTPSink(latency=latency) as sink:
+            start = time.perf_counter()
+            send_all(sink)
+            seconds = time.perf_counter() - start
+            assert sink.messages == n_messages, (mode, sink.messages)
+            results[mode] = {
+                'seconds': seconds,
+                'messages_per_second': n_messages / seconds,
+                'connections': sink.connections,
+                'logins': sink.logins,
+            }
+
+    def one_connection_each(sink):
+        config = sink.email_config()
+        for _ in range(n_messages):
+            pollen_scraper.send_email(content, config)
+    measure('per-email', one_connection_each)
+
+    for size in connections:
+        def pooled(sink):
+            config = sink.email_config()
+            messages = [pollen_scraper.build_message(content, config) for _ in range(n_messages)]
+            with SMTPPool(config, max_connections=size, max_messages_per_connection=messages_per_connection) as pool:
+                errors = pool.send_batch(messages)
+            assert not any(errors), errors
+        measure(f'pool x{size}', pooled)
+
+    return results
+
+def bench_mime(n_recipients=10000, per_transaction=(1, 50), send=True, smtp_connections=4):
+    """
+    Compare building every message with serializing it once per body
+
+    The CPU time to build and serialize the messages for `n_recipients`
+    recipients of one body is measured the old way (build_message and the
+    flattening smtplib.send_message does, per recipient) and with
+    pollen_mime.PreparedMessage (one serialization, per-recipient headers
+    only). With `send`, the messages also go through the SMTP pool to the
+    local sink, one recipient per transaction and then several; the CPU
+    time of sending includes the sink, which runs in this process.
+
+    Args:
+        n_recipients (int): Recipients of the same body
+        per_transaction (tuple): Recipients per SMTP transaction to send with
+        send (bool): Also send through the local SMTP sink
+        smtp_connections (int): Pooled SMTP connections
+
+    Returns:
+        dict: Mode -> 'cpu_seconds', 'us_per_message', and when sending
+            'seconds', 'transactions' and 'recipients'
+    """
+    from email.generator import BytesGenerator
+    from io import BytesIO
+    import pollen_scraper
+    from pollen_mime import split_recipients
+    from pollen_smtp import SMTPPool
+
+    data = pollen_scraper.extract_pollen_data(load_fixture().decode('utf-8'), 'berlin')
+    content = pollen_scraper.format_email_content(data, 'de', 3)
+    recipients = [f"user{i}@example.com" for i in range(n_recipients)]
+    config = {'email_from': 'alert@example.com', 'sender_name': 'Pollen Alert', 'city': 'berlin', 'language': 'de'}
+    results = {}
+
+    def build_each():
+        for email in recipients:
+            msg = pollen_scraper.build_message(content, dict(config, email_to=email))
+            policy = msg.policy.clone(linesep='\r\n')
+            BytesGenerator(BytesIO(), policy=policy).flatten(msg, linesep='\r\n')
+
+    def prepared(plain_text):
+        def run():
+            msg = pollen_scraper.prepare_message(content, dict(config, plain_text=plain_text))
+            for email in recipients:
+                msg.render(email)
+        return run
+
+    for mode, run in [('build per recipient', build_each), ('prepared', prepared(False)),
+                      ('prepared + text', prepared(True))]:
+        start = time.process_time()
+        run()
+        cpu = time.process_time() - start
+        results[mode] = {'cpu_seconds': cpu, 'us_per_message': cpu / n_recipients * 1e6}
+
+    if send:
+        def send_built(pool):
+            return pool.send_batch([pollen_scraper.build_message(content, dict(config, email_to=email))
+                                    for email in recipients])
+
+        def send_prepared(size):
+            def run(pool):
+                msg = pollen_scraper.prepare_message(content, config)
+                return pool.send_batch([(msg, to_addrs) for to_addrs in split_recipients(recipients, size)])
+            return run
+
+        modes = [('send built', send_built)]
+        modes += [(f'send prepared x{size}', send_prepared(size)) for size in per_transaction]
+        for mode, run in modes:
+            with SMTPSink() as sink:
+                smtp_config = sink.email_config()
+                with SMTPPool(smtp_config, max_connections=smtp_connections,
+                              max_messages_per_connection=n_recipients) as pool:
+                    start, cpu_start = time.perf_counter(), time.process_time()
+                    errors = run(pool)
+                    seconds, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+                assert not any(errors), errors
+                assert sink.recipients == n_recipients, (mode, sink.recipients)
+                results[mode] = {
+                    'seconds': seconds,
+                    'cpu_seconds': cpu,
+                    'us_per_message': cpu / n_recipients * 1e6,
+                    'transactions': sink.messages,
+                    'recipients': sink.recipients,
+                }
+    return results
+
+def bench_outbox(n_recipients=5000, smtp_connections=4, batch_size=100):
+    """
+    Measure the cost of sending through the durable outbox
+
+    The same prepared email goes to `n_recipients` recipients through the
+    SMTP pool directly, and through the outbox (enqueue, then drain in
+    batches). A second run through the outbox must not send anything again.
+
+    Args:
+        n_recipients (int): Recipients of the same body
+        smtp_connections (int): Pooled SMTP connections
+        batch_size (int): Messages per outbox batch
+
+    Returns:
+        dict: Mode -> 'seconds' and 'messages' (emails the sink received),
+            plus the enqueue and drain seconds of the outbox run
+    """
+    import tempfile
+    import pollen_scraper
+    from pollen_outbox import Outbox
+    from pollen_smtp import SMTPPool
+
+    data = pollen_scraper.extract_pollen_data(load_fixture().decode('utf-8'), 'berlin')
+    content = pollen_scraper.format_email_content(data, 'en')
+    results = {}
+
+    with SMTPSink() as sink, tempfile.TemporaryDirectory() as tmp:
+        config = sink.email_config()
+        message = pollen_scraper.prepare_message(content, config)
+        transactions = [(message, [f"user{i}@example.com"]) for i in range(n_recipients)]
+        with SMTPPool(config, max_connections=smtp_connections, max_messages_per_connection=n_recipients) as pool:
+            start = time.perf_counter()
+            assert not any(pool.send_batch(transactions))
+            results['direct'] = {'seconds': time.perf_counter() - start, 'messages': sink.messages}
+
+            with Outbox(os.path.join(tmp, 'outbox.sqlite'), batch_size=batch_size) as outbox:
+                for mode in ('outbox', 'outbox again'):
+                    before = sink.messages
+                    start = time.perf_counter()
+                    outbox.enqueue_many(transactions)
+                    enqueued = time.perf_counter()
+                    stats = outbox.drain(pool)
+                    assert not stats['failed'] and not stats['retried'], stats
+                    results[mode] = {
+                        'seconds': time.perf_counter() - start,
+                        'enqueue_seconds': enqueued - start,
+                        'drain_seconds': time.perf_counter() - enqueued,
+                        'messages': sink.messages - before,
+                    }
+    return results
+
+def bench_render(n_emails=3000, languages=('en', 'de', 'zh')):
+    """
+    Measure the per-email render cost of format_email_content
+
+    Args:
+        n_emails (int): Emails rendered per language
+        languages (tuple): Languages to render
+
+    Returns:
+        dict: Microseconds per email for each language
+    """
+    import pollen_scraper
+
+    data = pollen_scraper.extract_pollen_data(load_fixture().decode('utf-8'), 'berlin')
+    results = {}
+    for language in languages:
+        # The first call compiles the template, the rest reuse it
+        pollen_scraper.format_email_content(data, language)
+        start = time.perf_counter()
+        for _ in range(n_emails):
+            pollen_scraper.format_email_content(data, language)
+        results[language] = (time.perf_counter() - start) * 1e6 / n_emails
+    return results
+
+def bench_e2e(sizes=(1, 10, 100, 1000), latency=0.0, smtp_latency=0.0, max_workers=16, smtp_connections=4):
+    """
+    Time fetch, parse, render and send separately for growing batches
+
+    For every size n, n cities are fetched from the local HTTP server and
+    parsed, and n recipients (spread over the cities and the three
+    languages) get an email through the local SMTP sink. The whole
+    subscriber pipeline is timed as well.
+
+    Args:
+        sizes (tuple): Batch sizes (number of cities and of recipients)
+        latency (float): Simulated HTTP latency per request in seconds
+        smtp_latency (float): Simulated delay before every SMTP reply in seconds
+        max_workers (int): Concurrent fetches
+        smtp_connections (int): Pooled SMTP connections
+
+    Returns:
+        list: One dict per size with the seconds spent in every stage
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import pollen_scraper
+    from pollen_smtp import SMTPPool
+
+    languages = ('en', 'de', 'zh')
+    results = []
+
+    with StubPollenServer(latency=latency, pages=load_fixtures()) as stub, SMTPSink(latency=smtp_latency) as sink:
+        pollen_scraper.POLLEN_BASE_URL = stub.base_url
+        config = sink.email_config()
+        session = pollen_scraper.get_http_session()
+
+        for n in sizes:
+            cities = [f"city{i}" for i in range(n)]
+            subscribers = [
+                {'email': f"user{i}@example.com", 'city': cities[i % n], 'language': languages[i % len(languages)]}
+                for i in range(n)
+            ]
+            row = {'cities': n, 'recipients': n}
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                bodies = list(executor.map(lambda city: session.get(pollen_scraper.pollen_url(city)).text, cities))
+            row['fetch_seconds'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            parsed = [pollen_scraper.extract_pollen_data(body, city) for city, body in zip(cities, bodies)]
+            row['parse_seconds'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            contents = [pollen_scraper.format_email_content(parsed[i % n], s['language']) for i, s in enumerate(subscribers)]
+            row['render_seconds'] = time.perf_counter() - start
+
+            messages = [
+                pollen_scraper.build_message(content, dict(config, email_to=s['email'], city=s['city'], language=s['language']))
+                for content, s in zip(contents, subscribers)
+            ]
+            start = time.perf_counter()
+            with SMTPPool(config, max_connections=smtp_connections) as pool:
+                errors = pool.send_batch(messages)
+            row['send_seconds'] = time.perf_counter() - start
+            assert not any(errors), errors
+
+            start = time.perf_counter()
+            with SMTPPool(config, max_connections=smtp_connections) as pool:
+                stats = pollen_scraper.dispatch_subscribers(subscribers, config, max_workers=max_workers, pool=pool)
+            row['pipeline_seconds'] = time.perf_counter() - start
+            row['pipeline'] = stats
+            assert not stats['failed'], stats['failed']
+
+            results.append(row)
+
+    return results
+
+# Modules pollen_scraper used to import at load time, before imports were deferred
+EAGER_IMPORTS = (
+    'requests, requests.adapters, smtplib, email.mime.multipart, email.mime.text, email.utils, '
+    'concurrent.futures, pollen_cache, pollen_subscribers, pollen_smtp, pollen_templates, '
+    'pollen_history, pollen_delta, pollen_schedule'
+)
+
+def parse_importtime(stderr):
+    """
+    Sum up the output of python -X importtime
+
+    Args:
+        stderr (str): Standard error of the measured process
+
+    Returns:
+        tuple: (total import microseconds, {module: cumulative microseconds} of top-level imports)
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented below the module that triggered them
+        if not name[1:].startswith(' '):
+            modules[name.strip()] = int(cumulative)
+    return sum(modules.values()), modules
+
+def bench_startup(repeat=10, latency=0.0):
+    """
+    Measure cold-start time of short-lived invocations in fresh interpreters
+
+    Every scenario runs in a new `python -X importtime` process. Importing
+    pollen_scraper with and without the modules it used to load eagerly
+    shows what deferring imports saves; the scrape-only and send runs
+    show the whole cost of one invocation against the local servers.
+
+    Args:
+        repeat (int): Runs per scenario, the median is reported
+        latency (float): Simulated HTTP latency per request in seconds
+
+    Returns:
+        dict: Per scenario the median wall time and import time in milliseconds
+            and the slowest top-level imports of the last run
+    """
+    import statistics
+    import subprocess
+    import tempfile
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pollen_scraper.py')
+    results = {}
+
+    with StubPollenServer(latency=latency) as stub, SMTPSink() as sink, tempfile.TemporaryDirectory() as workdir:
+        config = sink.email_config()
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(script),
+            POLLEN_BASE_URL=stub.base_url,
+            EMAIL_ADDRESS=config['email_from'],
+            RECIPIENT_EMAIL=config['email_to'],
+            EMAIL_PASSWORD=config['email_password'],
+            SMTP_SERVER=config['smtp_server'],
+            SMTP_PORT=config['smtp_port'],
+            USE_STARTTLS='false',
+        )
+        scenarios = {
+            'import eager': ['-c', f'import pollen_scraper, {EAGER_IMPORTS}'],
+            'import lazy': ['-c', 'import pollen_scraper'],
+            'scrape-only': [script, 'scrape-only', '--city', 'berlin'],
+            'send': [script, '--city', 'berlin'],
+        }
+        for name, argv in scenarios.items():
+            walls = []
+            imports = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                proc = subprocess.run([sys.executable, '-X', 'importtime'] + argv, env=env, cwd=workdir,
+                                      capture_output=True, text=True)
+                walls.append((time.perf_counter() - start) * 1000)
+                if proc.returncode != 0:
+                    raise RuntimeError(f"{name} failed: {proc.stderr[-500:]}")
+                total, modules = parse_importtime(proc.stderr)
+                imports.append(total / 1000)
+            results[name] = {
+                'wall_ms': statistics.median(walls),
+                'import_ms': statistics.median(imports),
+                'top_imports': sorted(modules.items(), key=lambda item: -item[1])[:5],
+            }
+    return results
+
+async def _http_get(reader, writer, path):
+    # One keep-alive GET, returns the status code
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('ascii'))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = next(int(line.split(b':', 1)[1]) for line in head.split(b'\r\n') if line.lower().startswith(b'content-length:'))
+    await reader.readexactly(length)
+    return int(head.split(b' ', 2)[1])
+
+async def _load(port, paths, concurrency, duration):
+    # Keep `concurrency` connections busy for `duration` seconds, returns latencies (seconds) and statuses
+    import asyncio
+
+    latencies = []
+    statuses = {}
+    end = time.perf_counter() + duration
+
+    async def client(index):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        n = index
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            status = await _http_get(reader, writer, paths[n % len(paths)])
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            n += concurrency
+        writer.close()
+
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return latencies, statuses
+
+def bench_serve(concurrency=50, duration=5.0, n_cities=20, latency=0.2, ttl=2.0):
+    """
+    Load test serve mode against the stub pollen server
+
+    The server runs in its own process. First `concurrency` clients ask for
+    the same uncached city at once, which must cost a single upstream
+    request. Then the clients read `n_cities` cities for `duration`
+    seconds; with a `ttl` shorter than that, the cities expire and are
+    refreshed in the background during the run.
+
+    Args:
+        concurrency (int): Client connections
+        duration (float): Seconds of steady load
+        n_cities (int): Cities read in the steady phase
+        latency (float): Simulated upstream latency per request in seconds
+        ttl (float): Seconds the server keeps a city fresh
+
+    Returns:
+        dict: Phase -> 'requests', 'seconds', 'requests_per_second',
+            'p50_ms', 'p99_ms', 'statuses' and 'upstream_requests'
+    """
+    import asyncio
+    import json as json_module
+    import subprocess
+    import tempfile
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pollen_scraper.py')
+    with open(os.path.join(os.path.dirname(script), 'pollen_cities.json'), encoding='utf-8') as f:
+        slugs = sorted(json_module.load(f)['cities'])
+    cold_city, cities = slugs[0], slugs[1:n_cities + 1]
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    results = {}
+    with StubPollenServer(latency=latency, pages=load_fixtures()) as stub, tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, POLLEN_BASE_URL=stub.base_url)
+        server = subprocess.Popen(
+            [sys.executable, script, 'serve', '--port', str(port), '--ttl', str(ttl), '--refresh-ahead', str(ttl / 4)],
+            env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    time.sleep(0.05)
+
+            phases = [('cold burst', [f'/pollen/{cold_city}'], latency), ('steady', [f'/pollen/{c}' for c in cities], duration)]
+            for name, paths, seconds in phases:
+                upstream_before = stub.requests
+                start = time.perf_counter()
+                latencies, statuses = asyncio.run(_load(port, paths, concurrency, seconds))
+                elapsed = time.perf_counter() - start
+                latencies.sort()
+                results[name] = {
+                    'requests': len(latencies),
+                    'seconds': elapsed,
+                    'requests_per_second': len(latencies) / elapsed,
+                    'p50_ms': latencies[len(latencies) // 2] * 1000,
+                    'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+                    'statuses': statuses,
+                    'upstream_requests': stub.requests - upstream_before,
+                }
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+def e2e_report(results, params):
+    """
+    Wrap end-to-end results with the environment they were measured in
+
+    Args:
+        results (list): Output of bench_e2e
+        params (dict): Benchmark parameters
+
+    Returns:
+        dict: JSON-serializable report
+    """
+    import subprocess
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+
+    return {
+        'benchmark': 'e2e',
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+
+def compare_reports(old, new):
+    """
+    Compare two end-to-end reports stage by stage
+
+    Args:
+        old (dict): Baseline report
+        new (dict): Report to compare
+
+    Returns:
+        list: (size, stage, old seconds, new seconds, ratio) for every stage and size present in both
+    """
+    old_rows = {row['cities']: row for row in old['results']}
+    rows = []
+    for row in new['results']:
+        base = old_rows.get(row['cities'])
+        if base is None:
+            continue
+        for key in sorted(row):
+            if key.endswith('_seconds') and key in base:
+                ratio = row[key] / base[key] if base[key] else float('inf')
+                rows.append((row['cities'], key[:-len('_seconds')], base[key], row[key], ratio))
+    return rows
+
+def main(args=None):
+    """
+    Main function
+
+    Args:
+        args (list): Command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the pollen scraper')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='Sequential loop vs. concurrent scrape_many')
+    fetch_parser.add_argument('--cities', type=int, default=100, help='Number of cities')
+    fetch_parser.add_argument('--latency', type=float, default=0.02, help='Simulated server latency in seconds')
+    fetch_parser.add_argument('--max-workers', type=int, default=16, help='Worker threads for scrape_many')
+
+    cache_parser = subparsers.add_parser('cache', help='Cold vs. revalidated vs. fresh runs through the response cache')
+    cache_parser.add_argument('--cities', type=int, default=100, help='Number of cities')
+    cache_parser.add_argument('--latency', type=float, default=0.02, help='Simulated server latency in seconds')
+
+    parse_parser = subparsers.add_parser('parse', help='Parser engines on the recorded fixture pages')
+    parse_parser.add_argument('--repeat', type=int, default=50, help='Parses per page and engine')
+
+    workers_parser = subparsers.add_parser('parse-workers', help='Parse throughput by number of parse processes')
+    workers_parser.add_argument('--pages', type=int, default=400, help='Pages parsed per run, also the number of cities')
+    workers_parser.add_argument('--workers', type=str, default='0,1,2,4,8,16',
+                                help='Comma-separated worker process counts, 0 parses in-thread')
+    workers_parser.add_argument('--latency', type=float, default=0.02, help='Simulated server latency in seconds')
+    workers_parser.add_argument('--max-workers', type=int, default=16, help='Download threads for scrape_many')
+
+    mime_parser = subparsers.add_parser('mime', help='Message built per recipient vs. serialized once')
+    mime_parser.add_argument('--recipients', type=int, default=10000, help='Recipients of the same body')
+    mime_parser.add_argument('--per-transaction', type=str, default='1,50', help='Recipients per SMTP transaction')
+    mime_parser.add_argument('--no-send', action='store_true', help='Only measure building the messages')
+
+    matrix_parser = subparsers.add_parser('matrix', help='Aggregating dicts vs. the NumPy pollen matrix')
+    matrix_parser.add_argument('--cities', type=int, default=10000, help='Scrape results to aggregate')
+    matrix_parser.add_argument('--repeat', type=int, default=10, help='Runs of every aggregation')
+
+    sources_parser = subparsers.add_parser('sources', help='One page per city vs. the national DWD feed')
+    sources_parser.add_argument('--latency', type=float, default=0.02, help='Simulated server latency in seconds')
+    sources_parser.add_argument('--max-workers', type=int, default=16, help='Worker threads for scrape_many')
+
+    rules_parser = subparsers.add_parser('rules', help='Evaluating every alert rule vs. the rule index')
+    rules_parser.add_argument('--subscribers', type=int, default=100000, help='Subscribers to match')
+    rules_parser.add_argument('--repeat', type=int, default=5, help='Runs of every matching pass')
+
+    outbox_parser = subparsers.add_parser('outbox', help='Direct pool sends vs. the durable outbox')
+    outbox_parser.add_argument('--recipients', type=int, default=5000, help='Recipients of the same body')
+    outbox_parser.add_argument('--batch-size', type=int, default=100, help='Messages per outbox batch')
+
+    render_parser = subparsers.add_parser('render', help='Per-email cost of format_email_content')
+    render_parser.add_argument('--emails', type=int, default=3000, help='Emails rendered per language')
+
+    smtp_parser = subparsers.add_parser('smtp', help='One SMTP connection per email vs. the connection pool')
+    smtp_parser.add_argument('--messages', type=int, default=500, help='Number of emails')
+    smtp_parser.add_argument('--latency', type=float, default=0.002, help='Simulated delay before every SMTP reply')
+    smtp_parser.add_argument('--messages-per-connection', type=int, default=100, help='Messages per pooled connection')
+
+    e2e_parser = subparsers.add_parser('e2e', help='Fetch, parse, render and send timings as JSON')
+    e2e_parser.add_argument('--sizes', type=str, default='1,10,100,1000', help='Comma-separated batch sizes')
+    e2e_parser.add_argument('--latency', type=float, default=0.0, help='Simulated HTTP latency in seconds')
+    e2e_parser.add_argument('--smtp-latency', type=float, default=0.0, help='Simulated delay before every SMTP reply')
+    e2e_parser.add_argument('--max-workers', type=int, default=16, help='Concurrent fetches')
+    e2e_parser.add_argument('--smtp-connections', type=int, default=4, help='Pooled SMTP connections')
+    e2e_parser.add_argument('--output', type=str, help='Write the JSON report to this file instead of stdout')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two e2e JSON reports')
+    compare_parser.add_argument('old', help='Baseline report')
+    compare_parser.add_argument('new', help='Report to compare')
+
+    faults_parser = subparsers.add_parser('faults', help='scrape_many against injected server faults')
+    faults_parser.add_argument('--cities', type=int, default=50, help='Cities per scenario')
+    faults_parser.add_argument('--max-workers', type=int, default=8, help='Worker threads for scrape_many')
+
+    stream_parser = subparsers.add_parser('stream', help='Full downloads vs. streaming up to the pollen section')
+    stream_parser.add_argument('--cities', type=int, default=50, help='Number of cities')
+    stream_parser.add_argument('--bandwidth', type=float, default=2_000_000, help='Bytes per second per response')
+    stream_parser.add_argument('--tail-kb', type=int, default=0,
+                               help='Kilobytes of markup appended after the pollen section of every page')
+    stream_parser.add_argument('--max-workers', type=int, default=8, help='Worker threads for scrape_many')
+
+    serve_parser = subparsers.add_parser('serve', help='Load test of serve mode against the stub pollen server')
+    serve_parser.add_argument('--concurrency', type=int, default=50, help='Client connections')
+    serve_parser.add_argument('--duration', type=float, default=5, help='Seconds of steady load')
+    serve_parser.add_argument('--cities', type=int, default=20, help='Cities read in the steady phase')
+    serve_parser.add_argument('--latency', type=float, default=0.2, help='Simulated upstream latency in seconds')
+    serve_parser.add_argument('--ttl', type=float, default=2, help='Seconds the server keeps a city fresh')
+
+    startup_parser = subparsers.add_parser('startup', help='Cold-start time of short-lived invocations')
+    startup_parser.add_argument('--repeat', type=int, default=10, help='Runs per scenario')
+    startup_parser.add_argument('--latency', type=float, default=0.0, help='Simulated HTTP latency in seconds')
+
+    args = parser.parse_args(args if args is not None else sys.argv[1:])
+
+    # Keep the per-item log lines (and the expected errors of the fault scenarios) out of the measurements
+    logging.disable(logging.CRITICAL)
+
+    if args.command == 'fetch':
+        results = bench_fetch(args.cities, args.latency, args.max_workers)
+        for mode, r in results.items():
+            print(f"{mode:12s} {r['seconds']:8.3f}s  {args.cities / r['seconds']:8.1f} cities/s  {r['connections']} connections")
+    elif args.command == 'cache':
+        results = bench_cache(args.cities, args.latency)
+        for run, r in results.items():
+            c = r['cache']
+            print(f"{run:12s} {r['seconds']:8.3f}s  {r['requests']:5d} requests  {r['bytes_downloaded']:10d} bytes  "
+                  f"hits={c['hits']} revalidations={c['revalidations']} misses={c['misses']} "
+                  f"parse_saved={c['parse_seconds_saved']:.3f}s")
+    elif args.command == 'parse':
+        results = bench_parse(args.repeat)
+        baseline = results['html.parser']
+        for engine, ms in results.items():
+            print(f"{engine:12s} {ms:8.2f} ms/page  {baseline / ms:5.1f}x")
+    elif args.command == 'parse-workers':
+        workers = [int(count) for count in args.workers.split(',') if count.strip()]
+        results = bench_parse_workers(args.pages, workers, args.latency, args.max_workers)
+        baseline = results[workers[0]]
+        print(f"{os.cpu_count()} CPUs")
+        for count, r in results.items():
+            print(f"{count:3d} workers {r['parse']:9.1f} pages/s  {r['parse'] / baseline['parse']:5.2f}x  "
+                  f"scrape_many {r['scrape']:7.3f}s  {baseline['scrape'] / r['scrape']:5.2f}x")
+    elif args.command == 'mime':
+        sizes = [int(size) for size in args.per_transaction.split(',') if size.strip()]
+        for mode, r in bench_mime(args.recipients, sizes, send=not args.no_send).items():
+            line = f"{mode:22s} {r['cpu_seconds']:7.2f}s CPU  {r['us_per_message']:8.1f} us/message"
+            if 'seconds' in r:
+                line += f"  {r['seconds']:6.2f}s  {r['transactions']:6d} transactions"
+            print(line)
+    elif args.command == 'matrix':
+        result = bench_matrix(args.cities, args.repeat)
+        for name, ms in result['ms'].items():
+            print(f"{name:30s} {ms:9.2f} ms")
+        print(f"results as JSON {result['sizes']['json_bytes'] / 1024:.0f} KB, "
+              f"as matrix file {result['sizes']['matrix_bytes'] / 1024:.0f} KB")
+    elif args.command == 'sources':
+        for name, r in bench_sources(args.latency, args.max_workers).items():
+            print(f"{name:13s} {r['seconds']:7.3f}s  {r['requests']:4d} requests  {r['bytes'] / 1024:8.0f} KB  "
+                  f"{r['ok']} cities with data")
+    elif args.command == 'rules':
+        result = bench_rules(args.subscribers, args.repeat)
+        for name, ms in result['ms'].items():
+            print(f"{name:30s} {ms:9.2f} ms")
+        print(f"{result['matched']} of {args.subscribers} subscribers matched")
+    elif args.command == 'outbox':
+        for mode, r in bench_outbox(args.recipients, batch_size=args.batch_size).items():
+            line = f"{mode:13s} {r['seconds']:6.2f}s  {r['messages']:6d} messages sent"
+            if 'enqueue_seconds' in r:
+                line += f"  (enqueue {r['enqueue_seconds']:.2f}s, drain {r['drain_seconds']:.2f}s)"
+            print(line)
+    elif args.command == 'render':
+        for language, us in bench_render(args.emails).items():
+            print(f"{language:4s} {us:8.1f} us/email")
+    elif args.command == 'e2e':
+        sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+        params = {
+            'sizes': sizes,
+            'latency': args.latency,
+            'smtp_latency': args.smtp_latency,
+            'max_workers': args.max_workers,
+            'smtp_connections': args.smtp_connections,
+        }
+        report = e2e_report(bench_e2e(sizes, args.latency, args.smtp_latency, args.max_workers, args.smtp_connections), params)
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+    elif args.command == 'compare':
+        with open(args.old, encoding='utf-8') as f:
+            old = json.load(f)
+        with open(args.new, encoding='utf-8') as f:
+            new = json.load(f)
+        for size, stage, before, after, ratio in compare_reports(old, new):
+            print(f"{size:6d} {stage:10s} {before:9.4f}s -> {after:9.4f}s  {ratio:6.2f}x")
+    elif args.command == 'faults':
+        for name, modes in bench_faults(args.cities, args.max_workers).items():
+            for mode, r in modes.items():
+                print(f"{name:10s} {mode:11s} {r['seconds']:7.2f}s  {r['ok']:4d} ok  {r['failed']:4d} failed  "
+                      f"{r['requests']:5d} requests")
+    elif args.command == 'stream':
+        for mode, r in bench_stream(args.cities, args.bandwidth, args.tail_kb, args.max_workers).items():
+            print(f"{mode:8s} {r['seconds']:7.2f}s  {r['bytes_per_city'] / 1024:8.1f} KB/city downloaded  "
+                  f"{r['bytes_sent'] / 1024:9.1f} KB sent by the server")
+    elif args.command == 'serve':
+        for phase, r in bench_serve(args.concurrency, args.duration, args.cities, args.latency, args.ttl).items():
+            print(f"{phase:10s} {r['requests']:7d} requests  {r['requests_per_second']:8.0f} req/s  "
+                  f"p50 {r['p50_ms']:7.2f} ms  p99 {r['p99_ms']:7.2f} ms  {r['upstream_requests']:3d} upstream requests  "
+                  f"statuses {r['statuses']}")
+    elif args.command == 'startup':
+        for name, r in bench_startup(args.repeat, args.latency).items():
+            top = ', '.join(f"{module} {us / 1000:.1f}" for module, us in r['top_imports'])
+            print(f"{name:14s} {r['wall_ms']:8.1f} ms wall  {r['import_ms']:8.1f} ms imports  ({top})")
+    elif args.command == 'smtp':
+        results = bench_smtp(args.messages, args.latency, messages_per_connection=args.messages_per_connection)
+        for mode, r in results.items():
+            print(f"{mode:12s} {r['seconds']:8.3f}s  {r['messages_per_second']:8.1f} msg/s  "
+                  f"{r['connections']} connections  {r['logins']} logins")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
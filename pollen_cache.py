@@ -0,0 +1,244 @@
+"""
+Persistent HTTP response cache for pollen pages
+
+Responses are stored in a SQLite file keyed by URL, together with the parsed
+pollen data. Stale entries are revalidated with If-None-Match /
+If-Modified-Since, and a 304 answer reuses the stored parse result without
+touching BeautifulSoup. The time each page took to parse is stored with it,
+so the counters show the parse time as well as the bytes a hit saved.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+class CacheEntry:
+    """
+    A cached response
+
+    Args:
+        url (str): Request URL
+        etag (str): ETag response header
+        last_modified (str): Last-Modified response header
+        body (bytes): Raw response body
+        parsed (dict): Parsed pollen data ('title', 'date', 'pollen_items')
+        stored_at (float): Time the entry was stored or last revalidated
+        parse_seconds (float): Time it took to parse the body
+    """
+
+    def __init__(self, url, etag, last_modified, body, parsed, stored_at, parse_seconds=0.0):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+        self.parsed = parsed
+        self.stored_at = stored_at
+        self.parse_seconds = parse_seconds
+
+    def age(self, now=None):
+        return (now or time.time()) - self.stored_at
+
+class ResponseCache:
+    """
+    On-disk response cache with TTL and LRU size eviction
+
+    Args:
+        path (str): SQLite file path
+        ttl (float): Seconds after which an entry is discarded
+        fresh_for (float): Seconds during which an entry is served without
+            contacting the server; older entries are revalidated
+        max_bytes (int): Maximum total size of stored bodies, least recently
+            used entries are evicted first
+    """
+
+    def __init__(self, path, ttl=6 * 3600, fresh_for=600, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.fresh_for = fresh_for
+        self.max_bytes = max_bytes
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'revalidations': 0,
+            'stores': 0,
+            'evictions': 0,
+            'bytes_saved': 0,
+            'parse_seconds_saved': 0.0,
+        }
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB NOT NULL,
+                parsed TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                parse_seconds REAL NOT NULL DEFAULT 0
+            )
+        """)
+        # Caches written before parse times were recorded
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}
+        if 'parse_seconds' not in columns:
+            self._db.execute("ALTER TABLE responses ADD COLUMN parse_seconds REAL NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._db.commit()
+
+    def lookup(self, url):
+        """
+        Get the cached entry for a URL
+
+        Expired entries are deleted and reported as missing.
+
+        Args:
+            url (str): Request URL
+
+        Returns:
+            CacheEntry: Cached entry, or None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, body, parsed, stored_at, parse_seconds FROM responses WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[4] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._db.commit()
+                self.stats['evictions'] += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (now, url))
+            self._db.commit()
+        return CacheEntry(url, row[0], row[1], row[2], json.loads(row[3]), row[4], row[5])
+
+    def is_fresh(self, entry):
+        """
+        Check whether an entry can be used without revalidation
+
+        Args:
+            entry (CacheEntry): Cached entry
+
+        Returns:
+            bool: True if the entry is still fresh
+        """
+        return entry.age() <= self.fresh_for
+
+    def conditional_headers(self, entry):
+        """
+        Build revalidation headers for a cached entry
+
+        Args:
+            entry (CacheEntry): Cached entry, may be None
+
+        Returns:
+            dict: If-None-Match / If-Modified-Since headers
+        """
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def record_hit(self, entry):
+        with self._lock:
+            self.stats['hits'] += 1
+            self.stats['bytes_saved'] += len(entry.body)
+            self.stats['parse_seconds_saved'] += entry.parse_seconds
+
+    def record_miss(self):
+        with self._lock:
+            self.stats['misses'] += 1
+
+    def revalidated(self, entry, response_headers=None):
+        """
+        Mark an entry as confirmed by a 304 Not Modified response
+
+        Args:
+            entry (CacheEntry): Cached entry
+            response_headers (dict): Headers of the 304 response
+        """
+        response_headers = response_headers or {}
+        now = time.time()
+        with self._lock:
+            self.stats['revalidations'] += 1
+            self.stats['bytes_saved'] += len(entry.body)
+            self.stats['parse_seconds_saved'] += entry.parse_seconds
+            self._db.execute(
+                "UPDATE responses SET stored_at = ?, accessed_at = ?, "
+                "etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (now, now, response_headers.get('ETag'), response_headers.get('Last-Modified'), entry.url)
+            )
+            self._db.commit()
+        entry.stored_at = now
+
+    def store(self, url, response_headers, body, parsed, parse_seconds=0.0):
+        """
+        Store a response and its parse result
+
+        Args:
+            url (str): Request URL
+            response_headers (dict): Response headers
+            body (bytes): Raw response body
+            parsed (dict): Parsed pollen data
+            parse_seconds (float): Time it took to parse the body, counted
+                as saved whenever the entry is used instead
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(url, etag, last_modified, body, parsed, size, stored_at, accessed_at, parse_seconds) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, response_headers.get('ETag'), response_headers.get('Last-Modified'),
+                 body, json.dumps(parsed, ensure_ascii=False), len(body), now, now, parse_seconds)
+            )
+            self.stats['stores'] += 1
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        # Drop expired entries first, then least recently used ones until under the size cap
+        cursor = self._db.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl,))
+        self.stats['evictions'] += cursor.rowcount
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall()
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            total -= size
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def log_stats(self):
+        """
+        Log the cache counters
+        """
+        s = self.stats
+        logging.info(
+            f"Response cache: {s['hits']} hits, {s['revalidations']} revalidations, "
+            f"{s['misses']} misses, {s['evictions']} evictions, {s['bytes_saved']} bytes saved, "
+            f"{s['parse_seconds_saved']:.3f}s of parsing saved"
+        )
@@ -0,0 +1,298 @@
+"""
+City registry
+
+wetteronline.de names its pollen pages after a city slug: lowercase, with
+umlauts written out (ä -> ae, ö -> oe, ü -> ue, ß -> ss), e.g. muenchen or
+koeln. The registry maps free-text city names ("München", "Frankfurt am
+Main", "Cologne") to these slugs using a prebuilt index file. Only exact
+names, slugs and aliases are resolved; similar names are never substituted,
+since many real towns are a letter or two away from another one (Amberg
+and Bamberg, Langen and Erlangen). A name that is not in the index is
+rejected with suggestions before any request is sent; with STRICT off it
+is used as a normalized slug instead, with a warning.
+
+The index (pollen_cities.json) lists every slug with its display name,
+federal state and aliases, and a lookup table from normalized names to
+slugs. It is read on first use and kept in memory. It is built from the
+tracked-city list pollen_cities.csv (slug, name, state and aliases
+separated by '|') with:
+
+    python pollen_cities.py pollen_cities.csv pollen_cities.json
+
+A different index can be used with POLLEN_CITY_INDEX or by setting
+INDEX_PATH.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import unicodedata
+from collections import Counter
+from difflib import get_close_matches
+from functools import lru_cache
+
+# Index file used when none is passed explicitly
+INDEX_PATH = os.environ.get('POLLEN_CITY_INDEX',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pollen_cities.json'))
+
+# Reject cities that are not in the index; when False, unknown names are
+# only normalized (for cities missing from the index)
+STRICT = os.environ.get('POLLEN_STRICT_CITIES', 'true').lower() != 'false'
+
+# Similarity a name needs to be suggested for an unknown city
+SUGGEST_CUTOFF = 0.6
+
+# Index entries compared in full with a misspelled name, picked by shared letter pairs
+FUZZY_CANDIDATES = 20
+
+UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+NON_SLUG_PATTERN = re.compile(r'[^a-z0-9]+')
+
+class UnknownCityError(ValueError):
+    """
+    A city name could not be resolved to a pollen page
+
+    Args:
+        name (str): City name as given
+        suggestions (list): Slugs of similar cities
+    """
+
+    def __init__(self, name, suggestions=()):
+        self.name = name
+        self.suggestions = list(suggestions)
+        message = f"Unknown city: {name}"
+        if self.suggestions:
+            message += f" (did you mean {', '.join(self.suggestions)}?)"
+        super().__init__(message)
+
+def normalize_city(name):
+    """
+    Normalize a city name to slug form
+
+    Args:
+        name (str): Free-text city name, e.g. 'Frankfurt am Main'
+
+    Returns:
+        str: Lowercase name with umlauts written out and anything other
+            than letters and digits replaced with '-', e.g. 'frankfurt-am-main'
+    """
+    name = unicodedata.normalize('NFC', name.strip().lower()).translate(UMLAUTS)
+    # Drop the remaining accents (é -> e)
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return NON_SLUG_PATTERN.sub('-', name).strip('-')
+
+@lru_cache(maxsize=None)
+def load_index(path=None):
+    """
+    Load a city index, once per path
+
+    Args:
+        path (str): Index file, defaults to INDEX_PATH
+
+    Returns:
+        dict: 'cities' (slug -> dict with 'name', 'state' and 'aliases') and
+            'keys' (normalized name -> slug)
+    """
+    path = path or INDEX_PATH
+    with open(path, encoding='utf-8') as f:
+        index = json.load(f)
+    logging.info(f"Loaded {len(index['cities'])} cities from {path}")
+    return index
+
+def read_city_list(path):
+    """
+    Read a tracked-city list
+
+    Args:
+        path (str): CSV file with the columns slug, name, state and aliases
+            (separated by '|')
+
+    Returns:
+        list: Dicts with 'slug', 'name', 'state' and 'aliases', as taken by write_index
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        return [
+            {'slug': row['slug'], 'name': row['name'], 'state': row['state'],
+             'aliases': [alias for alias in row['aliases'].split('|') if alias]}
+            for row in csv.DictReader(f)
+        ]
+
+def write_index(cities, path):
+    """
+    Build a city index file
+
+    Args:
+        cities (list): Dicts with 'slug', 'name', 'state' and optionally 'aliases'
+        path (str): Output file
+    """
+    index = {'cities': {}, 'keys': {}}
+    for city in sorted(cities, key=lambda c: c['slug']):
+        aliases = list(city.get('aliases', []))
+        index['cities'][city['slug']] = {'name': city['name'], 'state': city['state'], 'aliases': aliases}
+        for name in [city['slug'], city['name']] + aliases:
+            # Also accept the name with umlauts reduced to plain vowels (Koln, Munchen)
+            plain = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+            for key in {normalize_city(name), normalize_city(plain)}:
+                if index['keys'].setdefault(key, city['slug']) != city['slug']:
+                    raise ValueError(f"{name} is ambiguous: {index['keys'][key]} or {city['slug']}")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+        f.write('\n')
+
+def city_info(slug, path=None):
+    """
+    Get the index entry of a city
+
+    Args:
+        slug (str): City slug
+        path (str): Index file, defaults to INDEX_PATH
+
+    Returns:
+        dict: 'name', 'state' and 'aliases', None for unknown slugs
+    """
+    return load_index(path)['cities'].get(slug)
+
+def suggest_cities(name, n=3, cutoff=SUGGEST_CUTOFF, path=None):
+    """
+    Find the cities closest to a name
+
+    Args:
+        name (str): Free-text city name
+        n (int): Maximum number of suggestions
+        cutoff (float): Minimum similarity (0-1)
+        path (str): Index file, defaults to INDEX_PATH
+
+    Returns:
+        list: Slugs, most similar first
+    """
+    return _suggest(normalize_city(name), n, cutoff, path or INDEX_PATH)
+
+def _bigrams(key):
+    padded = f" {key} "
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+@lru_cache(maxsize=None)
+def _bigram_index(path):
+    # Bigram -> index keys containing it, to narrow down fuzzy matching
+    index = {}
+    for key in load_index(path)['keys']:
+        for bigram in _bigrams(key):
+            index.setdefault(bigram, []).append(key)
+    return index
+
+def _candidates(key, path):
+    # Index keys sharing the most bigrams with a name, only these are compared in full
+    index = _bigram_index(path)
+    counts = Counter()
+    for bigram in _bigrams(key):
+        counts.update(index.get(bigram, ()))
+    return [candidate for candidate, _ in counts.most_common(FUZZY_CANDIDATES)]
+
+@lru_cache(maxsize=4096)
+def _suggest(key, n, cutoff, path):
+    keys = load_index(path)['keys']
+    slugs = []
+    for match in get_close_matches(key, _candidates(key, path), n=n * 3, cutoff=cutoff):
+        if keys[match] not in slugs:
+            slugs.append(keys[match])
+    return tuple(slugs[:n])
+
+def _match(key, path):
+    # (slug, suggestions) for a normalized name: an exact or alias match, or (None, suggestions)
+    keys = load_index(path)['keys']
+    if key in keys:
+        return keys[key], ()
+    return None, _suggest(key, 3, SUGGEST_CUTOFF, path)
+
+def resolve_city(name, strict=None, path=None):
+    """
+    Resolve a free-text city name to its slug
+
+    Exact names, slugs and aliases are looked up after normalization.
+    Similar names are only suggested, never used in place of the name.
+
+    Args:
+        name (str): Free-text city name, e.g. 'München'
+        strict (bool): Reject names that are not in the index, defaults to STRICT
+        path (str): Index file, defaults to INDEX_PATH
+
+    Returns:
+        str: City slug, e.g. 'muenchen'
+
+    Raises:
+        UnknownCityError: If the name is not in the index (only when strict)
+    """
+    resolved, unknown = resolve_cities([name], strict=strict, path=path)
+    if unknown:
+        raise UnknownCityError(name, unknown[name])
+    return resolved[name]
+
+def resolve_cities(names, strict=None, path=None):
+    """
+    Resolve many free-text city names in one call
+
+    Every distinct normalized name is looked up once, so long subscriber
+    lists with many repetitions of the same cities are cheap. When not
+    strict, names that are not in the index resolve to their normalized
+    slug, with one warning per distinct name.
+
+    Args:
+        names (iterable): Free-text city names
+        strict (bool): Reject names that are not in the index, defaults to STRICT
+        path (str): Index file, defaults to INDEX_PATH
+
+    Returns:
+        tuple: (resolved, unknown): dicts of name -> slug, and name -> list
+            of suggested slugs for the names that could not be resolved
+    """
+    strict = STRICT if strict is None else strict
+    path = path or INDEX_PATH
+    by_key = {}
+    resolved = {}
+    unknown = {}
+    for name in names:
+        if name in resolved or name in unknown:
+            continue
+        key = normalize_city(name)
+        if key not in by_key:
+            by_key[key] = _match(key, path)
+            if by_key[key][0] is None and not strict and key:
+                logging.warning(f"{UnknownCityError(name, by_key[key][1])}, not in the city index, using {key} as is")
+        slug, suggestions = by_key[key]
+        if slug is not None:
+            resolved[name] = slug
+        elif not strict and key:
+            resolved[name] = key
+        else:
+            unknown[name] = list(suggestions)
+    return resolved, unknown
+
+def main(args=None):
+    """
+    Build the city index from the tracked-city list
+
+    Args:
+        args (list): Command line arguments
+
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(description='Build the city index from a tracked-city list')
+    parser.add_argument('cities', type=str, help='Tracked-city list (CSV with slug, name, state, aliases)')
+    parser.add_argument('index', type=str, nargs='?', default=INDEX_PATH, help='Index file to write')
+    args = parser.parse_args(args if args is not None else sys.argv[1:])
+
+    try:
+        cities = read_city_list(args.cities)
+        write_index(cities, args.index)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Could not build the city index: {str(e)}", file=sys.stderr)
+        return 1
+    print(f"Wrote {len(cities)} cities to {args.index}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
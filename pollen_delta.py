@@ -0,0 +1,177 @@
+"""
+Change detection between scrapes
+
+The levels each city had when its forecast was last sent are kept as a
+snapshot. A new scrape is compared with it, and emails are only rendered
+and sent when a pollen level moved enough. Every skipped send is recorded
+with its reason.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Reasons for skipping a send
+REASON_UNCHANGED = 'unchanged'
+REASON_BELOW_THRESHOLD = 'below threshold'
+
+def level_value(concentration):
+    """
+    Convert a concentration string to an integer level
+
+    Args:
+        concentration (str): Concentration level ('0' to '3')
+
+    Returns:
+        int: Level, 0 if the value is not a number
+    """
+    return int(concentration) if concentration.isdigit() else 0
+
+class ChangeDetector:
+    """
+    Compares scrape results with the last snapshot of each city
+
+    A pollen type counts as changed when its level moved by at least
+    `min_change`. With a `threshold`, the move must also cross it (rise to
+    or above it from below, or fall below it from at or above).
+
+    Args:
+        path (str): SQLite file for snapshots and skipped sends
+        min_change (int): Smallest level difference that counts as a change
+        threshold (int): Level that a change must cross, None to accept any change
+    """
+
+    def __init__(self, path, min_change=1, threshold=None):
+        self.path = path
+        self.min_change = min_change
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                city TEXT PRIMARY KEY,
+                levels TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS skipped_sends (
+                skipped_at REAL NOT NULL,
+                city TEXT NOT NULL,
+                recipient TEXT,
+                reason TEXT NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _snapshot(self, city):
+        with self._lock:
+            row = self._db.execute("SELECT levels FROM snapshots WHERE city = ?", (city.lower(),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _is_change(self, old, new):
+        if abs(new - old) < self.min_change:
+            return False
+        if self.threshold is None:
+            return True
+        return (old < self.threshold) != (new < self.threshold)
+
+    def compare(self, data):
+        """
+        Compare a scrape result with the city's last snapshot
+
+        Results with an error or default data, and cities without a
+        snapshot, are always sent.
+
+        Args:
+            data (dict): Pollen data as returned by scrape_pollen_data
+
+        Returns:
+            dict: 'send' (bool), 'reason' (why it is skipped, or None) and
+                'changes' (pollen type -> previous concentration, for the
+                types that changed)
+        """
+        if 'error' in data or data.get('default_data'):
+            return {'send': True, 'reason': None, 'changes': {}}
+
+        previous = self._snapshot(data['city'])
+        if previous is None:
+            return {'send': True, 'reason': None, 'changes': {}}
+
+        moved = False
+        changes = {}
+        for item in data['pollen_items']:
+            old = previous.get(item['type'], '0')
+            if old == item['concentration']:
+                continue
+            moved = True
+            if self._is_change(level_value(old), level_value(item['concentration'])):
+                changes[item['type']] = old
+
+        if changes:
+            return {'send': True, 'reason': None, 'changes': changes}
+        return {'send': False, 'reason': REASON_BELOW_THRESHOLD if moved else REASON_UNCHANGED, 'changes': {}}
+
+    def update(self, data):
+        """
+        Make a scrape result the city's new snapshot, call after it was sent
+
+        Results with an error or default data are ignored.
+
+        Args:
+            data (dict): Pollen data as returned by scrape_pollen_data
+        """
+        if 'error' in data or data.get('default_data'):
+            return
+        levels = {item['type']: item['concentration'] for item in data['pollen_items']}
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO snapshots (city, levels, updated_at) VALUES (?, ?, ?)",
+                (data['city'].lower(), json.dumps(levels, ensure_ascii=False), time.time())
+            )
+            self._db.commit()
+
+    def record_skip(self, city, recipients, reason):
+        """
+        Record that sending was skipped
+
+        Args:
+            city (str): City name
+            recipients (list): Recipients that did not get an email
+            reason (str): Why the send was skipped
+        """
+        now = time.time()
+        logging.info(f"Skipping email for {city} to {len(recipients)} recipient(s): {reason}")
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO skipped_sends (skipped_at, city, recipient, reason) VALUES (?, ?, ?, ?)",
+                [(now, city.lower(), recipient, reason) for recipient in recipients]
+            )
+            self._db.commit()
+
+    def skipped(self, since=None):
+        """
+        Get recorded skips
+
+        Args:
+            since (float): Only skips at or after this UNIX time
+
+        Returns:
+            list: Skips as dicts with 'skipped_at', 'city', 'recipient' and 'reason'
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT skipped_at, city, recipient, reason FROM skipped_sends "
+                "WHERE skipped_at >= ? ORDER BY skipped_at, city",
+                (since or 0,)
+            ).fetchall()
+        return [dict(zip(('skipped_at', 'city', 'recipient', 'reason'), row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,349 @@
+"""
+Pollen data from the national DWD feed
+
+The Deutscher Wetterdienst publishes its pollen forecast (Pollenflug-
+Gefahrenindex) for all of Germany as one JSON document, updated once a day
+around 11:00. DWDSource downloads it once and answers every city from the
+copy in memory, so a batch run costs one request instead of one page per
+city. The copy is downloaded again (conditionally) when it is older than
+`max_age`; if that fails, the old copy keeps being used.
+
+The feed has levels per region and partregion rather than per city. Every
+city of the registry is mapped to the partregion it lies in (CITY_REGIONS);
+other cities get the region of their federal state, with the highest level
+of its partregions when it has several. The feed covers 8 pollen types, and has levels in half
+steps ("0-1", "1-2", "2-3"), which are rounded up to the 0-3 scale of the
+pollen pages, so an alert never misses a level the DWD considers possible.
+Both approximations are marked in the results: 'region_approximated' is
+True for the state fallback, and 'rounded_levels' (per result and per day)
+maps the pollen types whose level was rounded to the feed's range.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+import pollen_cities
+from pollen_metrics import METRICS
+from pollen_sources import PollenSource, error_result
+
+# Feed URL, can be overridden (e.g. to point at a saved copy served locally)
+DWD_URL = os.environ.get('POLLEN_DWD_URL', 'https://opendata.dwd.de/climate_environment/health/alerts/s31fg.json')
+
+# Public page of the forecast, linked from emails
+DWD_PAGE_URL = 'https://www.dwd.de/DE/leistungen/gefahrenindizespollen/gefahrenindexpollen.html'
+
+# Seconds the downloaded feed is used before it is revalidated
+MAX_AGE = 3600
+
+# Feed type names that differ from the pollen pages
+TYPE_NAMES = {'Beifuss': 'Beifuß', 'Graeser': 'Gräser'}
+
+# Feed levels -> levels of the pollen pages, ranges rounded up; "-1" means no forecast
+LEVELS = {'0': '0', '0-1': '1', '1': '1', '1-2': '2', '2': '2', '2-3': '3', '3': '3'}
+
+# Forecast days of the feed, counted from the day it was issued
+DAY_KEYS = ('today', 'tomorrow', 'dayafter_to')
+DAY_LABELS = ('Heute', 'Morgen', 'Übermorgen')
+
+# Federal state -> DWD region
+STATE_REGIONS = {
+    'Schleswig-Holstein': 10, 'Hamburg': 10,
+    'Mecklenburg-Vorpommern': 20,
+    'Niedersachsen': 30, 'Bremen': 30,
+    'Nordrhein-Westfalen': 40,
+    'Brandenburg': 50, 'Berlin': 50,
+    'Sachsen-Anhalt': 60,
+    'Thüringen': 70,
+    'Sachsen': 80,
+    'Hessen': 90,
+    'Rheinland-Pfalz': 100, 'Saarland': 100,
+    'Baden-Württemberg': 110,
+    'Bayern': 120,
+}
+
+# City slug -> (region, partregion), -1 for regions without partregions
+CITY_REGIONS = {
+    # Geest, Schleswig-Holstein und Hamburg
+    'flensburg': (10, 12), 'hamburg': (10, 12), 'kiel': (10, 12), 'luebeck': (10, 12),
+    # Mecklenburg-Vorpommern
+    'greifswald': (20, -1), 'rostock': (20, -1), 'schwerin': (20, -1),
+    # Westliches Niedersachsen/Bremen, östliches Niedersachsen
+    'bremen': (30, 31), 'bremerhaven': (30, 31), 'oldenburg': (30, 31), 'osnabrueck': (30, 31),
+    'braunschweig': (30, 32), 'goettingen': (30, 32), 'hannover': (30, 32), 'hildesheim': (30, 32),
+    'salzgitter': (30, 32), 'wolfsburg': (30, 32),
+    # Rhein.-Westfäl. Tiefland, Ostwestfalen, Mittelgebirge NRW
+    'aachen': (40, 41), 'bergisch-gladbach': (40, 41), 'bochum': (40, 41), 'bonn': (40, 41),
+    'bottrop': (40, 41), 'dortmund': (40, 41), 'duesseldorf': (40, 41), 'duisburg': (40, 41),
+    'essen': (40, 41), 'gelsenkirchen': (40, 41), 'hamm': (40, 41), 'herne': (40, 41), 'koeln': (40, 41),
+    'krefeld': (40, 41), 'leverkusen': (40, 41), 'moenchengladbach': (40, 41), 'moers': (40, 41),
+    'muelheim-an-der-ruhr': (40, 41), 'muenster': (40, 41), 'neuss': (40, 41), 'oberhausen': (40, 41),
+    'recklinghausen': (40, 41),
+    'bielefeld': (40, 42), 'guetersloh': (40, 42), 'paderborn': (40, 42),
+    'hagen': (40, 43), 'remscheid': (40, 43), 'siegen': (40, 43), 'solingen': (40, 43), 'wuppertal': (40, 43),
+    # Brandenburg und Berlin
+    'berlin': (50, -1), 'brandenburg': (50, -1), 'cottbus': (50, -1), 'frankfurt-oder': (50, -1),
+    'potsdam': (50, -1),
+    # Tiefland Sachsen-Anhalt
+    'halle': (60, 61), 'magdeburg': (60, 61),
+    # Tiefland Thüringen
+    'erfurt': (70, 71), 'gera': (70, 71), 'jena': (70, 71),
+    # Tiefland Sachsen, Mittelgebirge Sachsen
+    'dresden': (80, 81), 'leipzig': (80, 81), 'chemnitz': (80, 82), 'zwickau': (80, 82),
+    # Nordhessen und hess. Mittelgebirge, Rhein-Main
+    'giessen': (90, 91), 'kassel': (90, 91),
+    'darmstadt': (90, 92), 'frankfurt': (90, 92), 'offenbach': (90, 92), 'wiesbaden': (90, 92),
+    # Rhein, Pfalz, Nahe und Mosel; Mittelgebirgsbereich Rheinland-Pfalz; Saarland
+    'koblenz': (100, 101), 'ludwigshafen': (100, 101), 'mainz': (100, 101), 'trier': (100, 101),
+    'kaiserslautern': (100, 102), 'saarbruecken': (100, 103),
+    # Oberrhein und unteres Neckartal; Hohenlohe/mittlerer Neckar/Oberschwaben; Mittelgebirge Baden-Württemberg
+    'freiburg': (110, 111), 'heidelberg': (110, 111), 'karlsruhe': (110, 111), 'mannheim': (110, 111),
+    'heilbronn': (110, 112), 'konstanz': (110, 112), 'reutlingen': (110, 112), 'stuttgart': (110, 112),
+    'ulm': (110, 112), 'pforzheim': (110, 113),
+    # Allgäu/Oberbayern/Bay. Wald; Donauniederungen; Bayern nördl. der Donau; Mainfranken
+    'muenchen': (120, 121),
+    'augsburg': (120, 122), 'ingolstadt': (120, 122), 'passau': (120, 122), 'regensburg': (120, 122),
+    'bamberg': (120, 123), 'bayreuth': (120, 123), 'erlangen': (120, 123), 'fuerth': (120, 123),
+    'nuernberg': (120, 123),
+    'wuerzburg': (120, 124),
+}
+
+def parse_feed(feed):
+    """
+    Read the levels out of the feed document
+
+    Args:
+        feed (dict): Decoded s31fg.json
+
+    Returns:
+        dict: 'issued' (date the feed's "today" refers to) and 'regions':
+            (region, partregion) -> {'name', 'days', 'ranges'}, where days
+            has one dict per DAY_KEYS entry mapping pollen type -> level,
+            or None where the feed has no forecast, and ranges one dict per
+            day mapping the types whose level was rounded up to the feed value
+    """
+    issued = datetime.datetime.strptime(feed['last_update'].split()[0], '%Y-%m-%d').date()
+    regions = {}
+    for entry in feed['content']:
+        days = [{} for _ in DAY_KEYS]
+        ranges = [{} for _ in DAY_KEYS]
+        for pollen_type, values in entry['Pollen'].items():
+            pollen_type = TYPE_NAMES.get(pollen_type, pollen_type)
+            for day, key in enumerate(DAY_KEYS):
+                value = str(values.get(key, '-1'))
+                level = LEVELS.get(value)
+                if level is not None:
+                    days[day][pollen_type] = level
+                    if value != level:
+                        ranges[day][pollen_type] = value
+        regions[(entry['region_id'], entry.get('partregion_id', -1))] = {
+            'name': entry.get('partregion_name') or entry['region_name'],
+            'days': [levels or None for levels in days],
+            'ranges': ranges
+        }
+    return {'issued': issued, 'regions': regions}
+
+def _highest(parts):
+    # Levels of a whole region: per day and pollen type the highest level of its partregions,
+    # with the feed range of that level where it was rounded
+    days = []
+    ranges = []
+    for day in range(len(DAY_KEYS)):
+        levels = {}
+        rounded = {}
+        for part in parts:
+            for pollen_type, level in (part['days'][day] or {}).items():
+                value = part['ranges'][day].get(pollen_type)
+                # On a tie, a part that has the level exactly wins over a rounded one
+                if (pollen_type not in levels or level > levels[pollen_type]
+                        or (level == levels[pollen_type] and value is None)):
+                    levels[pollen_type] = level
+                    rounded.pop(pollen_type, None)
+                    if value is not None:
+                        rounded[pollen_type] = value
+        days.append(levels or None)
+        ranges.append(rounded)
+    return days, ranges
+
+class DWDSource(PollenSource):
+    """
+    Pollen data for every city from one download of the DWD feed
+
+    Args:
+        url (str): Feed URL, defaults to DWD_URL
+        session (requests.Session): HTTP session, defaults to a new one
+        policy (pollen_fetch.FetchPolicy): Timeouts and retries of the
+            download, defaults to pollen_fetch.DEFAULT_POLICY
+        max_age (float): Seconds the feed is used before it is revalidated
+        today (datetime.date): Day the forecast is read for, defaults to the
+            current day; set it to read a saved copy of the feed
+    """
+
+    name = 'dwd'
+    title = 'Deutscher Wetterdienst (DWD)'
+
+    def __init__(self, url=None, session=None, policy=None, max_age=MAX_AGE, today=None):
+        self.url = url or DWD_URL
+        self.session = session
+        self.policy = policy
+        self.max_age = max_age
+        self.today = today
+        self.feed = None
+        self.loaded_at = None
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Get the parsed feed, downloading it if it is missing or too old
+
+        Returns:
+            dict: Result of parse_feed
+
+        Raises:
+            Exception: If the feed could not be downloaded and there is no earlier copy
+        """
+        with self._lock:
+            if self.feed is not None and time.monotonic() - self.loaded_at < self.max_age:
+                return self.feed
+            try:
+                self._download()
+            except Exception as e:
+                if self.feed is None:
+                    raise
+                logging.warning(f"Could not refresh the DWD pollen feed, using the copy from "
+                                f"{self.feed['issued']}: {str(e)}")
+            self.loaded_at = time.monotonic()
+            return self.feed
+
+    def _download(self):
+        import pollen_fetch
+
+        if self.session is None:
+            import requests
+
+            self.session = requests.Session()
+        policy = self.policy or pollen_fetch.DEFAULT_POLICY
+        logging.info(f"Downloading DWD pollen feed: {self.url}")
+        with METRICS.timer('download', city='dwd'):
+            response = policy.fetch(self.session, self.url, headers=dict(self._validators),
+                                    deadline=policy.deadline_at())
+        try:
+            if response.status_code == 304 and self.feed is not None:
+                logging.info("DWD pollen feed not modified")
+                return
+            response.raise_for_status()
+            METRICS.inc('download_bytes', len(response.content), city='dwd')
+            with METRICS.timer('parse', city='dwd'):
+                feed = parse_feed(response.json())
+        finally:
+            response.close()
+        self.feed = feed
+        self._validators = {}
+        if response.headers.get('ETag'):
+            self._validators['If-None-Match'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            self._validators['If-Modified-Since'] = response.headers['Last-Modified']
+        logging.info(f"Loaded DWD pollen feed issued {feed['issued']} with {len(feed['regions'])} regions")
+
+    def page_url(self, city):
+        return DWD_PAGE_URL
+
+    def region(self, city):
+        """
+        Find the levels that apply to a city
+
+        Args:
+            city (str): City slug
+
+        Returns:
+            tuple: Region name, its levels and rounded ranges per day (see
+                parse_feed), and whether the levels are the highest of the
+                state's partregions rather than the city's own partregion
+
+        Raises:
+            ValueError: If the city cannot be mapped to a DWD region
+        """
+        regions = self.load()['regions']
+        key = CITY_REGIONS.get(city)
+        if key in regions:
+            return regions[key]['name'], regions[key]['days'], regions[key]['ranges'], False
+        info = pollen_cities.city_info(city)
+        region_id = STATE_REGIONS.get(info['state']) if info else None
+        parts = [region for (rid, _), region in sorted(regions.items()) if rid == region_id]
+        if not parts:
+            raise ValueError(f"No DWD pollen region for city: {city}")
+        if len(parts) == 1:
+            # A state region without partregions is the city's own region
+            return parts[0]['name'], parts[0]['days'], parts[0]['ranges'], False
+        return (info['state'],) + _highest(parts) + (True,)
+
+    def scrape(self, city):
+        """
+        Get the pollen data of one city from the feed
+
+        Args:
+            city (str): City slug
+
+        Returns:
+            dict: Pollen data, with the DWD region in 'region', True in
+                'region_approximated' if the city has no partregion of its
+                own, and the feed ranges of rounded levels in 'rounded_levels'
+        """
+        try:
+            issued = self.load()['issued']
+            name, region_days, region_ranges, approximated = self.region(city)
+            today = self.today or datetime.date.today()
+            days = []
+            # The feed is issued late in the morning; before that, its "tomorrow" is today
+            for offset, (levels, ranges) in enumerate(zip(region_days, region_ranges)):
+                date = issued + datetime.timedelta(days=offset)
+                if levels is None or date < today:
+                    continue
+                label = DAY_LABELS[(date - today).days] if (date - today).days < len(DAY_LABELS) else None
+                days.append({
+                    'date': f"{label}, {date:%d.%m.}" if label else f"{date:%d.%m.}",
+                    'pollen_items': [{'type': pollen_type, 'concentration': level}
+                                     for pollen_type, level in sorted(levels.items())],
+                    'rounded_levels': dict(ranges)
+                })
+            if not days:
+                raise ValueError(f"DWD pollen feed issued {issued} has no forecast for {today}")
+            city_name = (pollen_cities.city_info(city) or {}).get('name', city.capitalize())
+            if approximated:
+                logging.info(f"No DWD partregion mapped for {city}, using the highest levels in {name}")
+                title = f"Pollenflug-Gefahrenindex für {city_name} (höchster Wert in {name})"
+            else:
+                title = f"Pollenflug-Gefahrenindex für {city_name} ({name})"
+            return {
+                'date': days[0]['date'],
+                'title': title,
+                'pollen_items': days[0]['pollen_items'],
+                'days': days,
+                'city': city,
+                'region': name,
+                'region_approximated': approximated,
+                'rounded_levels': days[0]['rounded_levels']
+            }
+        except Exception as e:
+            return error_result(city, e)
+
+    def scrape_many(self, cities, max_workers=8):
+        """
+        Get the pollen data of several cities from one download of the feed
+
+        Args:
+            cities (list): City slugs
+            max_workers (int): Unused, the feed is a single download
+
+        Returns:
+            list: Pollen data dicts, in the same order as `cities`
+        """
+        cities = list(cities)
+        logging.info(f"Reading {len(cities)} cities from the DWD pollen feed")
+        # A failed download fails every city once, instead of being retried per city
+        try:
+            self.load()
+        except Exception as e:
+            return [error_result(city, e) for city in cities]
+        return [self.scrape(city) for city in cities]
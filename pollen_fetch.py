@@ -0,0 +1,362 @@
+"""
+Fetch policy for page downloads
+
+Every request gets connect and read timeouts, and a run can have an
+overall deadline. Connection errors, timeouts, truncated or undecodable
+bodies and 5xx answers are retried with exponential backoff and full
+jitter; 429 answers are retried after the time the server asks for in
+Retry-After. A per-host circuit breaker
+stops sending requests to a host after repeated failures (throttling
+included), so one degraded upstream fails a large batch quickly instead
+of stalling it. The deadline is also checked while a body is read, so a
+server that trickles data in under the read timeout cannot hold a run
+past it.
+"""
+import datetime
+import logging
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+from pollen_metrics import METRICS
+
+# Answers worth retrying
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+TOO_MANY_REQUESTS = 429
+
+class CircuitOpenError(Exception):
+    """
+    The circuit breaker of the host is open, the request was not sent
+    """
+
+class DeadlineExceeded(Exception):
+    """
+    The run's deadline passed before the page could be fetched
+    """
+
+# Bytes read at a time when reading a body
+BODY_CHUNK_SIZE = 8192
+
+def iter_body(response, deadline=None, chunk_size=BODY_CHUNK_SIZE):
+    """
+    Read a streamed response chunk by chunk, within a deadline
+
+    Args:
+        response (requests.Response): Response requested with stream=True
+        deadline (float): time.monotonic() value by which the body must be read
+        chunk_size (int): Bytes per chunk
+
+    Yields:
+        bytes: Body chunks, decompressed
+
+    Raises:
+        DeadlineExceeded: If the deadline passes before the body is read;
+            the response is closed
+    """
+    for chunk in response.iter_content(chunk_size):
+        if deadline is not None and time.monotonic() > deadline:
+            response.close()
+            METRICS.inc('deadline_exceeded')
+            raise DeadlineExceeded(f"Deadline passed while reading {response.url}")
+        yield chunk
+
+def read_body(response, deadline=None):
+    """
+    Read the whole body of a streamed response within a deadline
+
+    Afterwards response.content and response.text work as for a response
+    that was not streamed.
+
+    Args:
+        response (requests.Response): Response requested with stream=True
+        deadline (float): time.monotonic() value by which the body must be read
+
+    Returns:
+        bytes: Body
+
+    Raises:
+        DeadlineExceeded: If the deadline passes before the body is read
+    """
+    response._content = b''.join(iter_body(response, deadline))
+    response._content_consumed = True
+    return response._content
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker
+
+    The outcomes of the last `window` requests to each host are kept. Once
+    at least `min_requests` of them are known and `failure_ratio` or more
+    of them failed, the host's circuit opens and requests to it are
+    rejected. After `reset_after` seconds one trial request is let through;
+    if it succeeds the circuit closes again, otherwise it stays open for
+    another `reset_after` seconds. A few failing pages on a healthy host do
+    not open the circuit, a host that fails (almost) everything does.
+
+    Args:
+        window (int): Number of recent outcomes per host
+        min_requests (int): Outcomes needed before the circuit can open
+        failure_ratio (float): Share of failures that opens the circuit
+        reset_after (float): Seconds before a trial request is allowed
+    """
+
+    def __init__(self, window=20, min_requests=10, failure_ratio=0.8, reset_after=30.0):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_ratio = failure_ratio
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        # host -> {'outcomes' (deque of bools, True for a failure), 'opened_at', 'probing'}
+        self._hosts = {}
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {'outcomes': deque(maxlen=self.window), 'opened_at': None, 'probing': False}
+        return state
+
+    def allow(self, host):
+        """
+        Check whether a request to a host may be sent
+
+        Args:
+            host (str): Host name (with port)
+
+        Returns:
+            bool: False while the circuit is open
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state['opened_at'] is None:
+                return True
+            if state['probing'] or time.monotonic() - state['opened_at'] < self.reset_after:
+                return False
+            # Half-open: let one trial request through
+            state['probing'] = True
+            return True
+
+    def record_success(self, host):
+        """
+        Record an answer from a host, closing its circuit after a trial request
+
+        Args:
+            host (str): Host name (with port)
+        """
+        with self._lock:
+            state = self._state(host)
+            if state['probing']:
+                logging.info(f"Circuit for {host} closed")
+                state['outcomes'].clear()
+                state['opened_at'] = None
+                state['probing'] = False
+            state['outcomes'].append(False)
+
+    def record_failure(self, host):
+        """
+        Record a failed request to a host, opening its circuit when needed
+
+        Args:
+            host (str): Host name (with port)
+        """
+        with self._lock:
+            state = self._state(host)
+            outcomes = state['outcomes']
+            outcomes.append(True)
+            if state['probing']:
+                state['opened_at'] = time.monotonic()
+                state['probing'] = False
+            elif (state['opened_at'] is None and len(outcomes) >= self.min_requests
+                  and sum(outcomes) >= self.failure_ratio * len(outcomes)):
+                logging.warning(f"Circuit for {host} opened, {sum(outcomes)} of the last {len(outcomes)} requests failed")
+                METRICS.inc('circuit_opened', host=host)
+                state['opened_at'] = time.monotonic()
+
+    def is_open(self, host):
+        """
+        Check whether a host's circuit is open
+
+        Args:
+            host (str): Host name (with port)
+
+        Returns:
+            bool: True if requests to the host are currently rejected
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            return state is not None and state['opened_at'] is not None
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header
+
+    Args:
+        value (str): Header value, seconds or an HTTP date
+
+    Returns:
+        float: Seconds to wait, None if the value cannot be parsed
+    """
+    from email.utils import parsedate_to_datetime
+
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+class FetchPolicy:
+    """
+    Timeouts, retries, deadline and circuit breaking for page downloads
+
+    Args:
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait for data from the server
+        max_retries (int): Retries after the first attempt
+        backoff (float): Base delay in seconds, doubled after every retry
+        max_backoff (float): Longest delay between two attempts
+        max_retry_after (float): Longest Retry-After that is waited for,
+            answers asking for more are given up on
+        deadline (float): Seconds one run (e.g. one scrape_many call) may
+            take, None for no limit
+        breaker (CircuitBreaker): Per-host circuit breaker, None to disable
+        stream (bool): Only read pages up to the pollen section, see
+            pollen_parser.parse_pollen_stream
+    """
+
+    def __init__(self, connect_timeout=5.0, read_timeout=20.0, max_retries=3, backoff=0.5, max_backoff=10.0,
+                 max_retry_after=60.0, deadline=None, breaker=None, stream=False):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.deadline = deadline
+        self.breaker = breaker
+        self.stream = stream
+
+    def deadline_at(self):
+        """
+        Start a run
+
+        Returns:
+            float: time.monotonic() value at which the run's deadline
+                passes, None without a deadline
+        """
+        return time.monotonic() + self.deadline if self.deadline else None
+
+    def backoff_delay(self, attempt):
+        """
+        Get the delay before a retry
+
+        Args:
+            attempt (int): Number of the retry, starting at 0
+
+        Returns:
+            float: Random delay between 0 and the exponential backoff cap
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def fetch(self, session, url, headers=None, deadline=None):
+        """
+        GET a page under this policy
+
+        Args:
+            session (requests.Session): HTTP session
+            url (str): Page URL
+            headers (dict): Request headers
+            deadline (float): time.monotonic() value by which the fetch must
+                be done, see deadline_at
+
+        Returns:
+            requests.Response: Last response; after the retries are used
+                up this can still be a 5xx or 429 answer. With `stream`,
+                only the headers have been read and the caller must close it.
+
+        Raises:
+            CircuitOpenError: If the host's circuit is open
+            DeadlineExceeded: If the deadline passed, also while the body was read
+            requests.RequestException: If the last attempt failed without an answer
+        """
+        import requests
+
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                METRICS.inc('deadline_exceeded')
+                raise DeadlineExceeded(f"Deadline passed before fetching {url}")
+            if self.breaker is not None and not self.breaker.allow(host):
+                METRICS.inc('circuit_rejected', host=host)
+                raise CircuitOpenError(f"Circuit for {host} is open")
+
+            timeout = (self.connect_timeout, self.read_timeout)
+            if remaining is not None:
+                timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+
+            response = None
+            error = None
+            retry_after = None
+            try:
+                # Always streamed, so the body is read under the deadline too
+                response = session.get(url, headers=headers, timeout=timeout, stream=True)
+                if not self.stream and response.status_code not in RETRY_STATUSES \
+                        and response.status_code != TOO_MANY_REQUESTS:
+                    read_body(response, deadline)
+            except DeadlineExceeded:
+                if self.breaker is not None:
+                    self.breaker.record_failure(host)
+                raise
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                reason = 'timeout' if isinstance(e, requests.Timeout) else 'connection'
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError) as e:
+                # Truncated or corrupt body: the answer is unusable, retried like a lost connection
+                response.close()
+                response = None
+                error = e
+                reason = 'body'
+            else:
+                if response.status_code in RETRY_STATUSES:
+                    reason = str(response.status_code)
+                elif response.status_code == TOO_MANY_REQUESTS:
+                    reason = '429'
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                else:
+                    if self.breaker is not None:
+                        self.breaker.record_success(host)
+                    return response
+
+            # Throttling counts as a failure too, so a host that throttles everything opens its circuit
+            if self.breaker is not None:
+                self.breaker.record_failure(host)
+
+            delay = retry_after if retry_after is not None else self.backoff_delay(attempt)
+            give_up = (
+                attempt >= self.max_retries
+                or (retry_after is not None and retry_after > self.max_retry_after)
+                or (deadline is not None and time.monotonic() + delay >= deadline)
+                or (self.breaker is not None and self.breaker.is_open(host))
+            )
+            if give_up:
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+
+            logging.warning(f"Fetching {url} failed ({reason}), retry {attempt + 1} in {delay:.2f}s")
+            METRICS.inc('fetch_retries', reason=reason)
+            time.sleep(delay)
+            attempt += 1
+
+# Policy used when none is passed explicitly; main() replaces it with one built from the command line
+DEFAULT_POLICY = FetchPolicy(breaker=CircuitBreaker())
@@ -0,0 +1,270 @@
+"""
+Historical store for scraped pollen readings
+
+Every (city, date, pollen type, level) reading is kept in a SQLite file.
+Cities and pollen types are stored once in lookup tables and readings
+reference them by id, dates are stored as day ordinals and levels as small
+integers, in a WITHOUT ROWID table clustered on (city, type, day) so range
+queries by city, pollen type and date window read one contiguous range.
+
+Usage:
+    python pollen_scraper.py history --db pollen_history.sqlite query --city berlin --type Birke --from 2026-03-01
+    python pollen_scraper.py history --db pollen_history.sqlite info
+"""
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+class HistoryStore:
+    """
+    SQLite store of pollen readings
+
+    Args:
+        path (str): SQLite file path
+        batch_size (int): Readings per INSERT batch in record_many
+    """
+
+    def __init__(self, path, batch_size=5000):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS cities (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pollen_types (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS readings (
+                city_id INTEGER NOT NULL,
+                type_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                level INTEGER NOT NULL,
+                PRIMARY KEY (city_id, type_id, day)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS readings_day ON readings (day, type_id);
+        """)
+        self._db.commit()
+        self._city_ids = dict(self._db.execute("SELECT name, id FROM cities"))
+        self._type_ids = dict(self._db.execute("SELECT name, id FROM pollen_types"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _lookup_id(self, table, cache, name):
+        if name not in cache:
+            self._db.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            cache[name] = self._db.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+        return cache[name]
+
+    def record(self, data, day=None):
+        """
+        Store the readings of one scrape result
+
+        Args:
+            data (dict): Pollen data as returned by scrape_pollen_data
+            day (datetime.date): Date of the readings, defaults to today
+
+        Returns:
+            int: Number of readings stored
+        """
+        return self.record_many([data], day)
+
+    def record_many(self, results, day=None):
+        """
+        Store the readings of many scrape results in batched transactions
+
+        Results with an error or with substituted default data are skipped,
+        as are items whose level is not a number. A reading for the same
+        city, pollen type and day replaces the stored one.
+
+        Args:
+            results (list): Pollen data dicts as returned by scrape_pollen_data
+            day (datetime.date): Date of the readings, defaults to today
+
+        Returns:
+            int: Number of readings stored
+        """
+        day = (day or datetime.date.today()).toordinal()
+        stored = 0
+        with self._lock:
+            batch = []
+            for data in results:
+                if 'error' in data or data.get('default_data'):
+                    logging.info(f"Not recording pollen history for {data.get('city')}: no real data")
+                    continue
+                city_id = self._lookup_id('cities', self._city_ids, data['city'].lower())
+                for item in data['pollen_items']:
+                    level = item['concentration']
+                    if not level.isdigit():
+                        continue
+                    type_id = self._lookup_id('pollen_types', self._type_ids, item['type'])
+                    batch.append((city_id, type_id, day, int(level)))
+                if len(batch) >= self.batch_size:
+                    stored += self._insert(batch)
+                    batch = []
+            stored += self._insert(batch)
+            self._db.commit()
+        return stored
+
+    def _insert(self, batch):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO readings (city_id, type_id, day, level) VALUES (?, ?, ?, ?)", batch
+        )
+        return len(batch)
+
+    def query(self, city=None, pollen_type=None, start=None, end=None):
+        """
+        Get readings, filtered by city, pollen type and date window
+
+        Args:
+            city (str): City name
+            pollen_type (str): Pollen type (German name as on the page)
+            start (datetime.date): First day, inclusive
+            end (datetime.date): Last day, inclusive
+
+        Returns:
+            list: Readings as dicts with 'city', 'date' (ISO string), 'type' and 'level' (int),
+                ordered by city, pollen type and date
+        """
+        conditions = []
+        params = []
+        if city is not None:
+            conditions.append("c.name = ?")
+            params.append(city.lower())
+        if pollen_type is not None:
+            conditions.append("t.name = ?")
+            params.append(pollen_type)
+        if start is not None:
+            conditions.append("r.day >= ?")
+            params.append(start.toordinal())
+        if end is not None:
+            conditions.append("r.day <= ?")
+            params.append(end.toordinal())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT c.name, r.day, t.name, r.level FROM readings r "
+                "JOIN cities c ON c.id = r.city_id JOIN pollen_types t ON t.id = r.type_id "
+                f"{where} ORDER BY c.name, t.name, r.day",
+                params
+            ).fetchall()
+        return [
+            {'city': c, 'date': datetime.date.fromordinal(d).isoformat(), 'type': t, 'level': level}
+            for c, d, t, level in rows
+        ]
+
+    def latest(self, city):
+        """
+        Get the most recent stored readings of a city
+
+        Args:
+            city (str): City name
+
+        Returns:
+            dict: 'date' (ISO string) and 'pollen_items' in the scraper format, or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(r.day) FROM readings r JOIN cities c ON c.id = r.city_id WHERE c.name = ?",
+                (city.lower(),)
+            ).fetchone()
+            if row[0] is None:
+                return None
+            items = self._db.execute(
+                "SELECT t.name, r.level FROM readings r "
+                "JOIN cities c ON c.id = r.city_id JOIN pollen_types t ON t.id = r.type_id "
+                "WHERE c.name = ? AND r.day = ? ORDER BY t.name",
+                (city.lower(), row[0])
+            ).fetchall()
+        return {
+            'date': datetime.date.fromordinal(row[0]).isoformat(),
+            'pollen_items': [{'type': t, 'concentration': str(level)} for t, level in items],
+        }
+
+    def info(self):
+        """
+        Summarize the store
+
+        Returns:
+            dict: Number of readings, cities and pollen types, first and last date, file size in bytes
+        """
+        with self._lock:
+            count, first, last = self._db.execute("SELECT COUNT(*), MIN(day), MAX(day) FROM readings").fetchone()
+        return {
+            'readings': count,
+            'cities': len(self._city_ids),
+            'pollen_types': len(self._type_ids),
+            'first_date': datetime.date.fromordinal(first).isoformat() if first else None,
+            'last_date': datetime.date.fromordinal(last).isoformat() if last else None,
+            'size_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def main(args=None):
+    """
+    Query the history store from the command line
+
+    Args:
+        args (list): Command line arguments
+
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(prog='pollen_scraper.py history', description='Query stored pollen readings')
+    parser.add_argument('--db', type=str, default=os.environ.get('POLLEN_HISTORY', 'pollen_history.sqlite'),
+                        help='History file (or POLLEN_HISTORY environment variable)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    query_parser = subparsers.add_parser('query', help='Print readings')
+    query_parser.add_argument('--city', type=str, help='City name')
+    query_parser.add_argument('--type', type=str, help='Pollen type, German name (e.g. Birke)')
+    query_parser.add_argument('--from', dest='start', type=datetime.date.fromisoformat, help='First day (YYYY-MM-DD)')
+    query_parser.add_argument('--to', dest='end', type=datetime.date.fromisoformat, help='Last day (YYYY-MM-DD)')
+    query_parser.add_argument('--format', type=str, choices=['table', 'csv', 'json'], default='table', help='Output format')
+
+    subparsers.add_parser('info', help='Print a summary of the store')
+
+    args = parser.parse_args(args if args is not None else sys.argv[1:])
+
+    if not os.path.exists(args.db):
+        print(f"History file not found: {args.db}", file=sys.stderr)
+        return 1
+
+    with HistoryStore(args.db) as store:
+        if args.command == 'info':
+            for key, value in store.info().items():
+                print(f"{key}: {value}")
+            return 0
+
+        readings = store.query(args.city, args.type, args.start, args.end)
+        if args.format == 'json':
+            json.dump(readings, sys.stdout, ensure_ascii=False, indent=2)
+            print()
+        elif args.format == 'csv':
+            writer = csv.DictWriter(sys.stdout, fieldnames=['date', 'city', 'type', 'level'])
+            writer.writeheader()
+            writer.writerows(readings)
+        else:
+            for r in readings:
+                print(f"{r['date']}  {r['city']:20s} {r['type']:12s} {r['level']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+National pollen matrix
+
+Scrape results hold the levels as lists of {'type': ..., 'concentration':
+'0'..'3'} dicts per city and day. PollenMatrix packs the levels of many
+cities into one uint8 array of shape (cities, pollen types, forecast days),
+with the pollen types in the fixed order of POLLEN_TYPES, so aggregations
+over hundreds of cities are single NumPy operations: the highest and mean
+level per federal state, the top cities per pollen type and the change from
+one forecast day to the next or from an earlier snapshot.
+
+A matrix can be saved to a file that other processes open as a read-only
+memory map, so they read the latest national snapshot without parsing or
+copying it. Files are replaced atomically; a reader that has one open keeps
+the snapshot it opened.
+
+NumPy is only needed for this module: pip install numpy
+
+Usage:
+    python pollen_scraper.py scrape-only --cities-file cities.txt --matrix national.pollen > /dev/null
+    python pollen_scraper.py matrix --file national.pollen states --type Birke
+    python pollen_scraper.py matrix --file national.pollen top --type Gräser -n 5
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from pollen_templates import POLLEN_TRANSLATIONS
+
+# Pollen types in matrix order, the index of a type never changes
+POLLEN_TYPES = tuple(POLLEN_TRANSLATIONS)
+TYPE_INDEX = {pollen_type: i for i, pollen_type in enumerate(POLLEN_TYPES)}
+
+# Level of cities and days without data (failed scrapes, default data, shorter forecasts)
+MISSING = 255
+
+# File layout: magic, header length (uint32 LE), JSON header, padding, levels in C order
+FILE_MAGIC = b'POLLENMX'
+FILE_VERSION = 1
+DATA_ALIGNMENT = 64
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("The pollen matrix needs NumPy, install it with: pip install numpy") from None
+    return numpy
+
+def _level(value):
+    return int(value) if value in ('0', '1', '2', '3') else MISSING
+
+class PollenMatrix:
+    """
+    Pollen levels of many cities as a (cities, types, days) uint8 array
+
+    Args:
+        levels (numpy.ndarray): uint8 array of shape (len(cities), len(POLLEN_TYPES), days),
+            MISSING where there is no data
+        cities (list): City slugs, one per row
+        dates (list): Date label of every forecast day
+        created_at (float): Unix time the snapshot was taken
+    """
+
+    def __init__(self, levels, cities, dates, created_at=None):
+        self.levels = levels
+        self.cities = list(cities)
+        self.dates = list(dates)
+        self.created_at = created_at if created_at is not None else time.time()
+        self.city_index = {city: i for i, city in enumerate(self.cities)}
+        self._states = None
+
+    @classmethod
+    def from_results(cls, results, days=None):
+        """
+        Build a matrix from scrape results
+
+        Failed scrapes and default data become MISSING rows, unknown pollen
+        types are left out.
+
+        Args:
+            results (list): Pollen data dicts, see scrape_many
+            days (int): Forecast days to keep, defaults to the longest forecast
+
+        Returns:
+            PollenMatrix: New matrix
+        """
+        np = _numpy()
+        usable = [[] if 'error' in data or data.get('default_data') else data.get('days') or []
+                  for data in results]
+        if days is None:
+            days = max((len(forecast) for forecast in usable), default=1) or 1
+        levels = np.full((len(results), len(POLLEN_TYPES), days), MISSING, dtype=np.uint8)
+        dates = [None] * days
+        for row, forecast in enumerate(usable):
+            for day, entry in enumerate(forecast[:days]):
+                dates[day] = dates[day] or entry.get('date')
+                for item in entry['pollen_items']:
+                    column = TYPE_INDEX.get(item['type'])
+                    if column is not None:
+                        levels[row, column, day] = _level(item['concentration'])
+        return cls(levels, [data['city'] for data in results], dates)
+
+    def level(self, city, pollen_type, day=0):
+        """
+        Get one level
+
+        Args:
+            city (str): City slug
+            pollen_type (str): Pollen type, German name (e.g. Birke)
+            day (int): Forecast day, 0 for today
+
+        Returns:
+            int: Level 0-3, None without data
+        """
+        value = int(self.levels[self.city_index[city], TYPE_INDEX[pollen_type], day])
+        return None if value == MISSING else value
+
+    def pollen_items(self, city, day=0):
+        """
+        Get the levels of a city in the scrape result format
+
+        Args:
+            city (str): City slug
+            day (int): Forecast day, 0 for today
+
+        Returns:
+            list: Dicts with 'type' and 'concentration', without the types that have no data
+        """
+        row = self.levels[self.city_index[city], :, day]
+        return [{'type': pollen_type, 'concentration': str(value)}
+                for pollen_type, value in zip(POLLEN_TYPES, row.tolist()) if value != MISSING]
+
+    def states(self, index_path=None):
+        """
+        Group the cities by federal state
+
+        Args:
+            index_path (str): City index file, defaults to pollen_cities.INDEX_PATH
+
+        Returns:
+            tuple: (states, inverse): sorted state names, and the position
+                in `states` of every city's state
+        """
+        from pollen_cities import city_info
+
+        if self._states is None:
+            np = _numpy()
+            names = []
+            for city in self.cities:
+                info = city_info(city, index_path)
+                names.append(info['state'] if info else 'Unknown')
+            states, inverse = np.unique(np.array(names, dtype=object), return_inverse=True)
+            self._states = (states.tolist(), inverse)
+        return self._states
+
+    def _by_state(self, day):
+        # (states, group starts, levels with MISSING as 0, valid mask), the rows sorted by state
+        np = _numpy()
+        states, inverse = self.states()
+        order = np.argsort(inverse, kind='stable')
+        sorted_states = inverse[order]
+        starts = np.flatnonzero(np.r_[True, sorted_states[1:] != sorted_states[:-1]]) if len(order) else order
+        values = self.levels[order, :, day]
+        valid = values != MISSING
+        return states, starts, np.where(valid, values, 0), valid
+
+    def state_max(self, day=0):
+        """
+        Highest level per federal state and pollen type
+
+        Args:
+            day (int): Forecast day, 0 for today
+
+        Returns:
+            tuple: (states, levels): state names and a uint8 array of shape
+                (states, types), MISSING where no city of the state has data
+        """
+        np = _numpy()
+        states, starts, values, valid = self._by_state(day)
+        if not len(starts):
+            return states, np.zeros((0, len(POLLEN_TYPES)), dtype=np.uint8)
+        highest = np.maximum.reduceat(values, starts, axis=0)
+        counts = np.add.reduceat(valid.astype(np.uint32), starts, axis=0)
+        return states, np.where(counts > 0, highest, MISSING).astype(np.uint8)
+
+    def state_mean(self, day=0):
+        """
+        Mean level per federal state and pollen type, over the cities with data
+
+        Args:
+            day (int): Forecast day, 0 for today
+
+        Returns:
+            tuple: (states, means): state names and a float32 array of shape
+                (states, types), NaN where no city of the state has data
+        """
+        np = _numpy()
+        states, starts, values, valid = self._by_state(day)
+        if not len(starts):
+            return states, np.zeros((0, len(POLLEN_TYPES)), dtype=np.float32)
+        sums = np.add.reduceat(values.astype(np.uint32), starts, axis=0)
+        counts = np.add.reduceat(valid.astype(np.uint32), starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return states, (sums / counts).astype(np.float32)
+
+    def hotspots(self, n=10, day=0, pollen_type=None):
+        """
+        Cities with the highest levels per pollen type
+
+        Cities with level 0 or without data are left out; cities with the
+        same level keep their order in the matrix.
+
+        Args:
+            n (int): Cities per pollen type
+            day (int): Forecast day, 0 for today
+            pollen_type (str): Only this pollen type
+
+        Returns:
+            dict: Pollen type -> list of (city, level), highest first
+        """
+        np = _numpy()
+        values = self.levels[:, :, day]
+        ranked = np.where(values == MISSING, 0, values)
+        order = np.argsort(-ranked.astype(np.int16), axis=0, kind='stable')[:n]
+        top = np.take_along_axis(ranked, order, axis=0)
+        types = [pollen_type] if pollen_type else POLLEN_TYPES
+        result = {}
+        for name in types:
+            column = TYPE_INDEX[name]
+            result[name] = [(self.cities[row], level) for row, level
+                            in zip(order[:, column].tolist(), top[:, column].tolist()) if level > 0]
+        return result
+
+    def deltas(self):
+        """
+        Level changes from each forecast day to the next
+
+        Returns:
+            numpy.ndarray: int8 array of shape (cities, types, days - 1),
+                0 where either day has no data
+        """
+        np = _numpy()
+        today, tomorrow = self.levels[:, :, :-1], self.levels[:, :, 1:]
+        change = tomorrow.astype(np.int8) - today.astype(np.int8)
+        return np.where((today == MISSING) | (tomorrow == MISSING), 0, change).astype(np.int8)
+
+    def changes_since(self, previous, day=0):
+        """
+        Level changes since an earlier snapshot
+
+        Args:
+            previous (PollenMatrix): Earlier snapshot, e.g. yesterday's file
+            day (int): Forecast day compared in both snapshots
+
+        Returns:
+            numpy.ndarray: int8 array of shape (cities, types) in this
+                matrix's city order, 0 where either snapshot has no data
+        """
+        np = _numpy()
+        rows = np.array([previous.city_index.get(city, -1) for city in self.cities], dtype=np.intp)
+        before = np.full((len(self.cities), len(POLLEN_TYPES)), MISSING, dtype=np.uint8)
+        known = rows >= 0
+        if day < previous.levels.shape[2]:
+            before[known] = previous.levels[rows[known], :, day]
+        now = self.levels[:, :, day]
+        change = now.astype(np.int8) - before.astype(np.int8)
+        return np.where((now == MISSING) | (before == MISSING), 0, change).astype(np.int8)
+
+    def save(self, path):
+        """
+        Write the matrix to a file, replacing it atomically
+
+        Args:
+            path (str): Output file
+        """
+        header = json.dumps({
+            'version': FILE_VERSION,
+            'shape': list(self.levels.shape),
+            'types': list(POLLEN_TYPES),
+            'cities': self.cities,
+            'dates': self.dates,
+            'created_at': self.created_at,
+        }, ensure_ascii=False).encode('utf-8')
+        prefix = len(FILE_MAGIC) + 4 + len(header)
+        padding = b' ' * (-prefix % DATA_ALIGNMENT)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(FILE_MAGIC + struct.pack('<I', len(header) + len(padding)) + header + padding)
+            f.write(_numpy().ascontiguousarray(self.levels).tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Open a matrix file
+
+        Args:
+            path (str): Matrix file
+            mmap (bool): Map the levels read-only instead of reading them into memory
+
+        Returns:
+            PollenMatrix: The snapshot
+
+        Raises:
+            ValueError: If the file is not a matrix file or its pollen types differ
+        """
+        np = _numpy()
+        with open(path, 'rb') as f:
+            magic = f.read(len(FILE_MAGIC))
+            if magic != FILE_MAGIC:
+                raise ValueError(f"Not a pollen matrix file: {path}")
+            length, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length))
+            offset = f.tell()
+            shape = tuple(header['shape'])
+            if header['types'] != list(POLLEN_TYPES):
+                raise ValueError(f"Pollen types of {path} differ from this version")
+            if mmap:
+                levels = np.memmap(f, dtype=np.uint8, mode='r', offset=offset, shape=shape)
+            else:
+                levels = np.fromfile(f, dtype=np.uint8, count=int(np.prod(shape))).reshape(shape)
+        return cls(levels, header['cities'], header['dates'], header['created_at'])
+
+def main(args=None):
+    """
+    Query a matrix file from the command line
+
+    Args:
+        args (list): Command line arguments
+
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(prog='pollen_scraper.py matrix', description='Aggregate a national pollen snapshot')
+    parser.add_argument('--file', type=str, default=os.environ.get('POLLEN_MATRIX', 'pollen_matrix.pollen'),
+                        help='Matrix file (or POLLEN_MATRIX environment variable)')
+    parser.add_argument('--day', type=int, default=0, help='Forecast day, 0 for today')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    states_parser = subparsers.add_parser('states', help='Highest and mean level per federal state')
+    states_parser.add_argument('--type', type=str, required=True, help='Pollen type, German name (e.g. Birke)')
+    top_parser = subparsers.add_parser('top', help='Cities with the highest levels')
+    top_parser.add_argument('--type', type=str, help='Pollen type, all types if not given')
+    top_parser.add_argument('-n', type=int, default=10, help='Cities per pollen type')
+    subparsers.add_parser('deltas', help='Cities whose levels change on the next forecast day')
+    subparsers.add_parser('info', help='Print a summary of the file')
+
+    args = parser.parse_args(args if args is not None else sys.argv[1:])
+
+    if not os.path.exists(args.file):
+        print(f"Matrix file not found: {args.file}", file=sys.stderr)
+        return 1
+    if getattr(args, 'type', None) and args.type not in TYPE_INDEX:
+        print(f"Unknown pollen type: {args.type} (known: {', '.join(POLLEN_TYPES)})", file=sys.stderr)
+        return 1
+
+    matrix = PollenMatrix.load(args.file)
+    if not 0 <= args.day < matrix.levels.shape[2]:
+        print(f"The file has {matrix.levels.shape[2]} forecast days", file=sys.stderr)
+        return 1
+
+    if args.command == 'info':
+        print(f"cities: {len(matrix.cities)}")
+        print(f"days: {', '.join(str(date) for date in matrix.dates)}")
+        print(f"created_at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(matrix.created_at))}")
+        print(f"file_bytes: {os.path.getsize(args.file)}")
+    elif args.command == 'states':
+        column = TYPE_INDEX[args.type]
+        states, highest = matrix.state_max(args.day)
+        _, means = matrix.state_mean(args.day)
+        for state, top, mean in zip(states, highest[:, column].tolist(), means[:, column].tolist()):
+            if top != MISSING:
+                print(f"{state:25s} max {top}  mean {mean:.2f}")
+    elif args.command == 'top':
+        for pollen_type, cities in matrix.hotspots(args.n, args.day, args.type).items():
+            if cities:
+                print(f"{pollen_type}: {', '.join(f'{city} ({level})' for city, level in cities)}")
+    else:
+        if args.day >= matrix.levels.shape[2] - 1:
+            print(f"No forecast day after day {args.day}", file=sys.stderr)
+            return 1
+        change = matrix.deltas()[:, :, args.day]
+        for row, column in zip(*change.nonzero()):
+            print(f"{matrix.cities[row]:20s} {POLLEN_TYPES[column]:12s} {int(change[row, column]):+d}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
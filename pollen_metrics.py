@@ -0,0 +1,225 @@
+"""
+Per-stage timings and counters
+
+Every stage of a run (HTTP connect, download, parse, render, SMTP connect,
+auth and send) is timed, in total and per city or recipient, and events
+such as the backup parser or default data being used are counted. The
+collected metrics can be written as a Prometheus textfile (for the node
+exporter textfile collector) or as JSON.
+
+Stages:
+    http_connect   DNS lookup, TCP and TLS handshake of new HTTP connections
+    download       HTTP request until the body is read, includes http_connect
+                   when a new connection was needed
+    parse          Parsing one page
+    stream         Reading and parsing one page together when streaming,
+                   up to the end of the pollen section
+    render         Rendering one email body
+    smtp_connect   Opening an SMTP connection, including STARTTLS
+    smtp_auth      SMTP login
+    smtp_send      Sending one message over an open connection
+    serve          Answering one request in serve mode
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class Metrics:
+    """
+    Thread-safe collection of stage timings and counters
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything collected so far
+        """
+        with self._lock:
+            self.started_at = time.time()
+            self.stages = {}
+            self.cities = {}
+            self.recipients = {}
+            self.counters = {}
+
+    def observe(self, stage, seconds, city=None, recipient=None):
+        """
+        Record the duration of one stage
+
+        Args:
+            stage (str): Stage name
+            seconds (float): Duration
+            city (str): City the work was done for
+            recipient (str): Email recipient the work was done for
+        """
+        with self._lock:
+            summary = self.stages.get(stage)
+            if summary is None:
+                summary = self.stages[stage] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            summary['count'] += 1
+            summary['seconds'] += seconds
+            if seconds > summary['max_seconds']:
+                summary['max_seconds'] = seconds
+            if city is not None:
+                per_city = self.cities.setdefault(city, {})
+                per_city[stage] = per_city.get(stage, 0.0) + seconds
+            if recipient is not None:
+                per_recipient = self.recipients.setdefault(recipient, {})
+                per_recipient[stage] = per_recipient.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage, city=None, recipient=None):
+        """
+        Time the body of a with block as one stage, also when it raises
+
+        Args:
+            stage (str): Stage name
+            city (str): City the work is done for
+            recipient (str): Email recipient the work is done for
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, city, recipient)
+
+    def inc(self, counter, value=1, **labels):
+        """
+        Increase a counter
+
+        Args:
+            counter (str): Counter name
+            value (int): Amount to add
+            **labels: Label values, e.g. city='berlin'
+        """
+        key = (counter, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        """
+        Get everything collected so far
+
+        Returns:
+            dict: 'started_at', 'stages' (stage -> count, seconds, max_seconds),
+                'cities' and 'recipients' (name -> stage -> seconds) and
+                'counters' (list of dicts with 'name', 'labels' and 'value')
+        """
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'stages': {stage: dict(summary) for stage, summary in self.stages.items()},
+                'cities': {city: dict(stages) for city, stages in self.cities.items()},
+                'recipients': {email: dict(stages) for email, stages in self.recipients.items()},
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+            }
+
+    def to_json(self):
+        """
+        Format the metrics as JSON
+
+        Returns:
+            str: The snapshot as JSON
+        """
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """
+        Format the metrics in the Prometheus text exposition format
+
+        Per-recipient timings are left out to keep the number of series
+        small, they are only in the JSON output.
+
+        Returns:
+            str: Prometheus text
+        """
+        snap = self.snapshot()
+        lines = [
+            '# HELP pollen_stage_seconds_total Time spent per stage.',
+            '# TYPE pollen_stage_seconds_total counter',
+        ]
+        stages = snap['stages'].items()
+        lines += [f'pollen_stage_seconds_total{{stage="{stage}"}} {s["seconds"]:.6f}' for stage, s in stages]
+        lines += ['# HELP pollen_stage_count_total Number of timed operations per stage.',
+                  '# TYPE pollen_stage_count_total counter']
+        lines += [f'pollen_stage_count_total{{stage="{stage}"}} {s["count"]}' for stage, s in stages]
+        lines += ['# HELP pollen_stage_max_seconds Slowest single operation per stage.',
+                  '# TYPE pollen_stage_max_seconds gauge']
+        lines += [f'pollen_stage_max_seconds{{stage="{stage}"}} {s["max_seconds"]:.6f}' for stage, s in stages]
+        lines += ['# HELP pollen_city_stage_seconds_total Time spent per city and stage.',
+                  '# TYPE pollen_city_stage_seconds_total counter']
+        for city, stages in sorted(snap['cities'].items()):
+            for stage, seconds in stages.items():
+                lines.append(
+                    f'pollen_city_stage_seconds_total{{city="{_escape(city)}",stage="{stage}"}} {seconds:.6f}'
+                )
+
+        typed = set()
+        for counter in snap['counters']:
+            name = f"pollen_{counter['name']}_total"
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            labels = ','.join(f'{key}="{_escape(str(value))}"' for key, value in counter['labels'].items())
+            lines.append(f"{name}{{{labels}}} {counter['value']}" if labels else f"{name} {counter['value']}")
+
+        lines += ['# TYPE pollen_metrics_start_time_seconds gauge',
+                  f"pollen_metrics_start_time_seconds {snap['started_at']:.3f}"]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the metrics to a file, replacing it atomically
+
+        Files ending in .json get JSON, anything else (e.g. .prom) the
+        Prometheus text format.
+
+        Args:
+            path (str): Output file
+        """
+        content = self.to_json() + '\n' if path.endswith('.json') else self.to_prometheus()
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Metrics of this process
+METRICS = Metrics()
+
+def instrument_http_adapter(adapter, metrics=METRICS):
+    """
+    Time the connection setup of a requests HTTPAdapter as the http_connect stage
+
+    Args:
+        adapter (requests.adapters.HTTPAdapter): Adapter to instrument
+        metrics (Metrics): Where to record the timings
+
+    Returns:
+        requests.adapters.HTTPAdapter: The same adapter
+    """
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def timed(connection_class):
+        class TimedConnection(connection_class):
+            def connect(self):
+                with metrics.timer('http_connect'):
+                    super().connect()
+                metrics.inc('http_connections')
+        return TimedConnection
+
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': type('TimedHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': timed(HTTPConnection)}),
+        'https': type('TimedHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': timed(HTTPSConnection)}),
+    }
+    return adapter
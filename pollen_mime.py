@@ -0,0 +1,200 @@
+"""
+Email messages serialized once for many recipients
+
+Building a MIMEMultipart, encoding the HTML part and flattening the message
+costs far more CPU than sending it over an open SMTP connection. A subscriber
+list gets the same body for every (city, language), so PreparedMessage does
+that work once and keeps the serialized bytes; each recipient only gets its
+own To, Message-ID and Date headers in front of them.
+"""
+import hashlib
+import time
+from html.parser import HTMLParser
+
+# To header of messages sent to several recipients in one SMTP transaction,
+# so the recipients do not see each other's addresses
+UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+
+# Tags that start a new line in the plain-text alternative
+BLOCK_TAGS = frozenset(['br', 'div', 'h1', 'h2', 'h3', 'h4', 'li', 'p', 'table', 'tr'])
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.lines = ['']
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('style', 'script', 'head'):
+            self.skip += 1
+        elif tag in BLOCK_TAGS:
+            self.lines.append('')
+        elif tag == 'td':
+            self.lines[-1] += ' '
+
+    def handle_endtag(self, tag):
+        if tag in ('style', 'script', 'head'):
+            self.skip = max(0, self.skip - 1)
+        elif tag in BLOCK_TAGS:
+            self.lines.append('')
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.lines[-1] += data
+
+def html_to_text(html):
+    """
+    Turn an email body into plain text for the text/plain alternative
+
+    Args:
+        html (str): HTML email body
+
+    Returns:
+        str: Text with one line per block element, without empty lines
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = (' '.join(line.split()) for line in extractor.lines)
+    return '\n'.join(line for line in lines if line) + '\n'
+
+class PreparedMessage:
+    """
+    An email whose body is encoded and serialized once
+
+    `digest` identifies the content (sender, subject and body), unlike
+    `data`, whose MIME boundary is random.
+
+    Args:
+        content (str): HTML body
+        from_addr (str): Sender address, also the envelope sender
+        sender_name (str): Sender display name
+        subject (str): Subject line
+        plain_text (bool): Add a text/plain alternative generated from the HTML
+    """
+
+    def __init__(self, content, from_addr, sender_name, subject, plain_text=False):
+        from email.generator import BytesGenerator
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        from email.utils import formataddr
+        from io import BytesIO
+
+        # Same structure as build_message, plus the optional text part
+        if plain_text:
+            msg = MIMEMultipart('alternative')
+            msg.attach(MIMEText(html_to_text(content), 'plain'))
+        else:
+            msg = MIMEMultipart()
+        msg['From'] = formataddr((sender_name, from_addr))
+        msg['Subject'] = subject
+        msg.attach(MIMEText(content, 'html'))
+
+        # Flattened the way smtplib.send_message does it
+        self.policy = msg.policy.clone(linesep='\r\n')
+        buffer = BytesIO()
+        BytesGenerator(buffer, policy=self.policy).flatten(msg, linesep='\r\n')
+        self.data = buffer.getvalue()
+        self.from_addr = from_addr
+        self.domain = from_addr.rpartition('@')[2] or None
+        self.digest = hashlib.sha256(
+            '\0'.join([from_addr, sender_name, subject, content, str(bool(plain_text))]).encode('utf-8')
+        ).hexdigest()
+        self._date = (None, b'')
+
+    @classmethod
+    def restore(cls, data, from_addr, digest=None):
+        """
+        Recreate a prepared message from its serialized bytes, e.g. from the outbox
+
+        Args:
+            data (bytes): The `data` of a PreparedMessage
+            from_addr (str): Envelope sender
+            digest (str): The `digest` of the message
+
+        Returns:
+            PreparedMessage: Message that sends `data`
+        """
+        from email import policy
+
+        message = cls.__new__(cls)
+        message.policy = policy.compat32.clone(linesep='\r\n')
+        message.data = data
+        message.from_addr = from_addr
+        message.domain = from_addr.rpartition('@')[2] or None
+        message.digest = digest
+        message._date = (None, b'')
+        return message
+
+    def make_message_id(self):
+        """
+        Create a new Message-ID in the sender's domain
+
+        Returns:
+            str: Message-ID, with angle brackets
+        """
+        from email.utils import make_msgid
+
+        return make_msgid(domain=self.domain)
+
+    def _header(self, name, value):
+        if value.isascii() and '\r' not in value and '\n' not in value:
+            return f"{name}: {value}\r\n".encode('ascii')
+        return self.policy.fold_binary(name, value)
+
+    def _date_header(self):
+        # Formatting the date costs more than the rest of the headers, it only changes once a second
+        from email.utils import formatdate
+
+        now = int(time.time())
+        if self._date[0] != now:
+            self._date = (now, f"Date: {formatdate(now, localtime=True)}\r\n".encode('ascii'))
+        return self._date[1]
+
+    def render(self, to, message_id=None):
+        """
+        Get the message for one SMTP transaction
+
+        Args:
+            to (str): To header, e.g. the recipient's address or UNDISCLOSED_RECIPIENTS
+            message_id (str): Message-ID header, a new one if None
+
+        Returns:
+            bytes: Complete message with CRLF line endings
+        """
+        return (self._header('To', to) + self._header('Message-ID', message_id or self.make_message_id())
+                + self._date_header() + self.data)
+
+    def send(self, server, to_addrs, to=None, message_id=None):
+        """
+        Send the message over an open SMTP connection
+
+        Args:
+            server (smtplib.SMTP): Connected session
+            to_addrs (list): Envelope recipients
+            to (str): To header, defaults to the recipient for a single
+                recipient and UNDISCLOSED_RECIPIENTS otherwise
+            message_id (str): Message-ID header, a new one if None; a
+                message sent again (e.g. after a crash) keeps its Message-ID
+
+        Returns:
+            dict: Recipients that were refused, see smtplib.SMTP.sendmail
+        """
+        if to is None:
+            to = to_addrs[0] if len(to_addrs) == 1 else UNDISCLOSED_RECIPIENTS
+        return server.sendmail(self.from_addr, to_addrs, self.render(to, message_id))
+
+def split_recipients(recipients, per_transaction=1):
+    """
+    Group recipients into SMTP transactions
+
+    Args:
+        recipients (list): Recipient addresses
+        per_transaction (int): Recipients per transaction; servers commonly
+            accept up to 100 RCPT commands per message
+
+    Returns:
+        list: Lists of recipient addresses
+    """
+    per_transaction = max(1, per_transaction)
+    return [recipients[i:i + per_transaction] for i in range(0, len(recipients), per_transaction)]
@@ -0,0 +1,455 @@
+"""
+Durable outbox for email delivery
+
+Rendered emails are written to a SQLite outbox before anything is sent,
+and drain() delivers them in batches over the pooled SMTP connections. A
+failed or interrupted run does not lose its emails: the next run (or
+`--drain-only`) sends what is left, without scraping and rendering again.
+
+Every message has a state:
+
+    pending   waiting to be sent, possibly after a failed attempt
+    sending   claimed by a drain
+    sent      accepted by the SMTP server
+    failed    rejected permanently (5xx) or out of attempts
+
+Temporary failures are retried with exponential backoff. Messages are keyed
+by their run, content and recipients, so enqueuing the same email again in
+the same run does not send it twice. Unless a run id is given, it is derived
+from the job and its scheduled slot (see default_run_id): a job restarted
+after a crash gets the same run id and only sends what is missing, while
+the next scheduled slot sends again. A message
+left in 'sending' by a process that died is released after `lease` seconds
+and sent again with the same Message-ID, so at most one batch can be
+delivered twice.
+
+Usage:
+    python pollen_scraper.py outbox --db pollen_outbox.sqlite status
+    python pollen_scraper.py outbox --db pollen_outbox.sqlite retry-failed
+    python pollen_scraper.py outbox --db pollen_outbox.sqlite purge --days 7
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+def is_permanent_error(error):
+    """
+    Check whether a send failed for good
+
+    Args:
+        error (Exception): Error raised while sending
+
+    Returns:
+        bool: True for 5xx SMTP replies (including refused recipients), which
+            are not retried
+    """
+    import smtplib
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    code = getattr(error, 'smtp_code', None)
+    return isinstance(code, int) and 500 <= code < 600
+
+def default_run_id(job='', slot=None):
+    """
+    Get the run id of a job that was not given one
+
+    Runs of the same job in the same slot get the same id, so a run that is
+    started again after a crash does not send what the first one sent.
+
+    Args:
+        job (str): Job name, e.g. the subscriber list or the cities
+        slot (datetime.datetime): Scheduled time of the run, None for the current day
+
+    Returns:
+        str: Run id, e.g. '2026-04-17 subscribers.csv' or '2026-04-17T06:00 berlin'
+    """
+    when = f"{slot:%Y-%m-%dT%H:%M}" if slot else f"{datetime.date.today():%Y-%m-%d}"
+    return f"{when} {job}".rstrip()
+
+class Outbox:
+    """
+    SQLite queue of prepared emails with per-message delivery state
+
+    Args:
+        path (str): SQLite file
+        max_attempts (int): Attempts before a message is marked failed
+        backoff (float): Delay before the first retry in seconds, doubled after every retry
+        max_backoff (float): Longest delay between two attempts
+        lease (float): Seconds after which a claimed message that was
+            neither sent nor released is considered abandoned
+        max_wait (float): Seconds drain() waits for retries that are not due yet
+        batch_size (int): Messages claimed and sent per batch
+        run_id (str): Run the enqueued messages belong to, the current day
+            if None; see default_run_id
+    """
+
+    def __init__(self, path, max_attempts=8, backoff=30.0, max_backoff=3600.0, lease=600.0, max_wait=300.0,
+                 batch_size=100, run_id=None):
+        self.path = path
+        self.run_id = run_id or default_run_id()
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        # isolation_level=None: transactions are opened explicitly, claims use BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS bodies (
+                digest TEXT PRIMARY KEY,
+                from_addr TEXT NOT NULL,
+                data BLOB NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                digest TEXT NOT NULL REFERENCES bodies (digest),
+                recipients TEXT NOT NULL,
+                to_header TEXT,
+                message_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                claimed_at REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS messages_due ON messages (state, next_attempt_at);
+        """)
+        self._bodies = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        # Write transaction, taking the database lock up front so concurrent drains do not claim the same rows
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def start_run(self, run_id=None):
+        """
+        Start a new run, messages enqueued from now on are not deduplicated against other runs
+
+        Args:
+            run_id (str): Run id, the current day if None
+
+        Returns:
+            str: The run id
+        """
+        self.run_id = run_id or default_run_id()
+        return self.run_id
+
+    @staticmethod
+    def message_key(prepared, to_addrs, run_id=''):
+        """
+        Get the idempotency key of a message
+
+        Args:
+            prepared (pollen_mime.PreparedMessage): Message
+            to_addrs (list): Envelope recipients
+            run_id (str): Run the message belongs to
+
+        Returns:
+            str: Key that is the same for the same run, content and recipients
+        """
+        return hashlib.sha256('\n'.join([run_id, prepared.digest] + sorted(to_addrs)).encode('utf-8')).hexdigest()
+
+    def enqueue_many(self, transactions):
+        """
+        Add messages to the outbox in one transaction
+
+        Messages that are already in the outbox (in any state) for the
+        current run are not added again.
+
+        Args:
+            transactions (list): (PreparedMessage, to_addrs) or
+                (PreparedMessage, to_addrs, to) tuples, as for SMTPPool.send_batch
+
+        Returns:
+            list: Key of every message, in order
+        """
+        now = time.time()
+        keys = []
+        added = 0
+        with self._transaction() as db:
+            for transaction in transactions:
+                prepared, to_addrs = transaction[0], list(transaction[1])
+                to = transaction[2] if len(transaction) > 2 else None
+                key = self.message_key(prepared, to_addrs, self.run_id)
+                keys.append(key)
+                db.execute(
+                    "INSERT OR IGNORE INTO bodies (digest, from_addr, data, created_at) VALUES (?, ?, ?, ?)",
+                    (prepared.digest, prepared.from_addr, prepared.data, now)
+                )
+                added += db.execute(
+                    "INSERT OR IGNORE INTO messages (key, digest, recipients, to_header, message_id, state, "
+                    "next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, prepared.digest, json.dumps(to_addrs), to, prepared.make_message_id(), PENDING, now, now)
+                ).rowcount
+                self._bodies.setdefault(prepared.digest, prepared)
+        if added < len(keys):
+            logging.warning(f"Outbox: {len(keys) - added} of {len(keys)} messages were already queued or sent "
+                            f"in run {self.run_id}, they are not sent again")
+        return keys
+
+    def _claim(self, limit):
+        # Mark up to `limit` due messages as sending, after releasing abandoned claims
+        now = time.time()
+        with self._transaction() as db:
+            released = db.execute(
+                "UPDATE messages SET state = ?, claimed_at = NULL WHERE state = ? AND claimed_at < ?",
+                (PENDING, SENDING, now - self.lease)
+            ).rowcount
+            rows = db.execute(
+                "SELECT id, digest, recipients, to_header, message_id, attempts FROM messages "
+                "WHERE state = ? AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                (PENDING, now, limit)
+            ).fetchall()
+            db.executemany("UPDATE messages SET state = ?, claimed_at = ? WHERE id = ?",
+                           [(SENDING, now, row[0]) for row in rows])
+        if released:
+            logging.warning(f"Outbox: released {released} messages abandoned while sending, they are sent again")
+        return rows
+
+    def _body(self, digest):
+        from pollen_mime import PreparedMessage
+
+        prepared = self._bodies.get(digest)
+        if prepared is None:
+            with self._lock:
+                from_addr, data = self._db.execute(
+                    "SELECT from_addr, data FROM bodies WHERE digest = ?", (digest,)
+                ).fetchone()
+            prepared = self._bodies[digest] = PreparedMessage.restore(data, from_addr, digest)
+        return prepared
+
+    def _finish(self, rows, errors):
+        # Record the outcome of a sent batch, returns (sent, retried, failed) counts
+        now = time.time()
+        updates = []
+        counts = [0, 0, 0]
+        for (message, _, recipients, _, _, attempts), error in zip(rows, errors):
+            attempts += 1
+            if error is None:
+                updates.append((SENT, attempts, now, None, now, message))
+                counts[0] += 1
+            elif is_permanent_error(error) or attempts >= self.max_attempts:
+                updates.append((FAILED, attempts, now, str(error), None, message))
+                counts[2] += 1
+                logging.error(f"Outbox: giving up on {recipients} after {attempts} attempts: {error}")
+            else:
+                delay = random.uniform(0.5, 1.0) * min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+                updates.append((PENDING, attempts, now + delay, str(error), None, message))
+                counts[1] += 1
+        with self._transaction() as db:
+            db.executemany(
+                "UPDATE messages SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, sent_at = ?, "
+                "claimed_at = NULL WHERE id = ?",
+                updates
+            )
+        return counts
+
+    def next_due(self):
+        """
+        Get the time the next pending message is due
+
+        Returns:
+            float: Unix time, None if nothing is pending
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM messages WHERE state = ?", (PENDING,)
+            ).fetchone()[0]
+
+    def drain(self, pool, max_wait=None):
+        """
+        Send the due messages in batches
+
+        Retries that become due within `max_wait` seconds are waited for;
+        later ones stay in the outbox for the next drain.
+
+        Args:
+            pool (pollen_smtp.SMTPPool): Connection pool to send through
+            max_wait (float): Seconds to wait for retries, defaults to `max_wait`
+
+        Returns:
+            dict: Number of messages 'sent', 'retried' (will be tried again)
+                and 'failed' (given up on)
+        """
+        deadline = time.time() + (self.max_wait if max_wait is None else max_wait)
+        stats = {'sent': 0, 'retried': 0, 'failed': 0}
+        while True:
+            rows = self._claim(self.batch_size)
+            if not rows:
+                due = self.next_due()
+                if due is None or due > deadline:
+                    break
+                time.sleep(max(0.0, due - time.time()))
+                continue
+            errors = pool.send_batch([
+                (self._body(digest), json.loads(recipients), to, message_id)
+                for _, digest, recipients, to, message_id, _ in rows
+            ])
+            sent, retried, failed = self._finish(rows, errors)
+            stats['sent'] += sent
+            stats['retried'] += retried
+            stats['failed'] += failed
+        if any(stats.values()):
+            logging.info(f"Outbox: sent {stats['sent']}, {stats['retried']} retries scheduled, {stats['failed']} failed")
+        return stats
+
+    def states(self, keys):
+        """
+        Get the state of messages
+
+        Args:
+            keys (list): Message keys, see enqueue_many
+
+        Returns:
+            dict: Key -> state
+        """
+        result = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                result.update(self._db.execute(
+                    f"SELECT key, state FROM messages WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return result
+
+    def status(self):
+        """
+        Summarize the outbox
+
+        Returns:
+            dict: Number of messages per state, the time the next pending
+                message is due and the most recent errors
+        """
+        with self._lock:
+            counts = dict(self._db.execute("SELECT state, COUNT(*) FROM messages GROUP BY state").fetchall())
+            errors = self._db.execute(
+                "SELECT recipients, state, attempts, last_error FROM messages WHERE last_error IS NOT NULL "
+                "AND state != ? ORDER BY next_attempt_at DESC LIMIT 10", (SENT,)
+            ).fetchall()
+        summary = {state: counts.get(state, 0) for state in (PENDING, SENDING, SENT, FAILED)}
+        summary['next_due'] = self.next_due()
+        summary['errors'] = [
+            {'recipients': json.loads(recipients), 'state': state, 'attempts': attempts, 'error': error}
+            for recipients, state, attempts, error in errors
+        ]
+        return summary
+
+    def retry_failed(self):
+        """
+        Queue the failed messages again
+
+        Returns:
+            int: Number of messages queued
+        """
+        with self._lock:
+            count = self._db.execute(
+                "UPDATE messages SET state = ?, attempts = 0, next_attempt_at = ? WHERE state = ?",
+                (PENDING, time.time(), FAILED)
+            ).rowcount
+        return count
+
+    def purge(self, older_than):
+        """
+        Delete sent and failed messages, and bodies no message uses any more
+
+        Purged messages are forgotten, the same email could be queued again.
+
+        Args:
+            older_than (float): Age in seconds
+
+        Returns:
+            int: Number of messages deleted
+        """
+        with self._transaction() as db:
+            count = db.execute(
+                "DELETE FROM messages WHERE state IN (?, ?) AND created_at < ?", (SENT, FAILED, time.time() - older_than)
+            ).rowcount
+            db.execute("DELETE FROM bodies WHERE digest NOT IN (SELECT digest FROM messages)")
+        self._bodies.clear()
+        return count
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self._lock:
+            self._db.close()
+
+def main(args=None):
+    """
+    Inspect and maintain the outbox from the command line
+
+    Args:
+        args (list): Command line arguments
+
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(prog='pollen_scraper.py outbox', description='Inspect the email outbox')
+    parser.add_argument('--db', type=str, default=os.environ.get('POLLEN_OUTBOX', 'pollen_outbox.sqlite'),
+                        help='Outbox file (or POLLEN_OUTBOX environment variable)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='Print the number of messages per state and recent errors')
+    subparsers.add_parser('retry-failed', help='Queue the failed messages again')
+    purge_parser = subparsers.add_parser('purge', help='Delete old sent and failed messages')
+    purge_parser.add_argument('--days', type=float, default=7, help='Delete messages older than this many days')
+
+    args = parser.parse_args(args if args is not None else sys.argv[1:])
+
+    if not os.path.exists(args.db):
+        print(f"Outbox file not found: {args.db}", file=sys.stderr)
+        return 1
+
+    with Outbox(args.db) as outbox:
+        if args.command == 'retry-failed':
+            print(f"Queued {outbox.retry_failed()} failed messages again")
+        elif args.command == 'purge':
+            print(f"Deleted {outbox.purge(args.days * 86400)} messages")
+        else:
+            summary = outbox.status()
+            for state in (PENDING, SENDING, SENT, FAILED):
+                print(f"{state}: {summary[state]}")
+            if summary['next_due'] is not None:
+                print(f"next_due: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(summary['next_due']))}")
+            for error in summary['errors']:
+                print(f"{error['state']:8s} {', '.join(error['recipients'])} "
+                      f"(attempt {error['attempts']}): {error['error']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
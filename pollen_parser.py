@@ -0,0 +1,564 @@
+"""
+Parser engines for the wetteronline.de pollen page
+
+Only a handful of elements on the page matter: the headline
+(div.text-headline), the date tabs (div.tab-btn, the active one is today)
+and the pollen items (div.pollenflug-items / div.pollenflug-item). Every
+forecast day has its own div.pollenflug-items pane, matched to its tab by
+the data-tab attribute or, without it, by position. The engines below
+extract all of them in a single pass over the document:
+
+- 'lxml': lxml.html tree, fastest, needs the optional lxml package
+- 'strainer': BeautifulSoup with html.parser, restricted to the relevant
+  subtrees with a SoupStrainer
+- 'html.parser': BeautifulSoup with html.parser over the whole document
+
+- 'stream': incremental html.parser that only records the relevant
+  subtrees; parse_pollen_stream uses it to stop reading a page as soon as
+  the pollen section is complete
+
+'auto' picks 'lxml' when it is installed and 'strainer' otherwise.
+
+Large batches can be parsed in worker processes (get_pool), which return
+the small extracted dicts instead of parse trees.
+"""
+import importlib.util
+import logging
+import os
+import re
+import threading
+import time
+from html.parser import HTMLParser
+
+# Engine used when none is requested explicitly
+DEFAULT_ENGINE = os.environ.get('POLLEN_PARSER', 'auto')
+
+GRAD_CLASS_PATTERN = re.compile(r'grad-(\d)')
+
+# Classes of the elements the extraction looks at
+RELEVANT_CLASSES = frozenset(['text-headline', 'tab-btn', 'pollenflug-items', 'pollenflug-item'])
+
+def parse_concentration(grad_text, grad_classes):
+    """
+    Get the concentration level of a pollen item
+
+    Args:
+        grad_text (str): Stripped text of the div.grad element
+        grad_classes (list): Classes of the div.grad element
+
+    Returns:
+        str: Concentration level, '0' if it cannot be determined
+    """
+    # Concentration value is directly in the element text
+    if grad_text.isdigit() and 0 <= int(grad_text) <= 3:
+        return grad_text
+    # If not a number, try to extract from class name
+    for cls in grad_classes:
+        if 'grad-' in cls:
+            level_match = GRAD_CLASS_PATTERN.search(cls)
+            if level_match:
+                return level_match.group(1)
+    return '0'
+
+class _SoupBackend:
+    """
+    BeautifulSoup tree access, optionally restricted with a SoupStrainer
+    """
+
+    def __init__(self, strained):
+        self.strained = strained
+
+    def parse(self, html):
+        from bs4 import BeautifulSoup, SoupStrainer
+
+        parse_only = SoupStrainer(_is_relevant_tag) if self.strained else None
+        return BeautifulSoup(html, 'html.parser', parse_only=parse_only)
+
+    def page_title(self, root):
+        title = root.find('title')
+        return title.text if title else None
+
+    def divs(self, root):
+        return root.find_all('div')
+
+    def descendant_divs(self, element):
+        return element.find_all('div')
+
+    def classes(self, element):
+        return element.get('class') or []
+
+    def attr(self, element, name):
+        return element.get(name)
+
+    def text(self, element):
+        return element.get_text()
+
+class _LxmlBackend:
+    """
+    lxml.html tree access
+    """
+
+    def parse(self, html):
+        import lxml.html
+
+        return lxml.html.document_fromstring(html)
+
+    def page_title(self, root):
+        title = root.find('.//title')
+        return title.text_content() if title is not None else None
+
+    def divs(self, root):
+        return root.iter('div')
+
+    def descendant_divs(self, element):
+        return element.iterdescendants('div')
+
+    def classes(self, element):
+        return element.get('class', '').split()
+
+    def attr(self, element, name):
+        return element.get(name)
+
+    def text(self, element):
+        return element.text_content()
+
+class _StreamNode:
+    # A div (or the title) recorded by _StreamTreeBuilder; parts holds text and child nodes in document order
+    __slots__ = ('classes', 'attrs', 'parts')
+
+    def __init__(self, classes, attrs):
+        self.classes = classes
+        self.attrs = attrs
+        self.parts = []
+
+class _StreamTreeBuilder(HTMLParser):
+    """
+    Incremental parser that records the page title and the relevant div
+    subtrees while HTML is fed in chunk by chunk
+
+    The pollen section is complete once the headline and the active date
+    tab have been seen, no recorded div is open and either there is a
+    closed pane for every tab or other markup follows the last closed pane
+    (the panes of a page are next to each other).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.roots = []
+        # Open divs, None for the ones that are not recorded
+        self._stack = []
+        self._in_title = False
+        self._open_recorded = 0
+        self.headline_seen = False
+        self.active_tab_seen = False
+        self.tabs = 0
+        self.panes_closed = 0
+        self.panes_ended = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title' and self.title is None:
+            self.title = _StreamNode([], {})
+            self._in_title = True
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split() if tag == 'div' else []
+        if self.panes_closed and not self._open_recorded and 'pollenflug-items' not in classes:
+            self.panes_ended = True
+        if tag != 'div':
+            return
+        parent = next((node for node in reversed(self._stack) if node is not None), None) if self._open_recorded else None
+        if parent is None and RELEVANT_CLASSES.isdisjoint(classes):
+            self._stack.append(None)
+            return
+        node = _StreamNode(classes, attrs)
+        if parent is None:
+            self.roots.append(node)
+        else:
+            parent.parts.append(node)
+        self._stack.append(node)
+        self._open_recorded += 1
+        if 'tab-btn' in classes:
+            self.tabs += 1
+            if 'active' in classes:
+                self.active_tab_seen = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self._in_title = False
+        if self.panes_closed and not self._open_recorded:
+            # The element around the panes ends
+            self.panes_ended = True
+        if tag != 'div' or not self._stack:
+            return
+        node = self._stack.pop()
+        if node is None:
+            return
+        self._open_recorded -= 1
+        if 'text-headline' in node.classes:
+            self.headline_seen = True
+        if 'pollenflug-items' in node.classes:
+            self.panes_closed += 1
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title.parts.append(data)
+        if self._open_recorded:
+            next(node for node in reversed(self._stack) if node is not None).parts.append(data)
+
+    def complete(self):
+        """
+        Check whether the pollen section has been read completely
+
+        Returns:
+            bool: True once more input cannot change the extracted data
+        """
+        return (self.headline_seen and self.active_tab_seen and self.panes_closed > 0 and not self._open_recorded
+                and (self.panes_closed >= self.tabs or self.panes_ended))
+
+class _StreamBackend:
+    """
+    Access to the tree recorded by _StreamTreeBuilder
+    """
+
+    def parse(self, html):
+        builder = _StreamTreeBuilder()
+        builder.feed(html)
+        builder.close()
+        return builder
+
+    def page_title(self, root):
+        return self.text(root.title) if root.title is not None else None
+
+    def divs(self, root):
+        for node in root.roots:
+            yield node
+            yield from self.descendant_divs(node)
+
+    def descendant_divs(self, element):
+        for part in element.parts:
+            if isinstance(part, _StreamNode):
+                yield part
+                yield from self.descendant_divs(part)
+
+    def classes(self, element):
+        return element.classes
+
+    def attr(self, element, name):
+        return element.attrs.get(name)
+
+    def text(self, element):
+        return ''.join(part if isinstance(part, str) else self.text(part) for part in element.parts)
+
+def _is_relevant_tag(name, attrs):
+    # SoupStrainer callback, keeps the page title and the pollen subtrees
+    if name == 'title':
+        return True
+    if name != 'div':
+        return False
+    classes = attrs.get('class') or ''
+    if isinstance(classes, str):
+        classes = classes.split()
+    return not RELEVANT_CLASSES.isdisjoint(classes)
+
+def _lxml_available():
+    return importlib.util.find_spec('lxml') is not None
+
+ENGINES = {
+    'lxml': _LxmlBackend,
+    'strainer': lambda: _SoupBackend(strained=True),
+    'html.parser': lambda: _SoupBackend(strained=False),
+    'stream': _StreamBackend,
+}
+
+def register_engine(name, factory):
+    """
+    Register a parser engine
+
+    Args:
+        name (str): Engine name
+        factory (callable): Returns an object with the backend methods used by
+            parse_pollen_page (parse, page_title, divs, descendant_divs,
+            classes, attr, text)
+    """
+    ENGINES[name] = factory
+
+def resolve_engine(name=None):
+    """
+    Resolve an engine name to an installed engine
+
+    Args:
+        name (str): Engine name, None or 'auto' for the fastest available one
+
+    Returns:
+        str: Engine name
+    """
+    name = name or DEFAULT_ENGINE
+    if name == 'auto':
+        return 'lxml' if _lxml_available() else 'strainer'
+    if name == 'lxml' and not _lxml_available():
+        logging.warning("lxml is not installed, falling back to the strainer engine (html.parser)")
+        return 'strainer'
+    if name not in ENGINES:
+        raise ValueError(f"Unknown parser engine: {name}")
+    return name
+
+def parse_pollen_page(html, engine=None):
+    """
+    Extract the pollen forecast from a page
+
+    Args:
+        html (str): Page HTML
+        engine (str): Parser engine, see ENGINES; defaults to DEFAULT_ENGINE
+
+    Returns:
+        dict: Extracted data with keys 'page_title', 'title' and 'date'
+            (None when missing), 'pollen_items' (of the active day), 'days'
+            (one dict with 'date' and 'pollen_items' per forecast day, in
+            page order) and 'backup_used'
+    """
+    backend = ENGINES[resolve_engine(engine)]()
+    return _extract(backend, backend.parse(html))
+
+def _extract(backend, root):
+    # The extraction of parse_pollen_page on a parsed tree
+    headline = None
+    tabs = []
+    panes = []
+    all_items = []
+
+    # Single pass over all div elements in document order
+    for div in backend.divs(root):
+        classes = backend.classes(div)
+        if not classes:
+            continue
+        if headline is None and 'text-headline' in classes:
+            headline = div
+        if 'tab-btn' in classes:
+            tabs.append(div)
+        if 'pollenflug-items' in classes:
+            panes.append(div)
+        if 'pollenflug-item' in classes:
+            all_items.append(div)
+
+    # Pair every pane with its date tab
+    active_tab = next((tab for tab in tabs if 'active' in backend.classes(tab)), None)
+    tabs_by_id = {backend.attr(tab, 'data-tab'): tab for tab in tabs if backend.attr(tab, 'data-tab') is not None}
+    days = []
+    active_index = 0
+    for index, pane in enumerate(panes):
+        tab = tabs_by_id.get(backend.attr(pane, 'data-tab'))
+        if tab is None and index < len(tabs):
+            tab = tabs[index]
+        if tab is not None and tab is active_tab:
+            active_index = index
+        days.append({'date': backend.text(tab).strip() if tab is not None else None, 'pane': pane})
+
+    pollen_items = []
+    if days:
+        rows = _rows(backend, days[active_index]['pane'])
+        logging.info(f"Found {len(rows)} rows of pollen data")
+        pollen_items = _row_items(backend, rows, log=True)
+    else:
+        logging.info("Found 0 rows of pollen data")
+
+    # If no pollen data found, use every pollen item on the page
+    backup_used = False
+    if not pollen_items:
+        logging.warning("No pollen data found, trying backup parsing method")
+        backup_used = True
+        for item in all_items:
+            try:
+                name_elem, grad_elem = _name_and_grad(backend, item)
+                if name_elem is None or grad_elem is None:
+                    continue
+
+                pollen_type = backend.text(name_elem).strip()
+                concentration = parse_concentration(backend.text(grad_elem).strip(), backend.classes(grad_elem))
+
+                if pollen_type:
+                    pollen_items.append({'type': pollen_type, 'concentration': concentration})
+                    logging.info(f"Backup method found pollen: {pollen_type}, concentration: {concentration}")
+            except Exception as e:
+                logging.warning(f"Error processing pollen item with backup method: {e}")
+
+    date = backend.text(active_tab).strip() if active_tab is not None else None
+    if backup_used:
+        forecast = [{'date': date, 'pollen_items': pollen_items}] if pollen_items else []
+    else:
+        forecast = []
+        for index, day in enumerate(days):
+            items = pollen_items if index == active_index else _row_items(backend, _rows(backend, day['pane']))
+            if items:
+                forecast.append({'date': day['date'], 'pollen_items': items})
+        if len(forecast) > 1:
+            logging.info(f"Found forecast for {len(forecast)} days")
+
+    return {
+        'page_title': backend.page_title(root),
+        'title': backend.text(headline).strip() if headline is not None else None,
+        'date': date,
+        'pollen_items': pollen_items,
+        'days': forecast,
+        'backup_used': backup_used,
+    }
+
+def parse_pollen_stream(chunks, engine=None):
+    """
+    Extract the pollen forecast from a page while it is being downloaded
+
+    The chunks are fed to an incremental parser, and reading stops as soon
+    as the headline, the active date tab and the pollen panes are complete,
+    so the rest of the page never has to be downloaded. When the page ends
+    without a complete pollen section, the whole document is parsed with
+    the regular engine instead.
+
+    Args:
+        chunks (iterable): Decoded text chunks of the page
+        engine (str): Engine for the fallback, see parse_pollen_page
+
+    Returns:
+        tuple: (page, html, stopped_early): the result of parse_pollen_page,
+            the HTML read and whether reading stopped before the end
+    """
+    builder = _StreamTreeBuilder()
+    received = []
+    for chunk in chunks:
+        received.append(chunk)
+        builder.feed(chunk)
+        if builder.complete():
+            return _extract(_StreamBackend(), builder), ''.join(received), True
+    html = ''.join(received)
+    logging.info("Pollen section incomplete in streamed page, parsing the whole document")
+    return parse_pollen_page(html, engine), html, False
+
+def _rows(backend, pane):
+    # div.row elements below a pollenflug-items pane, in document order
+    return [div for div in backend.descendant_divs(pane) if 'row' in backend.classes(div)]
+
+def _row_items(backend, rows, log=False):
+    # Pollen items of the given rows
+    pollen_items = []
+    for row in rows:
+        for item in _child_items(backend, row):
+            try:
+                name_elem, grad_elem = _name_and_grad(backend, item)
+                if name_elem is None:
+                    continue
+
+                pollen_type = backend.text(name_elem).strip()
+                concentration = '0'  # Default to 0
+                if grad_elem is not None:
+                    concentration = parse_concentration(backend.text(grad_elem).strip(), backend.classes(grad_elem))
+
+                if pollen_type:
+                    pollen_items.append({'type': pollen_type, 'concentration': concentration})
+                    if log:
+                        logging.info(f"Found pollen: {pollen_type}, concentration: {concentration}")
+            except Exception as e:
+                logging.warning(f"Error processing pollen item: {e}")
+    return pollen_items
+
+def _child_items(backend, row):
+    # div.pollenflug-item elements below a row, in document order
+    return [div for div in backend.descendant_divs(row) if 'pollenflug-item' in backend.classes(div)]
+
+def _name_and_grad(backend, item):
+    # First div.name and first div.grad below a pollen item
+    name_elem = None
+    grad_elem = None
+    for div in backend.descendant_divs(item):
+        classes = backend.classes(div)
+        if name_elem is None and 'name' in classes:
+            name_elem = div
+        if grad_elem is None and 'grad' in classes:
+            grad_elem = div
+        if name_elem is not None and grad_elem is not None:
+            break
+    return name_elem, grad_elem
+
+# Worker processes for parsing large batches (see get_pool), 0 to parse in the calling thread
+DEFAULT_WORKERS = int(os.environ.get('POLLEN_PARSE_WORKERS', '0'))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# Log records of the current task in a worker process, as (level, message) pairs
+_worker_records = []
+
+class _RecordCollector(logging.Handler):
+    def emit(self, record):
+        _worker_records.append((record.levelno, record.getMessage()))
+
+def _init_worker(level):
+    # Worker processes keep their log records and hand them back with the result
+    logging.basicConfig(level=level, handlers=[_RecordCollector()], force=True)
+
+def parse_in_worker(html, engine):
+    """
+    Parse a page in a worker process
+
+    Args:
+        html (str): Page HTML
+        engine (str): Resolved parser engine name
+
+    Returns:
+        tuple: (page, seconds, records): the result of parse_pollen_page,
+            the parse time and the (level, message) pairs logged meanwhile
+    """
+    del _worker_records[:]
+    start = time.perf_counter()
+    page = parse_pollen_page(html, engine)
+    seconds = time.perf_counter() - start
+    records = list(_worker_records)
+    del _worker_records[:]
+    return page, seconds, records
+
+def get_pool(workers=None):
+    """
+    Get the shared process pool for parsing pages
+
+    Parsing is CPU-bound and holds the GIL, so threads only use one core
+    for it. The pool is started on first use, kept for later batches (e.g.
+    the runs of a daemon) and replaced when a different number of workers
+    is asked for. Workers are started with 'spawn', so engines added with
+    register_engine are only available in them when they are registered
+    when their module is imported. On a single core, handing pages to other
+    processes only adds overhead, so no pool is started there.
+
+    Args:
+        workers (int): Number of worker processes, defaults to DEFAULT_WORKERS
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: Pool, None when workers is 0
+            or the host has one CPU core
+    """
+    global _pool, _pool_workers
+    workers = DEFAULT_WORKERS if workers is None else workers
+    if workers > 0 and (os.cpu_count() or 1) < 2:
+        logging.info(f"Only one CPU core, parsing in the download threads instead of {workers} processes")
+        workers = 0
+    with _pool_lock:
+        if workers <= 0:
+            return None
+        if _pool is None or _pool_workers != workers:
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker, initargs=(logging.getLogger().getEffectiveLevel(),))
+            _pool_workers = workers
+        return _pool
+
+def shutdown_pool():
+    """
+    Stop the shared parse pool's worker processes
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+        _pool_workers = 0
@@ -0,0 +1,173 @@
+"""
+Per-subscriber alert rules
+
+A subscriber can limit their emails to the days when the pollen they are
+allergic to is high enough, e.g.
+
+    Birke >= 2 or Gräser >= 3
+    Erle ≥ 1 and Hasel ≥ 2
+    Beifuß > 1
+
+A rule is one or more alternatives joined by "or"; an alternative is one or
+more conditions joined by "and". A condition compares the level (0-3) of a
+pollen type, using the German names that scrape_pollen_data returns, with
+>=, ≥, > or =. Subscribers without a rule get every email.
+
+RuleIndex compiles the rules of a subscriber list into an inverted index
+from (city, pollen type, level) to the alternatives that a city having
+that level satisfies. After a scrape, only the index entries of the
+scraped levels are looked up, instead of evaluating every subscriber's rule.
+"""
+import re
+from functools import lru_cache
+from pollen_templates import POLLEN_TRANSLATIONS
+
+LEVELS = (0, 1, 2, 3)
+
+# German pollen type names, looked up case-insensitively
+POLLEN_TYPES = {name.lower(): name for name in POLLEN_TRANSLATIONS}
+
+CONDITION_PATTERN = re.compile(r'^\s*(?P<type>[^\W\d_]+)\s*(?P<op>>=|≥|>|=)\s*(?P<level>\d)\s*$')
+OR_PATTERN = re.compile(r'\s+or\s+', re.IGNORECASE)
+AND_PATTERN = re.compile(r'\s+and\s+', re.IGNORECASE)
+
+class RuleError(ValueError):
+    """
+    An alert rule could not be parsed
+    """
+
+@lru_cache(maxsize=4096)
+def parse_rule(text):
+    """
+    Parse an alert rule
+
+    Args:
+        text (str): Rule, e.g. 'Birke >= 2 or Gräser >= 3'
+
+    Returns:
+        tuple: Alternatives, each a tuple of (pollen type, levels) conditions,
+            where levels is the frozenset of levels that satisfy it
+
+    Raises:
+        RuleError: If the rule cannot be parsed or names an unknown pollen type
+    """
+    alternatives = []
+    for alternative in OR_PATTERN.split(text.strip()):
+        conditions = {}
+        for condition in AND_PATTERN.split(alternative):
+            match = CONDITION_PATTERN.match(condition)
+            if match is None:
+                raise RuleError(f"Cannot parse condition '{condition.strip()}' in rule: {text}")
+            pollen_type = POLLEN_TYPES.get(match.group('type').lower())
+            if pollen_type is None:
+                raise RuleError(f"Unknown pollen type '{match.group('type')}' in rule: {text}")
+            level = int(match.group('level'))
+            if level > LEVELS[-1]:
+                raise RuleError(f"Levels go from 0 to {LEVELS[-1]}, got {level} in rule: {text}")
+            op = match.group('op')
+            if op == '=':
+                levels = frozenset([level])
+            else:
+                levels = frozenset(l for l in LEVELS if l >= (level + 1 if op == '>' else level))
+            # The same type twice in one alternative: both must hold
+            conditions[pollen_type] = conditions.get(pollen_type, levels) & levels
+        alternatives.append(tuple(sorted(conditions.items())))
+    return tuple(alternatives)
+
+def city_levels(data, day=0):
+    """
+    Get the levels of a scrape result
+
+    Args:
+        data (dict): Pollen data as returned by scrape_pollen_data
+        day (int): Forecast day, 0 for today
+
+    Returns:
+        dict: Pollen type -> level, empty for failed scrapes and default data
+    """
+    if 'error' in data or data.get('default_data'):
+        return {}
+    days = data.get('days') or [{'pollen_items': data['pollen_items']}]
+    if day >= len(days):
+        return {}
+    return {item['type']: int(item['concentration'])
+            for item in days[day]['pollen_items'] if item['concentration'].isdigit()}
+
+def rule_matches(rule, levels):
+    """
+    Evaluate a parsed rule directly, without an index
+
+    Args:
+        rule (tuple): Result of parse_rule
+        levels (dict): Pollen type -> level, see city_levels
+
+    Returns:
+        bool: True if any alternative holds
+    """
+    return any(all(levels.get(pollen_type) in allowed for pollen_type, allowed in alternative)
+               for alternative in rule)
+
+class RuleIndex:
+    """
+    Inverted index of the alert rules of a subscriber list
+
+    Args:
+        subscribers (list): Subscribers; the ones with a 'rules' string are
+            indexed, the others always match
+    """
+
+    def __init__(self, subscribers):
+        self.subscribers = list(subscribers)
+        # City -> positions of subscribers without a rule
+        self.unconditional = {}
+        # (city, type, level) -> positions of subscribers with a one-condition alternative it satisfies
+        self.single = {}
+        # (city, type, level) -> ids of multi-condition alternatives one of whose conditions it satisfies
+        self.multi = {}
+        # Per multi-condition alternative: its subscriber's position and number of conditions
+        self.owners = []
+        self.sizes = []
+        for position, subscriber in enumerate(self.subscribers):
+            city = subscriber['city']
+            rules = subscriber.get('rules')
+            if not rules:
+                self.unconditional.setdefault(city, []).append(position)
+                continue
+            for alternative in parse_rule(rules):
+                if len(alternative) == 1:
+                    pollen_type, levels = alternative[0]
+                    for level in levels:
+                        self.single.setdefault((city, pollen_type, level), []).append(position)
+                    continue
+                alternative_id = len(self.owners)
+                self.owners.append(position)
+                self.sizes.append(len(alternative))
+                for pollen_type, levels in alternative:
+                    for level in levels:
+                        self.multi.setdefault((city, pollen_type, level), []).append(alternative_id)
+
+    def match(self, pollen_data, day=0):
+        """
+        Find the subscribers whose rules hold for a scrape
+
+        Args:
+            pollen_data (dict): City -> pollen data, see scrape_many
+            day (int): Forecast day the rules are checked against, 0 for today
+
+        Returns:
+            list: Matching subscribers, in list order; subscribers without a
+                rule match whenever their city was scraped, subscribers with
+                a rule never match a failed scrape
+        """
+        matched = set()
+        hits = {}
+        for city, data in pollen_data.items():
+            matched.update(self.unconditional.get(city, ()))
+            for pollen_type, level in city_levels(data, day).items():
+                key = (city, pollen_type, level)
+                matched.update(self.single.get(key, ()))
+                for alternative_id in self.multi.get(key, ()):
+                    hits[alternative_id] = hits.get(alternative_id, 0) + 1
+        sizes = self.sizes
+        matched.update(self.owners[i] for i, count in hits.items() if count == sizes[i])
+        return [self.subscribers[position] for position in sorted(matched)]
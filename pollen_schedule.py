@@ -0,0 +1,227 @@
+"""
+In-process scheduler for daemon mode
+
+Jobs run on cron-like schedules ("minute hour day month weekday", e.g.
+"30 6 * * 1-5"). Start times are jittered so many jobs due at the same
+minute do not all hit the pollen site at once. On SIGTERM or SIGINT the
+scheduler finishes the job that is running and then stops.
+
+A schedule file has one job per line: a cron expression followed by the
+cities it covers (comma-separated, or * for all cities):
+
+    # minute hour day month weekday  cities
+    0 6 * * *     berlin,hamburg
+    30 7 * * 1-5  muenchen
+"""
+import datetime
+import logging
+import random
+import signal
+import threading
+import time
+
+# Shortcuts for common schedules
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# (first, last) value of each cron field
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+# Longest time the scheduler sleeps before checking the clock again
+MAX_SLEEP = 60
+
+def parse_cron_field(field, first, last):
+    """
+    Parse one cron field
+
+    Args:
+        field (str): Field such as '*', '*/15', '1-5', '0,30' or '8-18/2'
+        first (int): Smallest allowed value
+        last (int): Largest allowed value
+
+    Returns:
+        set: Matching values
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError(f"Invalid step in cron field: {field}")
+        if part == '*':
+            start, end = first, last
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = last
+        if start < first or end > last or start > end:
+            raise ValueError(f"Cron field out of range {first}-{last}: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """
+    Cron-like schedule in local time
+
+    Day of month and weekday follow cron rules: when both are restricted, a
+    day matches if either matches. Weekdays are 0-7 with 0 and 7 for Sunday.
+
+    Args:
+        expr (str): Five-field cron expression, or one of CRON_ALIASES
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = CRON_ALIASES.get(expr.strip(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expr}")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_cron_field(field, first, last) for field, (first, last) in zip(fields, CRON_FIELDS)
+        )
+        self.weekdays = {d % 7 for d in weekdays}
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+
+    def __repr__(self):
+        return f"CronSchedule({self.expr!r})"
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, dt):
+        """
+        Get the next matching minute
+
+        Args:
+            dt (datetime.datetime): Start time, naive local time
+
+        Returns:
+            datetime.datetime: First matching minute strictly after `dt`
+        """
+        t = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = dt.year + 5
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression never matches: {self.expr}")
+
+def read_schedule_file(path):
+    """
+    Read a schedule file
+
+    Args:
+        path (str): File path
+
+    Returns:
+        list: (CronSchedule, cities) tuples, cities is None for all cities
+    """
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            if parts[0].startswith('@'):
+                expr, rest = parts[0], parts[1:]
+            else:
+                expr, rest = ' '.join(parts[:5]), parts[5:]
+            cities = [c.strip() for c in ','.join(rest).split(',') if c.strip()]
+            entries.append((CronSchedule(expr), None if cities in ([], ['*']) else cities))
+    return entries
+
+class Scheduler:
+    """
+    Runs jobs on their schedules, one at a time, until stopped
+
+    Args:
+        jitter (float): Each run starts up to this many seconds after its scheduled minute
+    """
+
+    def __init__(self, jitter=0.0):
+        self.jitter = jitter
+        self.jobs = []
+        self._stop = threading.Event()
+
+    def add(self, name, schedule, func):
+        """
+        Add a job
+
+        Args:
+            name (str): Job name, for the log
+            schedule (CronSchedule): When the job runs
+            func (callable): Called on every run with its scheduled time (datetime.datetime)
+        """
+        self.jobs.append({'name': name, 'schedule': schedule, 'func': func, 'slot': None, 'due': None, 'runs': 0})
+
+    def _plan(self, job, after):
+        job['slot'] = job['schedule'].next_after(after)
+        job['due'] = job['slot'].timestamp() + random.uniform(0, self.jitter)
+        due = datetime.datetime.fromtimestamp(job['due']).strftime('%Y-%m-%d %H:%M:%S')
+        logging.info(f"Next run of {job['name']} at {due}")
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stop after the running job, usable as a signal handler
+        """
+        if signum is not None:
+            logging.info(f"Received signal {signum}, stopping after the running job")
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        """
+        Stop gracefully on SIGTERM and SIGINT, must be called from the main thread
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def run(self):
+        """
+        Run jobs until stop() is called
+
+        A job that raises is logged and scheduled again. Runs that were
+        missed while another job was running are not caught up.
+        """
+        now = datetime.datetime.now()
+        for job in self.jobs:
+            self._plan(job, now)
+
+        while self.jobs and not self._stop.is_set():
+            job = min(self.jobs, key=lambda j: j['due'])
+            wait = job['due'] - time.time()
+            if wait > 0:
+                self._stop.wait(min(wait, MAX_SLEEP))
+                continue
+
+            logging.info(f"Running {job['name']}")
+            start = time.perf_counter()
+            try:
+                job['func'](job['slot'])
+            except Exception as e:
+                logging.error(f"Job {job['name']} failed: {str(e)}")
+            job['runs'] += 1
+            logging.info(f"Finished {job['name']} in {time.perf_counter() - start:.2f}s")
+            if not self._stop.is_set():
+                self._plan(job, max(datetime.datetime.now(), job['slot']))
+
+        logging.info("Scheduler stopped")
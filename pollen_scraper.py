@@ -1,423 +1,646 @@
-import requests
-from bs4 import BeautifulSoup
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 import os
 import datetime
 import logging
-import re
-from email.utils import formataddr
 import sys
+import threading
+import time
+from urllib.parse import urlsplit
+import pollen_cities
+import pollen_fetch
+import pollen_parser
+from pollen_parser import parse_pollen_page, parse_pollen_stream
+from pollen_sources import SOURCES, PollenSource, error_result
+from pollen_metrics import METRICS, instrument_http_adapter
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("pollen_alert.log", mode='a')
-    ]
-)
+# requests, the email stack and the optional stores are imported where they
+# are first used, so short-lived invocations (e.g. scrape-only) start quickly
 
-def scrape_pollen_data(city=None):
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_FILE = 'pollen_alert.log'
+
+_log_listener = None
+
+def setup_logging(log_file=LOG_FILE, level=logging.INFO):
+    """
+    Set up logging to stderr and, optionally, to a log file
+    
+    Nothing is configured at import time, so importing this module neither
+    creates a log file nor changes the caller's logging. Log records are
+    put on a queue and written by a background thread, so logging never
+    waits for the terminal or the disk.
+    
+    Args:
+        log_file (str): Log file appended to, None to only log to stderr
+        level (int): Logging level
+    """
+    global _log_listener
+    import atexit
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+    
+    if _log_listener is not None:
+        return
+    
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, mode='a'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(log_queue, *handlers)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    
+    # The listener's handlers add time and level, the queued record only carries the message
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=level, handlers=[queue_handler])
+
+# Base URL of the pollen pages, can be overridden (e.g. to point at a local mirror)
+POLLEN_BASE_URL = os.environ.get('POLLEN_BASE_URL', 'https://www.wetteronline.de/pollen')
+
+# Add User-Agent header to avoid being blocked
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Maximum number of simultaneous connections to a single host
+MAX_CONNECTIONS_PER_HOST = 8
+
+# Bytes read at a time when streaming pages
+STREAM_CHUNK_SIZE = 8192
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Get the shared HTTP session
+    
+    The session keeps connections alive between requests, so scraping several
+    cities only pays for the TCP and TLS handshake once per pooled connection.
+    
+    Returns:
+        requests.Session: Shared session
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            
+            session = requests.Session()
+            session.headers.update(HTTP_HEADERS)
+            adapter = instrument_http_adapter(HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONNECTIONS_PER_HOST))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+def pollen_url(city):
+    """
+    Build the pollen page URL for a city
+    
+    Args:
+        city (str): City name as used in the URL
+        
+    Returns:
+        str: Page URL
+    """
+    return f"{POLLEN_BASE_URL.rstrip('/')}/{city}"
+
+def extract_pollen_data(html, city):
+    """
+    Extract pollen data from a downloaded page
+    
+    Missing parts are replaced with defaults: a generic title, the current
+    date and, when no pollen items were found, a default pollen list. In
+    that last case the result has 'default_data' set to True.
+    
+    Besides today's 'pollen_items', the result has 'days': the forecast of
+    every day tab on the page, each with its 'date' label and 'pollen_items'.
+    
+    Args:
+        html (str): Page HTML
+        city (str): City name
+        
+    Returns:
+        dict: Dictionary containing pollen data
+    """
+    with METRICS.timer('parse', city=city):
+        page = parse_pollen_page(html)
+    return build_pollen_data(page, city)
+
+def build_pollen_data(page, city):
+    """
+    Build the pollen data of a city from a parsed page, see extract_pollen_data
+    
+    Args:
+        page (dict): Result of pollen_parser.parse_pollen_page
+        city (str): City name
+        
+    Returns:
+        dict: Dictionary containing pollen data
+    """
+    if page['backup_used']:
+        METRICS.inc('backup_parser', city=city)
+    
+    # Print page title for debugging
+    logging.info(f"Page title: {page['page_title'] or 'No title'}")
+    
+    # Get the forecast title
+    forecast_title = page['title']
+    if forecast_title is None:
+        forecast_title = f"Pollen Forecast - {city.capitalize()}"
+    
+    # Get today's date label, default to the current date
+    today_date = page['date']
+    if today_date is None:
+        today_date = datetime.datetime.now().strftime("%Y-%m-%d")
+    else:
+        logging.info(f"Found current date label: {today_date}")
+    
+    pollen_items = page['pollen_items']
+    
+    # If still no data found, use default pollen type list
+    if not pollen_items:
+        logging.warning("Cannot extract pollen data from webpage, using default values")
+        
+        # Default values based on typical data
+        default_items = [
+            {'type': 'Ambrosia', 'concentration': '0'},
+            {'type': 'Ampfer', 'concentration': '0'},
+            {'type': 'Beifuß', 'concentration': '0'},
+            {'type': 'Birke', 'concentration': '0'},
+            {'type': 'Buche', 'concentration': '0'},
+            {'type': 'Erle', 'concentration': '1'},
+            {'type': 'Esche', 'concentration': '1'},
+            {'type': 'Gräser', 'concentration': '0'},
+            {'type': 'Hasel', 'concentration': '0'},
+            {'type': 'Pappel', 'concentration': '3'},
+            {'type': 'Roggen', 'concentration': '0'},
+            {'type': 'Ulme', 'concentration': '3'},
+            {'type': 'Wegerich', 'concentration': '0'},
+            {'type': 'Weide', 'concentration': '3'}
+        ]
+        
+        logging.info("Using default pollen data")
+        METRICS.inc('default_data', city=city)
+        
+        return {
+            'date': today_date,
+            'title': forecast_title,
+            'pollen_items': default_items,
+            'days': [{'date': today_date, 'pollen_items': default_items}],
+            'city': city,
+            'default_data': True
+        }
+    
+    days = page['days']
+    if days and days[0]['date'] is None:
+        days[0]['date'] = today_date
+    
+    return {
+        'date': today_date,
+        'title': forecast_title,
+        'pollen_items': pollen_items,
+        'days': days,
+        'city': city
+    }
+
+def scrape_pollen_data(city=None, session=None, cache=None, policy=None, deadline=None):
     """
     Scrape pollen data for the specified city
     
     Args:
-        city (str): City name, if None it will be taken from environment variables
+        city (str): City slug, if None the CITY_NAME environment variable is
+            resolved with the city registry
+        session (requests.Session): HTTP session to use, defaults to the shared session
+        cache (pollen_cache.ResponseCache): Response cache, if None every call downloads the page
+        policy (pollen_fetch.FetchPolicy): Timeouts, retries and circuit breaker,
+            defaults to pollen_fetch.DEFAULT_POLICY
+        deadline (float): time.monotonic() value by which the page must be
+            fetched, defaults to the policy's per-run deadline starting now
         
     Returns:
         dict: Dictionary containing pollen data
     """
     # Get city name from environment variables if not provided
-    city = city or os.environ.get('CITY_NAME', 'berlin').lower()
+    if not city:
+        name = os.environ.get('CITY_NAME', 'berlin')
+        try:
+            city = pollen_cities.resolve_city(name)
+        except pollen_cities.UnknownCityError as e:
+            return error_result(name, e)
+    session = session or get_http_session()
+    policy = policy or pollen_fetch.DEFAULT_POLICY
+    if deadline is None:
+        deadline = policy.deadline_at()
+    
+    try:
+        fetched = _fetch_page(city, session, cache, policy, deadline)
+        if 'data' in fetched:
+            return fetched['data']
+        return _parse_fetched(fetched, cache)
+    except Exception as e:
+        return error_result(city, e)
+
+def _fetch_page(city, session, cache, policy, deadline):
+    # Download a city's page, or take its parse result from the cache
+    # Returns a dict with 'city', 'url' and either 'data' (from the cache) or 'response',
+    # with streaming also 'page' (the parse result) and 'body' (the part that was read)
     
     # Use the wetteronline.de URL format
-    url = f"https://www.wetteronline.de/pollen/{city}"
+    url = pollen_url(city)
     logging.info(f"Starting to scrape pollen data: {url}")
     
+    # Serve fresh cached data without contacting the server
+    entry = cache.lookup(url) if cache else None
+    if entry is not None and cache.is_fresh(entry):
+        cache.record_hit(entry)
+        logging.info(f"Using cached pollen data for {city}")
+        return {'city': city, 'url': url, 'data': dict(entry.parsed, city=city)}
+    
+    request_headers = dict(HTTP_HEADERS)
+    if cache:
+        request_headers.update(cache.conditional_headers(entry))
+    with METRICS.timer('download', city=city):
+        response = policy.fetch(session, url, headers=request_headers, deadline=deadline)
+    
+    # Page unchanged since it was cached, reuse the stored parse result
+    if entry is not None and response.status_code == 304:
+        cache.revalidated(entry, response.headers)
+        logging.info(f"Page not modified, using cached pollen data for {city}")
+        return {'city': city, 'url': url, 'data': dict(entry.parsed, city=city)}
+    
+    if cache:
+        cache.record_miss()
+    fetched = {'city': city, 'url': url, 'response': response, 'deadline': deadline}
     try:
-        # Add User-Agent header to avoid being blocked
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers)
         response.raise_for_status()  # Raise exception if request failed
+        stopped_early = policy.stream and _read_streaming(fetched)
+    finally:
+        response.close()
+    
+    # Bytes received for the body, as sent (before decompression)
+    downloaded = response.raw.tell()
+    METRICS.inc('download_bytes', downloaded, city=city)
+    total = response.headers.get('Content-Length', '')
+    if stopped_early and total.isdigit() and int(total) > downloaded:
+        METRICS.inc('download_bytes_skipped', int(total) - downloaded, city=city)
+        logging.info(f"Downloaded {downloaded} of {total} bytes for {city}, stopped after the pollen section")
+    else:
+        logging.info(f"Downloaded {downloaded} bytes for {city}")
+    return fetched
+
+def _read_streaming(fetched):
+    # Read a streamed page only until the pollen section is parsed; returns True if it stopped early
+    with METRICS.timer('stream', city=fetched['city']):
+        # CPU time of this thread, the time spent waiting for the network is not parsing
+        start = time.thread_time()
+        page, html, stopped_early = parse_pollen_stream(_decoded_chunks(fetched['response'], fetched['deadline']))
+        fetched['parse_seconds'] = time.thread_time() - start
+    fetched['page'] = page
+    fetched['body'] = html.encode(fetched['response'].encoding or 'utf-8', errors='replace')
+    return stopped_early
+
+def _decoded_chunks(response, deadline=None):
+    # Body of a streamed response as text, chunk by chunk, read within the deadline
+    import codecs
+    
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    for chunk in pollen_fetch.iter_body(response, deadline, STREAM_CHUNK_SIZE):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+def _parse_fetched(fetched, cache):
+    # Parse result of a downloaded page, parsed in this thread unless streaming already did
+    city = fetched['city']
+    if 'page' in fetched:
+        data = build_pollen_data(fetched['page'], city)
+    else:
+        start = time.perf_counter()
+        data = extract_pollen_data(fetched['response'].text, city)
+        fetched['parse_seconds'] = time.perf_counter() - start
+    return _store_result(fetched, data, cache)
+
+def _store_result(fetched, data, cache):
+    # Only real page data is worth caching; a streamed page is stored as far as it was read
+    if cache and not data.get('default_data'):
+        body = fetched['body'] if 'body' in fetched else fetched['response'].content
+        cache.store(fetched['url'], fetched['response'].headers, body, {
+            'date': data['date'],
+            'title': data['title'],
+            'pollen_items': data['pollen_items'],
+            'days': data['days']
+        }, fetched.get('parse_seconds', 0.0))
+    
+    logging.info(f"Data scraping successful, found {len(data['pollen_items'])} pollen types")
+    
+    return data
+
+def _finish_parse(fetched, cache):
+    # Collect a page parsed in a worker process
+    city = fetched['city']
+    try:
+        parsed, seconds, records = fetched['future'].result()
+        for level, message in records:
+            logging.log(level, message)
+        METRICS.observe('parse', seconds, city=city)
+        fetched['parse_seconds'] = seconds
+        data = build_pollen_data(parsed, city)
+        return _store_result(fetched, data, cache)
+    except Exception as e:
+        return error_result(city, e)
+
+def scrape_many(cities, max_workers=8, max_per_host=MAX_CONNECTIONS_PER_HOST, session=None, cache=None,
+                policy=None, parse_workers=None):
+    """
+    Scrape pollen data for several cities concurrently
+    
+    All requests share one keep-alive connection pool. No more than
+    `max_per_host` requests are in flight to the same host at any time.
+    The policy's deadline covers the whole batch.
+    
+    With parse workers, the threads only download: every page is handed to
+    the shared process pool (pollen_parser.get_pool) as soon as it arrives,
+    so parsing runs on several cores while the remaining pages download.
+    
+    Args:
+        cities (list): City names
+        max_workers (int): Number of worker threads
+        max_per_host (int): Maximum number of concurrent requests per host
+        session (requests.Session): HTTP session to use, defaults to the shared session
+        cache (pollen_cache.ResponseCache): Response cache shared by all cities
+        policy (pollen_fetch.FetchPolicy): Timeouts, retries and circuit breaker,
+            defaults to pollen_fetch.DEFAULT_POLICY
+        parse_workers (int): Worker processes for parsing, 0 to parse in the
+            download threads; defaults to pollen_parser.DEFAULT_WORKERS
         
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Print page title for debugging
-        logging.info(f"Page title: {soup.title.text if soup.title else 'No title'}")
-        
-        # Get current date
-        today_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        
-        # Get the forecast title
-        try:
-            forecast_title_elem = soup.select_one('div.text-headline')
-            if forecast_title_elem:
-                forecast_title = forecast_title_elem.text.strip()
-            else:
-                forecast_title = f"Pollen Forecast - {city.capitalize()}"
-        except (AttributeError, TypeError):
-            forecast_title = f"Pollen Forecast - {city.capitalize()}"
-            logging.warning(f"Cannot find forecast title, using default: {forecast_title}")
-        
-        # Get today's date label
+    Returns:
+        list: Pollen data dictionaries, in the same order as `cities`
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    cities = list(cities)
+    if not cities:
+        return []
+    
+    session = session or get_http_session()
+    policy = policy or pollen_fetch.DEFAULT_POLICY
+    deadline = policy.deadline_at()
+    host_limits = {}
+    host_limits_lock = threading.Lock()
+    
+    if parse_workers is None:
+        parse_workers = pollen_parser.DEFAULT_WORKERS
+    parse_pool = pollen_parser.get_pool(parse_workers)
+    engine = pollen_parser.resolve_engine() if parse_pool else None
+    
+    def scrape_one(city):
+        host = urlsplit(pollen_url(city)).netloc
+        with host_limits_lock:
+            limit = host_limits.setdefault(host, threading.BoundedSemaphore(max_per_host))
+        if parse_pool is None:
+            with limit:
+                return scrape_pollen_data(city, session=session, cache=cache, policy=policy, deadline=deadline)
         try:
-            today_tab = soup.select_one('div.tab-btn.active')
-            if today_tab:
-                today_date = today_tab.text.strip()
-                logging.info(f"Found current date label: {today_date}")
+            with limit:
+                fetched = _fetch_page(city, session, cache, policy, deadline)
+            if 'page' in fetched:
+                # Streaming has parsed the page already
+                fetched['data'] = _parse_fetched(fetched, cache)
+            elif 'response' in fetched:
+                fetched['future'] = parse_pool.submit(pollen_parser.parse_in_worker, fetched['response'].text, engine)
+            return fetched
         except Exception as e:
-            logging.warning(f"Error getting date label: {e}")
+            return {'city': city, 'data': error_result(city, e)}
+    
+    if parse_pool is None:
+        logging.info(f"Scraping {len(cities)} cities with {max_workers} workers")
+    else:
+        logging.info(f"Scraping {len(cities)} cities with {max_workers} workers, "
+                     f"parsing in {parse_workers} processes")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(cities)))) as executor:
+        results = list(executor.map(scrape_one, cities))
+    if parse_pool is None:
+        return results
+    return [fetched['data'] if 'data' in fetched else _finish_parse(fetched, cache) for fetched in results]
+
+class WetterOnlineSource(PollenSource):
+    """
+    Pollen data scraped from one wetteronline.de page per city
+    
+    Args:
+        session (requests.Session): HTTP session to use, defaults to the shared session
+        cache (pollen_cache.ResponseCache): Response cache
+        policy (pollen_fetch.FetchPolicy): Timeouts, retries and circuit breaker,
+            defaults to pollen_fetch.DEFAULT_POLICY
+        parse_workers (int): Worker processes for parsing, see scrape_many
+    """
+    
+    name = 'wetteronline'
+    title = 'wetteronline.de'
+    
+    def __init__(self, session=None, cache=None, policy=None, parse_workers=None):
+        self.session = session
+        self.cache = cache
+        self.policy = policy
+        self.parse_workers = parse_workers
+    
+    def page_url(self, city):
+        return pollen_url(city)
+    
+    def scrape(self, city):
+        return scrape_pollen_data(city, session=self.session, cache=self.cache, policy=self.policy)
+    
+    def scrape_many(self, cities, max_workers=8):
+        return scrape_many(cities, max_workers=max_workers, session=self.session, cache=self.cache,
+                           policy=self.policy, parse_workers=self.parse_workers)
 
-        # Parse pollen data
-        pollen_items = []
+def make_source(name='wetteronline', cache=None):
+    """
+    Create a pollen data source
+    
+    Args:
+        name (str): One of pollen_sources.SOURCES
+        cache (pollen_cache.ResponseCache): Response cache of the wetteronline pages
         
-        # Find pollen data rows
-        pollen_rows = soup.select('div.pollenflug-items div.row')
-        logging.info(f"Found {len(pollen_rows)} rows of pollen data")
+    Returns:
+        pollen_sources.PollenSource: Data source
+    """
+    if name == 'wetteronline':
+        return WetterOnlineSource(cache=cache)
+    if name == 'dwd':
+        from pollen_dwd import DWDSource
         
-        for row in pollen_rows:
-            pollen_items_in_row = row.select('div.pollenflug-item')
-            
-            for item in pollen_items_in_row:
-                try:
-                    # Get pollen type name
-                    name_elem = item.select_one('div.name')
-                    if not name_elem:
-                        continue
-                    
-                    pollen_type = name_elem.text.strip()
-                    
-                    # Get concentration value
-                    grad_elem = item.select_one('div.grad')
-                    concentration = '0'  # Default to 0
-                    
-                    if grad_elem:
-                        # Concentration value is directly in the element text
-                        grad_text = grad_elem.text.strip()
-                        if grad_text.isdigit() and 0 <= int(grad_text) <= 3:
-                            concentration = grad_text
-                        else:
-                            # If not a number, try to extract from class name
-                            grad_classes = grad_elem.get('class', [])
-                            for cls in grad_classes:
-                                if 'grad-' in cls:
-                                    level_match = re.search(r'grad-(\d)', cls)
-                                    if level_match:
-                                        concentration = level_match.group(1)
-                                        break
-                    
-                    # Add to results list
-                    if pollen_type:
-                        pollen_items.append({
-                            'type': pollen_type,
-                            'concentration': concentration
-                        })
-                        logging.info(f"Found pollen: {pollen_type}, concentration: {concentration}")
-                except Exception as e:
-                    logging.warning(f"Error processing pollen item: {e}")
-        
-        # If no pollen data found, try backup parsing method
-        if not pollen_items:
-            logging.warning("No pollen data found, trying backup parsing method")
-            
-            # Try to find all pollen items directly
-            all_items = soup.select('div.pollenflug-item')
-            
-            for item in all_items:
-                try:
-                    name_elem = item.select_one('div.name')
-                    grad_elem = item.select_one('div.grad')
-                    
-                    if name_elem and grad_elem:
-                        pollen_type = name_elem.text.strip()
-                        
-                        # Get concentration value
-                        concentration = '0'  # Default to 0
-                        grad_text = grad_elem.text.strip()
-                        
-                        if grad_text.isdigit() and 0 <= int(grad_text) <= 3:
-                            concentration = grad_text
-                        else:
-                            # If not a number, try to extract from class name
-                            grad_classes = grad_elem.get('class', [])
-                            for cls in grad_classes:
-                                if 'grad-' in cls:
-                                    level_match = re.search(r'grad-(\d)', cls)
-                                    if level_match:
-                                        concentration = level_match.group(1)
-                                        break
-                        
-                        # Add to results list
-                        if pollen_type:
-                            pollen_items.append({
-                                'type': pollen_type,
-                                'concentration': concentration
-                            })
-                            logging.info(f"Backup method found pollen: {pollen_type}, concentration: {concentration}")
-                except Exception as e:
-                    logging.warning(f"Error processing pollen item with backup method: {e}")
-        
-        # If still no data found, use default pollen type list
-        if not pollen_items:
-            logging.warning("Cannot extract pollen data from webpage, using default values")
-            
-            # Default values based on typical data
-            default_items = [
-                {'type': 'Ambrosia', 'concentration': '0'},
-                {'type': 'Ampfer', 'concentration': '0'},
-                {'type': 'Beifuß', 'concentration': '0'},
-                {'type': 'Birke', 'concentration': '0'},
-                {'type': 'Buche', 'concentration': '0'},
-                {'type': 'Erle', 'concentration': '1'},
-                {'type': 'Esche', 'concentration': '1'},
-                {'type': 'Gräser', 'concentration': '0'},
-                {'type': 'Hasel', 'concentration': '0'},
-                {'type': 'Pappel', 'concentration': '3'},
-                {'type': 'Roggen', 'concentration': '0'},
-                {'type': 'Ulme', 'concentration': '3'},
-                {'type': 'Wegerich', 'concentration': '0'},
-                {'type': 'Weide', 'concentration': '3'}
-            ]
-            
-            logging.info("Using default pollen data")
-            pollen_items = default_items
+        return DWDSource(session=get_http_session())
+    raise ValueError(f"Unknown pollen data source: {name} (choose from {', '.join(SOURCES)})")
+
+def read_cities_file(path):
+    """
+    Read city names from a file
+    
+    One city per line; blank lines and lines starting with '#' are ignored.
+    
+    Args:
+        path (str): File path
         
-        logging.info(f"Data scraping successful, found {len(pollen_items)} pollen types")
+    Returns:
+        list: City names
+    """
+    with open(path, encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+def add_city_arguments(parser):
+    """
+    Add the city registry options to an argument parser
+    
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend
+    """
+    parser.add_argument('--city-index', type=str, default=pollen_cities.INDEX_PATH,
+                        help='City index file used to check and resolve city names')
+    parser.add_argument('--no-city-check', action='store_true', default=not pollen_cities.STRICT,
+                        help='Use city names that are not in the city index as they are instead of rejecting them')
+
+def resolve_city_names(names):
+    """
+    Resolve city names from the command line to pollen page slugs
+    
+    Names that are not in the city index are logged with suggestions and
+    nothing is downloaded; without pollen_cities.STRICT they are used as
+    they are, with a warning.
+    
+    Args:
+        names (list): Free-text city names
         
-        return {
-            'date': today_date,
-            'title': forecast_title,
-            'pollen_items': pollen_items,
-            'city': city
-        }
-    except Exception as e:
-        logging.error(f"Error scraping data: {str(e)}")
-        # Return error information
-        return {
-            'date': datetime.datetime.now().strftime("%Y-%m-%d"),
-            'title': f"Pollen Forecast for {city.capitalize()} (Scraping Failed)",
-            'pollen_items': [
-                {'type': f'Error: {str(e)}', 'concentration': '0'}
-            ],
-            'error': str(e),
-            'city': city
-        }
+    Returns:
+        list: City slugs in the same order, None if any name is unknown
+    """
+    resolved, unknown = pollen_cities.resolve_cities(names)
+    for name, suggestions in unknown.items():
+        logging.error(str(pollen_cities.UnknownCityError(name, suggestions)))
+    if unknown:
+        return None
+    return [resolved[name] for name in names]
 
-def format_email_content(data, language='en'):
+def format_email_content(data, language='en', days=1, source=None):
     """
     Format email content
     
     Args:
         data (dict): Pollen data
         language (str): Email language, supports 'en' (English), 'de' (German), and 'zh' (Chinese)
+        days (int): Forecast days shown in a compact table below today's levels,
+            1 for today only
+        source (pollen_sources.PollenSource): Source of the data, credited in
+            the footer and linked when scraping failed; defaults to wetteronline.de
         
     Returns:
         str: HTML formatted email content
     """
-    city = data.get('city', os.environ.get('CITY_NAME', 'Berlin'))
-    today = datetime.datetime.now().strftime('%Y-%m-%d')
-    
-    # Pollen types translations (German to Chinese and English)
-    pollen_translations = {
-        'Ambrosia': {'en': 'Ragweed', 'zh': '豚草'},
-        'Ampfer': {'en': 'Sorrel', 'zh': '酸模'},
-        'Beifuß': {'en': 'Mugwort', 'zh': '艾蒿'},
-        'Birke': {'en': 'Birch', 'zh': '桦树'},
-        'Buche': {'en': 'Beech', 'zh': '山毛榉'},
-        'Erle': {'en': 'Alder', 'zh': '桤木'},
-        'Esche': {'en': 'Ash', 'zh': '梣树'},
-        'Gräser': {'en': 'Grasses', 'zh': '草'},
-        'Hasel': {'en': 'Hazel', 'zh': '榛树'},
-        'Pappel': {'en': 'Poplar', 'zh': '杨树'},
-        'Roggen': {'en': 'Rye', 'zh': '黑麦'},
-        'Ulme': {'en': 'Elm', 'zh': '榆树'},
-        'Wegerich': {'en': 'Plantain', 'zh': '车前草'},
-        'Weide': {'en': 'Willow', 'zh': '柳树'}
-    }
+    from pollen_templates import compile_email_template
     
-    # Multi-language support
-    titles = {
-        'en': {
-            'email_title': f"Pollen Concentration Forecast for {city}",
-            'date': f"Date: {today}",
-            'forecast_date': "Forecast Date",
-            'pollen_type': "Pollen Type",
-            'translation': "English Name",
-            'concentration': "Concentration Level",
-            'greeting': "Stay healthy!",
-            'footer_auto': "This email is generated by an automated system. Please do not reply.",
-            'footer_source': "Data Source: wetteronline.de",
-            'error_title': "Warning: Data Scraping Issue",
-            'error_check': "Please check if the website structure has changed or contact the script maintainer. You can visit the website manually to check the latest data:",
-            'levels': {
-                '0': '✅ None',
-                '1': '⚠️ Low',
-                '2': '🟠 Medium',
-                '3': '🔴 High'
-            }
-        },
-        'de': {
-            'email_title': f"Pollenkonzentrationsprognose für {city}",
-            'date': f"Datum: {today}",
-            'forecast_date': "Prognosedatum",
-            'pollen_type': "Pollentyp",
-            'translation': "Englischer Name",
-            'concentration': "Konzentrationsniveau",
-            'greeting': "Bleiben Sie gesund!",
-            'footer_auto': "Diese E-Mail wird von einem automatisierten System generiert. Bitte antworten Sie nicht.",
-            'footer_source': "Datenquelle: wetteronline.de",
-            'error_title': "Warnung: Problem beim Datenabrufen",
-            'error_check': "Bitte überprüfen Sie, ob sich die Website-Struktur geändert hat, oder kontaktieren Sie den Skript-Betreuer. Sie können die Website manuell besuchen, um die neuesten Daten zu überprüfen:",
-            'levels': {
-                '0': '✅ Keine',
-                '1': '⚠️ Gering',
-                '2': '🟠 Mittel',
-                '3': '🔴 Stark'
-            }
-        },
-        'zh': {
-            'email_title': f"{city}地区花粉浓度预报",
-            'date': f"日期: {today}",
-            'forecast_date': "预报日期",
-            'pollen_type': "花粉类型",
-            'translation': "中文名称",
-            'concentration': "浓度等级",
-            'greeting': "祝您健康每一天！",
-            'footer_auto': "此邮件由自动系统生成，请勿回复。",
-            'footer_source': "数据来源: wetteronline.de",
-            'error_title': "警告：数据抓取遇到问题",
-            'error_check': "请检查网站结构是否已更改或联系脚本维护人员。您可以手动访问以下网站查看最新数据:",
-            'levels': {
-                '0': '✅ 无',
-                '1': '⚠️ 弱',
-                '2': '🟠 中',
-                '3': '🔴 强'
-            }
-        }
-    }
+    with METRICS.timer('render', city=data.get('city')):
+        if source is None:
+            return compile_email_template(language).render(data, days)
+        return compile_email_template(language).render(data, days, source.title,
+                                                       source.page_url(data.get('city', '')))
+
+def check_email_config(config):
+    """
+    Check that the email configuration has all required fields
     
-    # Use specified language text, default to English if not supported
-    text = titles.get(language, titles['en'])
-    
-    # Check for errors
-    error_message = ""
-    if 'error' in data:
-        error_message = f"""
-        <div style="background-color: #ffebee; padding: 10px; border-left: 4px solid #f44336; margin-bottom: 20px;">
-            <h3 style="color: #d32f2f; margin-top: 0;">{text['error_title']}</h3>
-            <p>{data['error']}</p>
-            <p>{text['error_check']}
-               <a href="https://www.wetteronline.de/pollen/{city.lower()}" target="_blank">wetteronline.de</a>
-            </p>
-        </div>
-        """
-    
-    # Create HTML content
-    html_content = f"""
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; color: #333; background-color: #f5f5f5; }}
-            h1 {{ color: #2c3e50; margin-top: 0; }}
-            h2 {{ color: #3498db; }}
-            .date {{ color: #7f8c8d; font-size: 0.9em; margin-bottom: 20px; }}
-            table {{ border-collapse: collapse; width: 100%; margin: 20px 0; background-color: white; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }}
-            th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
-            th {{ background-color: #f2f2f2; font-weight: bold; }}
-            tr:nth-child(even) {{ background-color: #f9f9f9; }}
-            .high {{ color: #e74c3c; font-weight: bold; }}
-            .medium {{ color: #f39c12; }}
-            .low {{ color: #27ae60; }}
-            .none {{ color: #7f8c8d; }}
-            .footer {{ margin-top: 30px; font-size: 0.8em; color: #7f8c8d; border-top: 1px solid #eee; padding-top: 15px; }}
-            .container {{ max-width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 5px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); }}
-            .header {{ background-color: #3498db; color: white; padding: 15px; border-radius: 5px 5px 0 0; margin: -20px -20px 20px; }}
-            .header h1 {{ color: white; margin: 0; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>{text['email_title']}</h1>
-            </div>
-            <p class="date">{text['date']}</p>
-            {error_message}
-            <h2>{data['title']}</h2>
-            <p>{text['forecast_date']}: {data['date']}</p>
-            
-            <table>
-                <tr>
-                    <th>{text['pollen_type']}</th>
-                    <th>{text['translation']}</th>
-                    <th>{text['concentration']}</th>
-                </tr>
-    """
-    
-    # Sort by concentration, with higher concentrations at the top
-    sorted_items = sorted(data['pollen_items'], 
-                         key=lambda x: (x['concentration'] == '0', x['type']))
-    
-    for item in sorted_items:
-        concentration = item['concentration']
-        css_class = ""
-        
-        # Handle possible non-numeric concentration values
-        if concentration not in text['levels']:
-            if concentration.isdigit() and 0 <= int(concentration) <= 3:
-                concentration = concentration
-            else:
-                # Default to 0
-                concentration = '0'
-                
-        if concentration == '3':
-            css_class = "high"
-        elif concentration == '2':
-            css_class = "medium"
-        elif concentration == '1':
-            css_class = "low"
-        else:
-            css_class = "none"
-            
-        emoji_concentration = text['levels'].get(concentration, concentration)
+    Args:
+        config (dict): Email configuration
         
-        # Get translation based on language
-        pollen_name = item['type']
-        translation = pollen_translations.get(pollen_name, {}).get(language, pollen_name)
+    Raises:
+        ValueError: If a required field is missing
+    """
+    required_fields = ['email_from', 'email_to', 'email_password', 'smtp_server', 'smtp_port']
+    missing_fields = [field for field in required_fields if not config.get(field)]
+    
+    if missing_fields:
+        logging.error(f"Missing required email configuration: {', '.join(missing_fields)}")
+        raise ValueError(f"Missing required email configuration: {', '.join(missing_fields)}")
+
+def email_subject(config):
+    """
+    Get the email subject
+    
+    Args:
+        config (dict): Email configuration, 'city' and 'language' are used
+        
+    Returns:
+        str: Subject in the configured language
+    """
+    # Email subject multi-language support
+    subject_templates = {
+        'en': f"Pollen Forecast for {config['city']} - {datetime.datetime.now().strftime('%Y-%m-%d')}",
+        'de': f"Pollenvorhersage für {config['city']} - {datetime.datetime.now().strftime('%Y-%m-%d')}",
+        'zh': f"{config['city']}花粉浓度预报 - {datetime.datetime.now().strftime('%Y-%m-%d')}"
+    }
+    return subject_templates.get(config['language'], subject_templates['en'])
+
+def build_message(content, config):
+    """
+    Build the email message
+    
+    Args:
+        content (str): Email HTML content
+        config (dict): Email configuration
         
-        html_content += f"""
-                <tr>
-                    <td>{pollen_name}</td>
-                    <td>{translation}</td>
-                    <td class="{css_class}">{emoji_concentration}</td>
-                </tr>
-        """
+    Returns:
+        MIMEMultipart: Email message
+    """
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.utils import formataddr
+    
+    subject = email_subject(config)
+    
+    # Create email object
+    msg = MIMEMultipart()
+    # Use formataddr to set sender name
+    msg['From'] = formataddr((config['sender_name'], config['email_from']))
+    msg['To'] = config['email_to']
+    msg['Subject'] = subject
+    
+    # Add HTML content
+    msg.attach(MIMEText(content, 'html'))
+    return msg
+
+def prepare_message(content, config):
+    """
+    Build an email once for every recipient of the same body
     
-    html_content += f"""
-            </table>
-            <p>{text['greeting']}</p>
-            <div class="footer">
-                <p>{text['footer_auto']}</p>
-                <p>{text['footer_source']}</p>
-            </div>
-        </div>
-    </body>
-    </html>
+    Args:
+        content (str): Email HTML content
+        config (dict): Email configuration; with 'plain_text', a text
+            alternative is added
+        
+    Returns:
+        pollen_mime.PreparedMessage: Serialized message, the recipient is
+            added when it is sent
     """
+    from pollen_mime import PreparedMessage
     
-    return html_content
+    return PreparedMessage(content, config['email_from'], config['sender_name'], email_subject(config),
+                           plain_text=config.get('plain_text', False))
 
-def send_email(content, config=None):
+def send_email(content, config=None, pool=None):
     """
     Send email
     
     Args:
         content (str): Email HTML content
         config (dict): Email configuration, if None it will be taken from environment variables
+        pool (pollen_smtp.SMTPPool): Connection pool to send through, if None a
+            new connection is opened and closed for this email
         
     Returns:
         bool: Whether sending was successful
@@ -431,6 +654,7 @@ def send_email(content, config=None):
             'smtp_server': os.environ.get('SMTP_SERVER'),
             'smtp_port': os.environ.get('SMTP_PORT'),
             'use_ssl': os.environ.get('USE_SSL', 'true').lower() == 'true',
+            'use_starttls': os.environ.get('USE_STARTTLS', 'true').lower() == 'true',
             'smtp_auth_required': os.environ.get('SMTP_AUTH_REQUIRED', 'true').lower() == 'true',
             'sender_name': os.environ.get('SENDER_NAME', 'Pollen Alert'),
             'city': os.environ.get('CITY_NAME', 'Berlin'),
@@ -438,63 +662,59 @@ def send_email(content, config=None):
         }
     
     # Check required configuration
-    required_fields = ['email_from', 'email_to', 'email_password', 'smtp_server', 'smtp_port']
-    missing_fields = [field for field in required_fields if not config.get(field)]
-    
-    if missing_fields:
-        logging.error(f"Missing required email configuration: {', '.join(missing_fields)}")
-        raise ValueError(f"Missing required email configuration: {', '.join(missing_fields)}")
+    check_email_config(config)
     
     logging.info(f"Preparing to send email to {config['email_to']}")
     logging.info(f"SMTP settings: server={config['smtp_server']}, port={config['smtp_port']}, SSL={config['use_ssl']}, auth={config['smtp_auth_required']}")
     
-    # Email subject multi-language support
-    subject_templates = {
-        'en': f"Pollen Forecast for {config['city']} - {datetime.datetime.now().strftime('%Y-%m-%d')}",
-        'de': f"Pollenvorhersage für {config['city']} - {datetime.datetime.now().strftime('%Y-%m-%d')}",
-        'zh': f"{config['city']}花粉浓度预报 - {datetime.datetime.now().strftime('%Y-%m-%d')}"
-    }
-    subject = subject_templates.get(config['language'], subject_templates['en'])
+    from email.utils import getaddresses
     
-    # Create email object
-    msg = MIMEMultipart()
-    # Use formataddr to set sender name
-    msg['From'] = formataddr((config['sender_name'], config['email_from']))
-    msg['To'] = config['email_to']
-    msg['Subject'] = subject
-    
-    # Add HTML content
-    msg.attach(MIMEText(content, 'html'))
+    msg = prepare_message(content, config)
+    recipients = [address for _, address in getaddresses([config['email_to']])]
     
     try:
-        if config['use_ssl']:
-            # Use SSL connection
-            logging.info("Using SSL connection to SMTP server")
-            server = smtplib.SMTP_SSL(config['smtp_server'], int(config['smtp_port']))
-        else:
-            # Use non-SSL connection
-            logging.info("Using non-SSL connection to SMTP server")
-            server = smtplib.SMTP(config['smtp_server'], int(config['smtp_port']))
-            server.starttls()  # Enable TLS encryption
-        
-        # Set longer timeout
-        server.timeout = 60
-        
-        if config['smtp_auth_required']:
-            # Login authentication
-            logging.info(f"Using {config['email_from']} for SMTP authentication")
-            server.login(config['email_from'], config['email_password'])
-        
         # Send email
         logging.info("Sending email...")
-        server.send_message(msg)
-        server.quit()
+        if pool is not None:
+            pool.send_prepared(msg, recipients, config['email_to'])
+        else:
+            from pollen_smtp import open_smtp_connection
+            
+            server = open_smtp_connection(config)
+            with METRICS.timer('smtp_send', recipient=config['email_to']):
+                msg.send(server, recipients, config['email_to'])
+            server.quit()
+            METRICS.inc('emails_sent')
         logging.info(f"Email successfully sent to {config['email_to']}")
         return True
     except Exception as e:
         logging.error(f"Error sending email: {str(e)}")
         raise
 
+def deliver(transactions, pool, outbox=None):
+    """
+    Send prepared emails over the pool, through the outbox when there is one
+    
+    With an outbox, the emails are stored before anything is sent and then
+    drained; the ones that cannot be sent now are retried by later runs.
+    
+    Args:
+        transactions (list): Tuples of SMTPPool.send_prepared arguments
+        pool (pollen_smtp.SMTPPool): SMTP connection pool
+        outbox (pollen_outbox.Outbox): Durable outbox
+        
+    Returns:
+        list: One entry per transaction, in order: None if it was sent,
+            otherwise the exception, or with an outbox the message state
+            ('pending' or 'failed')
+    """
+    if outbox is None:
+        return pool.send_batch(transactions)
+    keys = outbox.enqueue_many(transactions)
+    outbox.drain(pool)
+    states = outbox.states(keys)
+    return [None if states.get(key) == 'sent' else states.get(key) for key in keys]
+
 def get_email_provider_settings(provider):
     """
     Get SMTP settings for common email providers
@@ -529,6 +749,471 @@ def get_email_provider_settings(provider):
     
     return providers.get(provider.lower(), {})
 
+def select_changed(pollen_data, recipients, delta):
+    """
+    Keep only the cities whose pollen levels changed enough to send an email
+    
+    Skipped cities are recorded with their recipients and the reason. The
+    returned pollen data carries the changed pollen types under 'changes',
+    so the email highlights them.
+    
+    Args:
+        pollen_data (dict): City -> pollen data
+        recipients (dict): City -> list of recipient addresses
+        delta (pollen_delta.ChangeDetector): Change detector
+        
+    Returns:
+        dict: City -> pollen data, for the cities to send
+    """
+    selected = {}
+    for city, data in pollen_data.items():
+        decision = delta.compare(data)
+        if decision['send']:
+            selected[city] = dict(data, changes=decision['changes']) if decision['changes'] else data
+        else:
+            delta.record_skip(city, recipients[city], decision['reason'])
+    return selected
+
+def run_many(cities, email_config, max_workers=8, cache=None, pool=None, history=None, delta=None, outbox=None,
+             source=None):
+    """
+    Scrape several cities concurrently and send one email per city
+    
+    Args:
+        cities (list): City names
+        email_config (dict): Email configuration shared by all cities
+        max_workers (int): Number of cities scraped concurrently
+        cache (pollen_cache.ResponseCache): Response cache
+        pool (pollen_smtp.SMTPPool): SMTP connection pool, if None one is
+            created for this run
+        history (pollen_history.HistoryStore): Store that keeps the scraped readings
+        delta (pollen_delta.ChangeDetector): Only send cities whose levels changed
+        outbox (pollen_outbox.Outbox): Queue the emails in this outbox before sending
+        source (pollen_sources.PollenSource): Data source, defaults to the
+            wetteronline pages through `cache`
+        
+    Returns:
+        int: Exit code, 1 if sending failed for any city
+    """
+    logging.info(f"Starting pollen data scraping script for {len(cities)} cities")
+    
+    source = source or WetterOnlineSource(cache=cache)
+    results = dict(zip(cities, source.scrape_many(cities, max_workers=max_workers)))
+    if history:
+        history.record_many(results.values())
+    if delta:
+        results = select_changed(results, {city: [email_config['email_to']] for city in results}, delta)
+    
+    from email.utils import getaddresses
+    
+    cities = list(results)
+    recipients = [address for _, address in getaddresses([email_config['email_to']])]
+    messages = []
+    for city, pollen_data in results.items():
+        config = dict(email_config, city=city)
+        check_email_config(config)
+        email_content = format_email_content(pollen_data, email_config['language'],
+                                             email_config.get('forecast_days', 1), source)
+        messages.append((prepare_message(email_content, config), recipients, email_config['email_to']))
+    
+    own_pool = pool is None
+    if own_pool:
+        from pollen_smtp import SMTPPool
+        
+        pool = SMTPPool(email_config)
+    try:
+        errors = deliver(messages, pool, outbox)
+    finally:
+        if own_pool:
+            pool.close()
+    
+    failed = [city for city, error in zip(cities, errors) if error is not None]
+    if delta:
+        for city in cities:
+            if city not in failed:
+                delta.update(results[city])
+    if failed:
+        logging.error(f"Script execution finished with errors for: {', '.join(failed)}")
+        return 1
+    
+    logging.info("Script execution complete")
+    return 0
+
+def dispatch_subscribers(subscribers, email_config, max_workers=8, cache=None, pool=None, history=None, delta=None,
+                         outbox=None, source=None):
+    """
+    Send the pollen forecast to a list of subscribers
+    
+    Each city is scraped once and each (city, language) email is rendered
+    and serialized once, then sent to every subscriber that shares it. With
+    'recipients_per_message' in the email configuration, up to that many
+    subscribers of the same email share one SMTP transaction. Subscribers
+    with alert rules (see pollen_rules) only get an email when their rule
+    holds for today's levels.
+    
+    Args:
+        subscribers (list): Subscribers, see pollen_subscribers
+        email_config (dict): Email configuration shared by all subscribers
+        max_workers (int): Number of cities scraped concurrently
+        cache (pollen_cache.ResponseCache): Response cache
+        pool (pollen_smtp.SMTPPool): SMTP connection pool, if None one is
+            created for this run
+        history (pollen_history.HistoryStore): Store that keeps the scraped readings
+        delta (pollen_delta.ChangeDetector): Only send cities whose levels changed
+        outbox (pollen_outbox.Outbox): Queue the emails in this outbox before sending
+        source (pollen_sources.PollenSource): Data source, defaults to the
+            wetteronline pages through `cache`
+        
+    Returns:
+        dict: Per-stage counts and timings ('scrape', 'render', 'send'),
+            plus the number of subscribers, the number of skipped recipients,
+            the number of subscribers whose alert rules did not hold and the
+            failed recipients
+    """
+    from pollen_subscribers import group_by_city
+    
+    groups = group_by_city(subscribers)
+    stats = {
+        'subscribers': len(subscribers),
+        'scrape': {'count': 0, 'seconds': 0.0},
+        'render': {'count': 0, 'seconds': 0.0},
+        'send': {'count': 0, 'seconds': 0.0},
+        'skipped': 0,
+        'below_rules': 0,
+        'failed': []
+    }
+    
+    # Scrape every city once
+    start = time.perf_counter()
+    cities = list(groups)
+    source = source or WetterOnlineSource(cache=cache)
+    pollen_data = dict(zip(cities, source.scrape_many(cities, max_workers=max_workers)))
+    stats['scrape'] = {'count': len(cities), 'seconds': time.perf_counter() - start}
+    if history:
+        history.record_many(pollen_data.values())
+    
+    # Leave out cities whose levels did not change
+    if delta:
+        pollen_data = select_changed(
+            pollen_data, {city: [s['email'] for s in members] for city, members in groups.items()}, delta
+        )
+        stats['skipped'] = sum(len(members) for city, members in groups.items() if city not in pollen_data)
+        groups = {city: members for city, members in groups.items() if city in pollen_data}
+    
+    # Leave out subscribers whose alert rules do not hold for today's levels
+    if any(subscriber.get('rules') for members in groups.values() for subscriber in members):
+        from pollen_rules import RuleIndex
+        
+        index = RuleIndex(subscriber for members in groups.values() for subscriber in members)
+        matched = group_by_city(index.match(pollen_data))
+        stats['below_rules'] = len(index.subscribers) - sum(len(members) for members in matched.values())
+        groups = matched
+    
+    # Render and serialize every (city, language) once
+    start = time.perf_counter()
+    prepared = {}
+    for city, members in groups.items():
+        for subscriber in members:
+            key = (city, subscriber['language'])
+            if key not in prepared:
+                config = dict(email_config, email_to=subscriber['email'], city=city, language=subscriber['language'])
+                check_email_config(config)
+                content = format_email_content(pollen_data[city], subscriber['language'],
+                                               email_config.get('forecast_days', 1), source)
+                prepared[key] = {'message': prepare_message(content, config), 'recipients': []}
+            prepared[key]['recipients'].append(subscriber['email'])
+    stats['render'] = {'count': len(prepared), 'seconds': time.perf_counter() - start}
+    
+    # Fan out to the recipients over pooled connections
+    from pollen_mime import split_recipients
+    
+    start = time.perf_counter()
+    transactions = []
+    for entry in prepared.values():
+        for to_addrs in split_recipients(entry['recipients'], email_config.get('recipients_per_message', 1)):
+            transactions.append((entry['message'], to_addrs))
+    
+    own_pool = pool is None
+    if own_pool:
+        from pollen_smtp import SMTPPool
+        
+        pool = SMTPPool(email_config)
+    try:
+        errors = deliver(transactions, pool, outbox)
+    finally:
+        if own_pool:
+            pool.close()
+    
+    stats['failed'] = [email for (_, to_addrs), error in zip(transactions, errors) if error is not None
+                       for email in to_addrs]
+    sent = sum(len(to_addrs) for _, to_addrs in transactions) - len(stats['failed'])
+    stats['send'] = {'count': sent, 'seconds': time.perf_counter() - start}
+    
+    # A city's snapshot moves on once its forecast reached at least one recipient
+    if delta:
+        failed = set(stats['failed'])
+        for city, members in groups.items():
+            if any(s['email'] not in failed for s in members):
+                delta.update(pollen_data[city])
+    
+    logging.info(
+        f"Dispatched {stats['subscribers']} subscribers: "
+        f"scraped {stats['scrape']['count']} cities in {stats['scrape']['seconds']:.2f}s, "
+        f"rendered {stats['render']['count']} emails in {stats['render']['seconds']:.2f}s, "
+        f"sent {stats['send']['count']} emails in {stats['send']['seconds']:.2f}s, "
+        f"{stats['skipped']} skipped, {stats['below_rules']} below their alert rules, "
+        f"{len(stats['failed'])} failed"
+    )
+    return stats
+
+def run_scheduled(cities, email_config, subscribers_path=None, max_workers=8, cache=None, pool=None, history=None,
+                  delta=None, metrics_path=None, outbox=None, source=None, run_id=None):
+    """
+    Run one scheduled job in daemon mode
+    
+    With a subscriber list, the list is read again on every run so edits
+    take effect without a restart, and only subscribers in `cities` get an
+    email. Otherwise one email per city is sent to the configured recipient.
+    
+    Args:
+        cities (list): Cities of the job, None for all subscribers
+        email_config (dict): Email configuration
+        subscribers_path (str): Subscriber list file
+        max_workers (int): Number of cities scraped concurrently
+        cache (pollen_cache.ResponseCache): Response cache
+        pool (pollen_smtp.SMTPPool): SMTP connection pool, kept open between runs
+        history (pollen_history.HistoryStore): Store that keeps the scraped readings
+        delta (pollen_delta.ChangeDetector): Only send cities whose levels changed
+        metrics_path (str): Metrics file updated after the run
+        outbox (pollen_outbox.Outbox): Queue the emails in this outbox before sending
+        source (pollen_sources.PollenSource): Data source, kept between runs
+        run_id (str): Outbox run id, see pollen_outbox.default_run_id
+        
+    Returns:
+        int: Exit code, 1 if sending failed for any recipient
+    """
+    if outbox:
+        # Every scheduled run sends its emails, even when an earlier run sent the same ones
+        outbox.start_run(run_id)
+    try:
+        if subscribers_path:
+            from pollen_subscribers import load_subscribers
+            
+            subscribers = load_subscribers(subscribers_path, default_language=email_config['language'])
+            if cities is not None:
+                wanted = {city.lower() for city in cities}
+                subscribers = [s for s in subscribers if s['city'] in wanted]
+            stats = dispatch_subscribers(subscribers, email_config, max_workers=max_workers, cache=cache, pool=pool,
+                                         history=history, delta=delta, outbox=outbox, source=source)
+            return 1 if stats['failed'] else 0
+        return run_many(cities, email_config, max_workers=max_workers, cache=cache, pool=pool, history=history,
+                        delta=delta, outbox=outbox, source=source)
+    finally:
+        if metrics_path:
+            METRICS.write(metrics_path)
+
+def add_fetch_arguments(parser):
+    """
+    Add the data source and fetch policy options to an argument parser
+    
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend
+    """
+    parser.add_argument('--connect-timeout', type=float, default=5, help='Seconds to wait for an HTTP connection')
+    parser.add_argument('--read-timeout', type=float, default=20, help='Seconds to wait for data from the server')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Retries per page on connection errors, timeouts, 5xx and 429 answers')
+    parser.add_argument('--deadline', type=float, help='Seconds all pages of one run may take to download')
+    parser.add_argument('--stream', action='store_true', default=os.environ.get('POLLEN_STREAM', '').lower() == 'true',
+                        help='Stop downloading each page once its pollen section has been parsed')
+    parser.add_argument('--source', type=str, choices=SOURCES, default=os.environ.get('POLLEN_SOURCE', 'wetteronline'),
+                        help='Data source: wetteronline (one page per city) or dwd (one national DWD feed per run)')
+
+def configure_fetch_policy(args):
+    """
+    Make the fetch policy options the default policy
+    
+    Args:
+        args (argparse.Namespace): Parsed options, see add_fetch_arguments
+    """
+    pollen_fetch.DEFAULT_POLICY = pollen_fetch.FetchPolicy(
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        max_retries=args.retries,
+        deadline=args.deadline,
+        breaker=pollen_fetch.CircuitBreaker(),
+        stream=args.stream
+    )
+
+def scrape_only(args=None):
+    """
+    Scrape cities and print the results as JSON, without the email stack
+    
+    Args:
+        args (list): Command line arguments
+        
+    Returns:
+        int: Exit code, 1 if scraping failed for any city
+    """
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(prog='pollen_scraper.py scrape-only',
+                                     description='Scrape pollen data and print it as JSON')
+    parser.add_argument('--city', type=str, help='City name')
+    parser.add_argument('--cities', type=str, help='Comma-separated list of city names')
+    parser.add_argument('--cities-file', type=str, help='File with one city name per line')
+    parser.add_argument('--max-workers', type=int, default=8, help='Number of cities scraped concurrently')
+    parser.add_argument('--format', type=str, choices=['json', 'ndjson'], default='json',
+                        help='json: one array, ndjson: one object per line')
+    parser.add_argument('--parser', type=str, choices=['auto'] + sorted(pollen_parser.ENGINES),
+                        default=pollen_parser.DEFAULT_ENGINE,
+                        help='HTML parser engine, auto uses lxml when installed')
+    parser.add_argument('--parse-workers', type=int, default=pollen_parser.DEFAULT_WORKERS,
+                        help='Processes that parse downloaded pages in parallel, 0 to parse in the download threads')
+    parser.add_argument('--cache', type=str, default=os.environ.get('POLLEN_CACHE'),
+                        help='Response cache file, pages are only downloaded again when they changed')
+    parser.add_argument('--metrics', type=str, default=os.environ.get('POLLEN_METRICS'),
+                        help='Write stage timings and counters to this file (.prom or .json)')
+    parser.add_argument('--matrix', type=str, default=os.environ.get('POLLEN_MATRIX'),
+                        help='Also write the levels as a national matrix file (needs NumPy), see pollen_matrix')
+    parser.add_argument('--verbose', action='store_true', help='Log progress to stderr')
+    add_fetch_arguments(parser)
+    add_city_arguments(parser)
+    args = parser.parse_args(args)
+    
+    # stdout carries the data, logs go to stderr only
+    setup_logging(log_file=None, level=logging.INFO if args.verbose else logging.WARNING)
+    pollen_parser.DEFAULT_ENGINE = args.parser
+    pollen_parser.DEFAULT_WORKERS = args.parse_workers
+    pollen_cities.INDEX_PATH = args.city_index
+    pollen_cities.STRICT = not args.no_city_check
+    configure_fetch_policy(args)
+    
+    cities = []
+    if args.city:
+        cities.append(args.city)
+    if args.cities:
+        cities.extend(c.strip() for c in args.cities.split(',') if c.strip())
+    if args.cities_file:
+        cities.extend(read_cities_file(args.cities_file))
+    if not cities:
+        cities.append(os.environ.get('CITY_NAME', 'berlin'))
+    cities = resolve_city_names(cities)
+    if cities is None:
+        return 1
+    
+    cache = None
+    if args.cache:
+        from pollen_cache import ResponseCache
+        
+        cache = ResponseCache(args.cache)
+    
+    try:
+        results = make_source(args.source, cache).scrape_many(cities, max_workers=args.max_workers)
+    finally:
+        pollen_parser.shutdown_pool()
+        if cache:
+            cache.close()
+        if args.metrics:
+            METRICS.write(args.metrics)
+    
+    if args.matrix:
+        from pollen_matrix import PollenMatrix
+        
+        PollenMatrix.from_results(results).save(args.matrix)
+    
+    if args.format == 'ndjson':
+        for data in results:
+            sys.stdout.write(json.dumps(data, ensure_ascii=False) + '\n')
+    else:
+        json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    return 1 if any('error' in data for data in results) else 0
+
+def serve(args=None):
+    """
+    Serve pollen data over HTTP from an in-memory cache, see pollen_server
+    
+    Args:
+        args (list): Command line arguments
+        
+    Returns:
+        int: Exit code
+    """
+    import argparse
+    import asyncio
+    import signal
+    from pollen_server import PollenServer
+    from pollen_templates import EMAIL_TEXTS
+    
+    parser = argparse.ArgumentParser(prog='pollen_scraper.py serve',
+                                     description='Serve pollen data as JSON and HTML over HTTP')
+    parser.add_argument('--host', type=str, default=os.environ.get('POLLEN_SERVE_HOST', '127.0.0.1'),
+                        help='Address to listen on')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('POLLEN_SERVE_PORT', '8080')),
+                        help='Port to listen on')
+    parser.add_argument('--ttl', type=float, default=600, help='Seconds a scraped city is served from memory')
+    parser.add_argument('--stale-for', type=float, default=3600,
+                        help='Seconds an expired city may still be served while it is refreshed')
+    parser.add_argument('--refresh-ahead', type=float, default=60,
+                        help='Cities read recently are refreshed this many seconds before they expire')
+    parser.add_argument('--max-workers', type=int, default=8, help='Cities scraped concurrently')
+    parser.add_argument('--language', type=str, choices=['en', 'de', 'zh'], default='en',
+                        help='Default language of the HTML rendering')
+    parser.add_argument('--parser', type=str, choices=['auto'] + sorted(pollen_parser.ENGINES),
+                        default=pollen_parser.DEFAULT_ENGINE,
+                        help='HTML parser engine, auto uses lxml when installed')
+    parser.add_argument('--cache', type=str, default=os.environ.get('POLLEN_CACHE'),
+                        help='Response cache file, pages are only downloaded again when they changed')
+    add_fetch_arguments(parser)
+    add_city_arguments(parser)
+    args = parser.parse_args(args)
+    
+    setup_logging()
+    pollen_parser.DEFAULT_ENGINE = args.parser
+    pollen_cities.INDEX_PATH = args.city_index
+    # Any path would otherwise turn into an upstream request, so unknown cities get a 404 unless allowed
+    pollen_cities.STRICT = not args.no_city_check
+    configure_fetch_policy(args)
+    
+    cache = None
+    if args.cache:
+        from pollen_cache import ResponseCache
+        
+        cache = ResponseCache(args.cache)
+    
+    source = make_source(args.source, cache)
+    languages = [args.language] + [language for language in EMAIL_TEXTS if language != args.language]
+    server = PollenServer(
+        source.scrape,
+        lambda data, language, days: format_email_content(data, language, days, source),
+        ttl=args.ttl,
+        stale_for=args.stale_for,
+        refresh_ahead=args.refresh_ahead,
+        max_fetches=args.max_workers,
+        languages=languages
+    )
+    
+    async def run():
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopped.set)
+        await server.start(args.host, args.port)
+        await stopped.wait()
+        logging.info("Stopping server")
+        await server.stop()
+    
+    try:
+        asyncio.run(run())
+    finally:
+        pollen_parser.shutdown_pool()
+        source.close()
+        if cache:
+            cache.close()
+    return 0
+
 def main(args=None):
     """
     Main function
@@ -538,9 +1223,31 @@ def main(args=None):
     """
     import argparse
     
+    args = args if args is not None else sys.argv[1:]
+    
+    # Subcommands
+    if args and args[0] == 'history':
+        from pollen_history import main as history_main
+        return history_main(args[1:])
+    if args and args[0] == 'scrape-only':
+        return scrape_only(args[1:])
+    if args and args[0] == 'serve':
+        return serve(args[1:])
+    if args and args[0] == 'outbox':
+        from pollen_outbox import main as outbox_main
+        return outbox_main(args[1:])
+    if args and args[0] == 'matrix':
+        from pollen_matrix import main as matrix_main
+        return matrix_main(args[1:])
+    
     # Parse arguments
     parser = argparse.ArgumentParser(description='Scrape pollen data and send email notification')
     parser.add_argument('--city', type=str, help='City name')
+    parser.add_argument('--cities', type=str, help='Comma-separated list of city names, one email is sent per city')
+    parser.add_argument('--cities-file', type=str, help='File with one city name per line, one email is sent per city')
+    parser.add_argument('--max-workers', type=int, default=8, help='Number of cities scraped concurrently')
+    parser.add_argument('--subscribers', type=str,
+                        help='Subscriber list (.csv, .json or .sqlite) with email, city and language per subscriber')
     parser.add_argument('--email-from', type=str, help='Sender email address')
     parser.add_argument('--email-to', type=str, help='Recipient email address')
     parser.add_argument('--email-password', type=str, help='Email password or app password')
@@ -548,14 +1255,70 @@ def main(args=None):
     parser.add_argument('--smtp-port', type=str, help='SMTP server port')
     parser.add_argument('--use-ssl', action='store_true', help='Use SSL connection')
     parser.add_argument('--no-auth', action='store_true', help='No SMTP authentication required')
+    parser.add_argument('--no-starttls', action='store_true', help='Do not upgrade non-SSL connections with STARTTLS')
+    parser.add_argument('--smtp-connections', type=int, default=2,
+                        help='Maximum number of concurrent SMTP connections when sending many emails')
+    parser.add_argument('--smtp-messages-per-connection', type=int, default=100,
+                        help='Emails sent over one SMTP connection before it is replaced')
+    parser.add_argument('--recipients-per-message', type=int, default=1,
+                        help='Subscribers with the same email sent in one SMTP transaction, with a hidden recipient list')
+    parser.add_argument('--plain-text', action='store_true', help='Add a plain-text alternative to the HTML email')
     parser.add_argument('--sender-name', type=str, default='Pollen Alert', help='Sender name')
     parser.add_argument('--provider', type=str, choices=['gmail', 'outlook', 'yahoo'], 
                         help='Email provider, can automatically set SMTP parameters')
     parser.add_argument('--language', type=str, choices=['en', 'de', 'zh'], default='en', 
                         help='Email language: en (English), de (German), zh (Chinese)')
+    parser.add_argument('--days', type=int, default=int(os.environ.get('FORECAST_DAYS', '1')),
+                        help='Forecast days shown in the email, more than 1 adds a multi-day table')
+    parser.add_argument('--parser', type=str, choices=['auto'] + sorted(pollen_parser.ENGINES),
+                        default=pollen_parser.DEFAULT_ENGINE,
+                        help='HTML parser engine, auto uses lxml when installed')
+    parser.add_argument('--parse-workers', type=int, default=pollen_parser.DEFAULT_WORKERS,
+                        help='Processes that parse downloaded pages in parallel, 0 to parse in the download threads')
+    parser.add_argument('--cache', type=str, default=os.environ.get('POLLEN_CACHE'),
+                        help='Response cache file, pages are only downloaded again when they changed')
+    parser.add_argument('--cache-ttl', type=float, default=6 * 3600, help='Seconds after which cached pages are discarded')
+    parser.add_argument('--cache-fresh', type=float, default=600,
+                        help='Seconds during which cached pages are used without revalidation')
+    parser.add_argument('--cache-max-mb', type=float, default=50, help='Maximum cache size in megabytes')
+    add_fetch_arguments(parser)
+    add_city_arguments(parser)
+    parser.add_argument('--delta', action='store_true',
+                        help='Only send an email when pollen levels changed since the last email')
+    parser.add_argument('--delta-state', type=str, default=os.environ.get('POLLEN_DELTA_STATE', 'pollen_state.sqlite'),
+                        help='File with the last sent levels per city and the log of skipped sends')
+    parser.add_argument('--delta-min-change', type=int, default=1,
+                        help='Smallest level difference that counts as a change')
+    parser.add_argument('--delta-threshold', type=int, choices=[1, 2, 3],
+                        help='Only count changes that cross this level')
+    parser.add_argument('--history', type=str, default=os.environ.get('POLLEN_HISTORY'),
+                        help='History file, every scraped reading is stored in it')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Stay running and send on a schedule, keeping connections and templates warm')
+    parser.add_argument('--schedule', type=str, default=os.environ.get('POLLEN_SCHEDULE', '0 6 * * *'),
+                        help='Cron expression for all cities in daemon mode (minute hour day month weekday)')
+    parser.add_argument('--schedule-file', type=str,
+                        help='File with one cron expression and its cities per line, for per-city schedules')
+    parser.add_argument('--jitter', type=float, default=300,
+                        help='Each scheduled run starts up to this many seconds late, to spread out requests')
+    parser.add_argument('--metrics', type=str, default=os.environ.get('POLLEN_METRICS'),
+                        help='Write stage timings and counters to this file (.prom or .json)')
+    parser.add_argument('--outbox', type=str, default=os.environ.get('POLLEN_OUTBOX'),
+                        help='Outbox file, emails are stored in it before sending and retried until delivered')
+    parser.add_argument('--outbox-wait', type=float, default=300,
+                        help='Seconds a run waits for retries of failed emails, later retries are left to the next run')
+    parser.add_argument('--outbox-run-id', type=str, default=os.environ.get('POLLEN_RUN_ID'),
+                        help='Run id in the outbox: a run started again with the same id does not send emails twice '
+                             '(default: the date and the job; in daemon mode, each scheduled slot and job)')
+    parser.add_argument('--drain-only', action='store_true',
+                        help='Only send the emails left in the outbox, without scraping')
     
     # Parse command line arguments
-    args = parser.parse_args(args if args is not None else sys.argv[1:])
+    args = parser.parse_args(args)
+    if args.drain_only and not args.outbox:
+        parser.error('--drain-only needs --outbox')
+    
+    setup_logging()
     
     # If email provider specified, get default SMTP settings
     provider_settings = {}
@@ -571,28 +1334,179 @@ def main(args=None):
         'smtp_port': args.smtp_port or provider_settings.get('smtp_port') or os.environ.get('SMTP_PORT'),
         'use_ssl': args.use_ssl if args.use_ssl is not None else provider_settings.get('use_ssl', True),
         'smtp_auth_required': not args.no_auth if args.no_auth is not None else provider_settings.get('smtp_auth_required', True),
+        'use_starttls': not args.no_starttls and os.environ.get('USE_STARTTLS', 'true').lower() == 'true',
         'sender_name': args.sender_name or os.environ.get('SENDER_NAME', 'Pollen Alert'),
         'city': args.city or os.environ.get('CITY_NAME', 'Berlin'),
-        'language': args.language or os.environ.get('LANGUAGE', 'en')
+        'language': args.language or os.environ.get('LANGUAGE', 'en'),
+        'forecast_days': args.days,
+        'plain_text': args.plain_text,
+        'recipients_per_message': args.recipients_per_message
     }
     
+    # Collect cities for multi-city mode
+    cities = []
+    if args.cities:
+        cities.extend(c.strip() for c in args.cities.split(',') if c.strip())
+    if args.cities_file:
+        cities.extend(read_cities_file(args.cities_file))
+    
+    pollen_parser.DEFAULT_ENGINE = args.parser
+    pollen_parser.DEFAULT_WORKERS = args.parse_workers
+    pollen_cities.INDEX_PATH = args.city_index
+    pollen_cities.STRICT = not args.no_city_check
+    configure_fetch_policy(args)
+    
+    # Reject unknown cities before anything is downloaded
+    city_slug = None
+    if not args.subscribers:
+        slugs = resolve_city_names(cities or [email_config['city']])
+        if slugs is None:
+            return 1
+        if cities:
+            cities = slugs
+        else:
+            city_slug = slugs[0]
+    
+    cache = None
+    if args.cache:
+        from pollen_cache import ResponseCache
+        
+        cache = ResponseCache(args.cache, ttl=args.cache_ttl, fresh_for=args.cache_fresh,
+                              max_bytes=int(args.cache_max_mb * 1024 * 1024))
+    
+    history = None
+    if args.history:
+        from pollen_history import HistoryStore
+        
+        history = HistoryStore(args.history)
+    
+    delta = None
+    if args.delta:
+        from pollen_delta import ChangeDetector
+        
+        delta = ChangeDetector(args.delta_state, min_change=args.delta_min_change, threshold=args.delta_threshold)
+    
+    from pollen_smtp import SMTPPool
+    
+    pool = SMTPPool(email_config, max_connections=args.smtp_connections,
+                    max_messages_per_connection=args.smtp_messages_per_connection)
+    
+    outbox = None
+    if args.outbox:
+        from pollen_outbox import Outbox, default_run_id
+        
+        # Without a run id, a job started again on the same day only sends what is missing
+        job = args.subscribers or ','.join(cities or [city_slug])
+        outbox = Outbox(args.outbox, max_wait=args.outbox_wait, run_id=args.outbox_run_id or default_run_id(job))
+    
+    source = make_source(args.source, cache)
+    
     try:
+        if outbox:
+            # Deliver what an earlier run left behind, before scraping
+            if args.drain_only:
+                outbox.drain(pool)
+                status = outbox.status()
+                logging.info(f"Outbox: {status['pending']} pending, {status['failed']} failed")
+                return 1 if status['pending'] or status['sending'] else 0
+            outbox.drain(pool, max_wait=0)
+        
+        if args.daemon:
+            from pollen_outbox import default_run_id
+            from pollen_schedule import CronSchedule, Scheduler, read_schedule_file
+            
+            if args.schedule_file:
+                entries = read_schedule_file(args.schedule_file)
+            else:
+                entries = [(CronSchedule(args.schedule), None)]
+            all_cities = None if args.subscribers else (cities or [city_slug])
+            scheduler = Scheduler(jitter=args.jitter)
+            for schedule, job_cities in entries:
+                job_cities = resolve_city_names(job_cities) if job_cities else all_cities
+                if job_cities is None:
+                    return 1
+                job_name = f"{schedule.expr} for {', '.join(job_cities) if job_cities else 'all subscribers'}"
+                scheduler.add(
+                    job_name,
+                    schedule,
+                    lambda slot, job_cities=job_cities, job=job_name: run_scheduled(
+                        job_cities, email_config, subscribers_path=args.subscribers, max_workers=args.max_workers,
+                        cache=cache, pool=pool, history=history, delta=delta, metrics_path=args.metrics, outbox=outbox,
+                        source=source, run_id=default_run_id(job, slot)
+                    )
+                )
+            scheduler.install_signal_handlers()
+            logging.info(f"Starting daemon with {len(scheduler.jobs)} scheduled jobs")
+            scheduler.run()
+            return 0
+        
+        if args.subscribers:
+            from pollen_subscribers import load_subscribers
+            
+            subscribers = load_subscribers(args.subscribers, default_language=email_config['language'])
+            stats = dispatch_subscribers(subscribers, email_config, max_workers=args.max_workers, cache=cache,
+                                         pool=pool, history=history, delta=delta, outbox=outbox, source=source)
+            return 1 if stats['failed'] else 0
+        
+        if cities:
+            return run_many(cities, email_config, max_workers=args.max_workers, cache=cache, pool=pool,
+                            history=history, delta=delta, outbox=outbox, source=source)
+        
         logging.info("Starting pollen data scraping script")
         
         # Scrape data
-        pollen_data = scrape_pollen_data(email_config['city'])
+        pollen_data = source.scrape(city_slug)
+        if history:
+            history.record(pollen_data)
+        
+        # Skip the email when nothing changed
+        if delta:
+            city = city_slug
+            changed = select_changed({city: pollen_data}, {city: [email_config['email_to']]}, delta)
+            if not changed:
+                logging.info("Script execution complete, no email sent")
+                return 0
+            pollen_data = changed[city]
         
         # Format email content
-        email_content = format_email_content(pollen_data, email_config['language'])
+        email_content = format_email_content(pollen_data, email_config['language'],
+                                             email_config.get('forecast_days', 1), source)
         
         # Send email
-        send_email(email_content, email_config)
+        if outbox:
+            from email.utils import getaddresses
+            
+            check_email_config(email_config)
+            recipients = [address for _, address in getaddresses([email_config['email_to']])]
+            message = (prepare_message(email_content, email_config), recipients, email_config['email_to'])
+            if deliver([message], pool, outbox)[0] is not None:
+                logging.error(f"Email to {email_config['email_to']} not sent yet, it stays in the outbox")
+                return 1
+        else:
+            send_email(email_content, email_config)
+        if delta:
+            delta.update(pollen_data)
         
         logging.info("Script execution complete")
         return 0
     except Exception as e:
         logging.error(f"Error during execution: {str(e)}")
         return 1
+    finally:
+        pool.close()
+        source.close()
+        pollen_parser.shutdown_pool()
+        if outbox:
+            outbox.close()
+        if history:
+            history.close()
+        if delta:
+            delta.close()
+        if cache:
+            cache.log_stats()
+            cache.close()
+        if args.metrics:
+            METRICS.write(args.metrics)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+Read-through HTTP API for pollen data
+
+Serve mode answers:
+
+    GET /pollen/{city}        Pollen data as JSON, as returned by scrape_pollen_data
+    GET /pollen/{city}.html   The email rendering; ?language=de and ?days=3 are optional
+    GET /metrics              Stage timings and counters in the Prometheus text format
+
+Scrape results are kept in memory for `ttl` seconds. Concurrent requests
+for a city that is not cached share one upstream fetch. Cities that were
+read within the last `ttl` seconds are refreshed in the background shortly
+before they expire, so their readers never wait for the pollen site; an
+expired entry is still served (for up to `stale_for` seconds) while it is
+being refreshed, and also when the refresh fails. HTML renderings are made
+in a worker thread, so they do not hold up other connections, and are kept
+with the entry per language and number of days until it is refreshed.
+"""
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+from pollen_cities import UnknownCityError, resolve_city
+from pollen_metrics import METRICS
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 502: 'Bad Gateway'}
+
+# Longest request line or header line accepted
+MAX_LINE = 8192
+
+class PollenServer:
+    """
+    asyncio HTTP server with a TTL cache in front of the scraper
+
+    The scraper and renderer are passed in, so this module does not depend
+    on how pages are fetched.
+
+    Args:
+        scrape (callable): scrape(city) -> pollen data dict, blocking; run in worker threads
+        render (callable): render(data, language, days) -> HTML string
+        ttl (float): Seconds a scrape result is fresh
+        stale_for (float): Seconds an expired result may still be served while refreshing
+        refresh_ahead (float): Hot cities are refreshed this many seconds before they expire
+        max_fetches (int): Upstream fetches running at the same time
+        languages (tuple): Languages accepted for the HTML rendering, the first is the default
+        max_days (int): Largest ?days= value accepted
+    """
+
+    def __init__(self, scrape, render, ttl=600.0, stale_for=3600.0, refresh_ahead=60.0, max_fetches=8,
+                 languages=('en',), max_days=7):
+        self.scrape = scrape
+        self.render = render
+        self.ttl = ttl
+        self.stale_for = stale_for
+        self.refresh_ahead = min(refresh_ahead, ttl / 2)
+        self.languages = tuple(languages)
+        self.max_days = max_days
+        # city -> {'data', 'body' (JSON bytes), 'html' ((language, days) -> HTML bytes), 'fetched_at', 'read_at'}
+        self.entries = {}
+        # city -> task of the upstream fetch in flight
+        self.inflight = {}
+        self.stats = {'hits': 0, 'stale': 0, 'misses': 0, 'fetches': 0, 'refreshes': 0, 'fetch_errors': 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_fetches, thread_name_prefix='pollen-fetch')
+        # Separate from the fetches, so renderings never wait behind a slow upstream
+        self._render_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='pollen-render')
+        self._server = None
+        self._refresher = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """
+        Start listening and refreshing
+
+        Args:
+            host (str): Address to bind
+            port (int): Port to bind, 0 for any free port
+
+        Returns:
+            int: Port the server listens on
+        """
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_LINE)
+        self._refresher = asyncio.ensure_future(self._refresh_loop())
+        port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Serving pollen data on http://{host}:{port}/pollen/{{city}}")
+        return port
+
+    async def stop(self):
+        """
+        Stop listening and wait for running fetches
+        """
+        if self._refresher is not None:
+            self._refresher.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self.inflight:
+            await asyncio.gather(*self.inflight.values(), return_exceptions=True)
+        self._executor.shutdown(wait=False)
+        self._render_executor.shutdown(wait=False)
+
+    async def lookup(self, city):
+        """
+        Get the cached entry of a city, fetching it on a miss
+
+        Args:
+            city (str): City slug
+
+        Returns:
+            tuple: (entry, cache state): state is 'hit', 'stale' (expired,
+                refresh started) or 'miss'
+        """
+        now = time.monotonic()
+        entry = self.entries.get(city)
+        if entry is not None and now - entry['fetched_at'] < self.ttl + self.stale_for:
+            entry['read_at'] = now
+            if now - entry['fetched_at'] < self.ttl:
+                self.stats['hits'] += 1
+                return entry, 'hit'
+            self.stats['stale'] += 1
+            self._fetch(city)
+            return entry, 'stale'
+        self.stats['misses'] += 1
+        # Shielded, so a client that hangs up does not cancel the fetch other clients wait for
+        entry = await asyncio.shield(self._fetch(city))
+        entry['read_at'] = time.monotonic()
+        return entry, 'miss'
+
+    def _fetch(self, city):
+        # Upstream fetch of a city, at most one at a time per city
+        task = self.inflight.get(city)
+        if task is None:
+            task = self.inflight[city] = asyncio.ensure_future(self._scrape(city))
+            task.add_done_callback(lambda _: self.inflight.pop(city, None))
+        return task
+
+    async def _scrape(self, city):
+        self.stats['fetches'] += 1
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self._executor, self.scrape, city)
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        previous = self.entries.get(city)
+        now = time.monotonic()
+        entry = {'data': data, 'body': body, 'html': {}, 'fetched_at': now,
+                 'read_at': previous['read_at'] if previous else now}
+        if 'error' in data:
+            self.stats['fetch_errors'] += 1
+            METRICS.inc('serve_fetch_errors', city=city)
+            # Keep serving the last good result, errors are not cached
+            return previous or entry
+        self.entries[city] = entry
+        return entry
+
+    async def _rendering(self, entry, language, days):
+        # HTML of an entry, rendered in a worker thread the first time it is asked for
+        key = (language, days)
+        html = entry['html'].get(key)
+        if html is None:
+            loop = asyncio.get_running_loop()
+            html = await loop.run_in_executor(self._render_executor, self.render, entry['data'], language, days)
+            html = entry['html'][key] = html.encode('utf-8')
+            METRICS.inc('serve_renders')
+        return html
+
+    async def _refresh_loop(self):
+        # Refresh hot cities before they expire and drop the ones nobody reads
+        interval = max(0.05, self.refresh_ahead / 4)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for city, entry in list(self.entries.items()):
+                idle = now - entry['read_at']
+                if idle > self.ttl + self.stale_for:
+                    del self.entries[city]
+                elif (idle < self.ttl and now - entry['fetched_at'] >= self.ttl - self.refresh_ahead
+                      and city not in self.inflight):
+                    self.stats['refreshes'] += 1
+                    self._fetch(city)
+
+    async def _handle(self, reader, writer):
+        # One client connection, with keep-alive
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, content_type, body, extra = self._error(400, 'Malformed request line')
+                    keep_alive = False
+                else:
+                    method, target, version = parts
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                    if method not in ('GET', 'HEAD'):
+                        # A request body would follow, do not try to read the next request after it
+                        status, content_type, body, extra = self._error(405, f"Method not allowed: {method}")
+                        keep_alive = False
+                    else:
+                        status, content_type, body, extra = await self._route(target)
+                    if method == 'HEAD':
+                        extra['Content-Length'] = str(len(body))
+                        body = b''
+
+                head = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}"]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                if 'Content-Length' not in extra:
+                    head.append(f"Content-Length: {len(body)}")
+                head.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+                await writer.drain()
+                METRICS.observe('serve', time.perf_counter() - start)
+                METRICS.inc('serve_requests', status=status)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def _error(self, status, message, **fields):
+        body = json.dumps(dict({'error': message}, **fields), ensure_ascii=False).encode('utf-8')
+        return status, 'application/json; charset=utf-8', body, {}
+
+    async def _route(self, target):
+        # (status, content type, body, extra headers) for a GET request
+        url = urlsplit(target)
+        if url.path == '/metrics':
+            return 200, 'text/plain; version=0.0.4', METRICS.to_prometheus().encode('utf-8'), {}
+        if not url.path.startswith('/pollen/'):
+            return self._error(404, f"Not found: {url.path}")
+
+        name = unquote(url.path[len('/pollen/'):])
+        as_html = name.endswith('.html')
+        if as_html:
+            name = name[:-len('.html')]
+        try:
+            city = resolve_city(name)
+        except UnknownCityError as e:
+            return self._error(404, str(e), suggestions=e.suggestions)
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        language = query.get('language', self.languages[0])
+        if language not in self.languages:
+            return self._error(400, f"Unsupported language: {language}")
+        days = query.get('days', '1')
+        if not days.isdigit() or not 1 <= int(days) <= self.max_days:
+            return self._error(400, f"days must be between 1 and {self.max_days}")
+
+        entry, state = await self.lookup(city)
+        if 'error' in entry['data']:
+            return self._error(502, entry['data']['error'], city=city)
+
+        age = int(time.monotonic() - entry['fetched_at'])
+        extra = {'X-Cache': state, 'Age': str(age), 'Cache-Control': f"max-age={max(0, int(self.ttl) - age)}"}
+        if as_html:
+            return 200, 'text/html; charset=utf-8', await self._rendering(entry, language, int(days)), extra
+        return 200, 'application/json; charset=utf-8', entry['body'], extra
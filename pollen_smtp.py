@@ -0,0 +1,237 @@
+"""
+SMTP connections and a pool of authenticated sessions
+
+Opening an SMTP connection costs a TCP and TLS handshake plus an AUTH round
+trip, and many providers rate-limit repeated logins. SMTPPool keeps logged-in
+connections open and reuses them for many messages, either email.message
+objects or pollen_mime.PreparedMessage bodies that were serialized once.
+"""
+import logging
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pollen_metrics import METRICS
+
+# SMTP reply code for "service not available, closing transmission channel"
+SMTP_SERVICE_NOT_AVAILABLE = 421
+
+def open_smtp_connection(config, timeout=60):
+    """
+    Open an SMTP connection and log in
+
+    Args:
+        config (dict): Email configuration ('smtp_server', 'smtp_port', 'use_ssl',
+            'use_starttls', 'smtp_auth_required', 'email_from', 'email_password')
+        timeout (float): Socket timeout in seconds
+
+    Returns:
+        smtplib.SMTP: Connected and authenticated session
+    """
+    with METRICS.timer('smtp_connect'):
+        if config['use_ssl']:
+            # Use SSL connection
+            logging.info("Using SSL connection to SMTP server")
+            server = smtplib.SMTP_SSL(config['smtp_server'], int(config['smtp_port']), timeout=timeout)
+        else:
+            # Use non-SSL connection
+            logging.info("Using non-SSL connection to SMTP server")
+            server = smtplib.SMTP(config['smtp_server'], int(config['smtp_port']), timeout=timeout)
+            if config.get('use_starttls', True):
+                server.starttls()  # Enable TLS encryption
+
+    if config['smtp_auth_required']:
+        # Login authentication
+        logging.info(f"Using {config['email_from']} for SMTP authentication")
+        with METRICS.timer('smtp_auth'):
+            server.login(config['email_from'], config['email_password'])
+
+    return server
+
+def is_connection_error(error):
+    """
+    Check whether an SMTP error means the connection is no longer usable
+
+    Args:
+        error (Exception): Error raised while sending
+
+    Returns:
+        bool: True if the message should be retried on a new connection
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError)):
+        return True
+    return getattr(error, 'smtp_code', None) == SMTP_SERVICE_NOT_AVAILABLE
+
+class SMTPPool:
+    """
+    Pool of authenticated SMTP connections
+
+    Args:
+        config (dict): Email configuration, see open_smtp_connection
+        max_connections (int): Maximum number of connections open at the same time
+        max_messages_per_connection (int): Messages sent over one connection
+            before it is closed and replaced
+        max_retries (int): Reconnect attempts per message after the server
+            dropped the connection or answered 421
+        timeout (float): Socket timeout in seconds
+        max_idle (float): Idle connections older than this many seconds are
+            closed instead of reused, since servers drop them anyway
+    """
+
+    def __init__(self, config, max_connections=2, max_messages_per_connection=100, max_retries=2, timeout=60,
+                 max_idle=240):
+        self.config = config
+        self.max_connections = max_connections
+        self.max_messages_per_connection = max_messages_per_connection
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.stats = {'connections': 0, 'reconnects': 0, 'expired': 0, 'sent': 0, 'failed': 0}
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _acquire(self):
+        # Returns [server, messages_sent, last_used], opening a connection if none is idle
+        self._slots.acquire()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+                if self.max_idle is None or time.monotonic() - conn[2] <= self.max_idle:
+                    return conn
+                self.stats['expired'] += 1
+            _quit(conn[0])
+        try:
+            server = open_smtp_connection(self.config, timeout=self.timeout)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.stats['connections'] += 1
+        return [server, 0, time.monotonic()]
+
+    def _release(self, conn):
+        if conn is not None:
+            if self._closed or conn[1] >= self.max_messages_per_connection:
+                _quit(conn[0])
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        self._slots.release()
+
+    def send(self, msg, from_addr=None, to_addrs=None):
+        """
+        Send a message over a pooled connection
+
+        Args:
+            msg (email.message.Message): Message to send
+            from_addr (str): Envelope sender, defaults to the From header
+            to_addrs (list): Envelope recipients, defaults to the To/Cc/Bcc headers
+
+        Returns:
+            dict: Recipients that were refused, see smtplib.SMTP.send_message
+        """
+        return self._send(lambda server: server.send_message(msg, from_addr=from_addr, to_addrs=to_addrs),
+                          msg['To'], len(to_addrs) if to_addrs else 1)
+
+    def send_prepared(self, prepared, to_addrs, to=None, message_id=None):
+        """
+        Send a prepared message over a pooled connection, in one SMTP transaction
+
+        Args:
+            prepared (pollen_mime.PreparedMessage): Message to send
+            to_addrs (list): Envelope recipients
+            to (str): To header, see pollen_mime.PreparedMessage.send
+            message_id (str): Message-ID header, a new one if None
+
+        Returns:
+            dict: Recipients that were refused, see smtplib.SMTP.sendmail
+        """
+        return self._send(lambda server: prepared.send(server, to_addrs, to, message_id),
+                          to_addrs[0] if len(to_addrs) == 1 else None, len(to_addrs))
+
+    def _send(self, deliver, recipient, emails):
+        # deliver(server) sends one message; retried on a new connection when the server dropped us
+        attempt = 0
+        while True:
+            conn = self._acquire()
+            try:
+                with METRICS.timer('smtp_send', recipient=recipient):
+                    refused = deliver(conn[0])
+                conn[1] += 1
+                conn[2] = time.monotonic()
+                with self._lock:
+                    self.stats['sent'] += 1
+                METRICS.inc('emails_sent', emails)
+                return refused
+            except Exception as e:
+                if not is_connection_error(e) or attempt >= self.max_retries:
+                    with self._lock:
+                        self.stats['failed'] += 1
+                    METRICS.inc('emails_failed', emails)
+                    if is_connection_error(e):
+                        _quit(conn[0])
+                        conn = None
+                    raise
+                # The server dropped us, throw the connection away and try a new one
+                logging.warning(f"SMTP connection lost ({e}), reconnecting")
+                _quit(conn[0])
+                conn = None
+                attempt += 1
+                with self._lock:
+                    self.stats['reconnects'] += 1
+                METRICS.inc('smtp_reconnects')
+            finally:
+                self._release(conn)
+
+    def send_batch(self, messages):
+        """
+        Send many messages over the pooled connections
+
+        Args:
+            messages (list): email.message.Message objects, or tuples of
+                send_prepared arguments
+
+        Returns:
+            list: One entry per message, in order: None if it was sent,
+                otherwise the exception that made it fail
+        """
+        def send_one(msg):
+            try:
+                if isinstance(msg, tuple):
+                    self.send_prepared(*msg)
+                else:
+                    self.send(msg)
+                return None
+            except Exception as e:
+                recipients = ', '.join(msg[1]) if isinstance(msg, tuple) else msg['To']
+                logging.error(f"Error sending email to {recipients}: {str(e)}")
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            return list(executor.map(send_one, messages))
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for server, _, _ in idle:
+            _quit(server)
+
+def _quit(server):
+    try:
+        server.quit()
+    except Exception:
+        server.close()
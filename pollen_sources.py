@@ -0,0 +1,97 @@
+"""
+Pollen data sources
+
+A data source turns city slugs into pollen data dicts with 'date', 'title',
+'pollen_items' ({'type', 'concentration'} with German type names and levels
+'0' to '3'), 'days' and 'city', the shape format_email_content, the history
+and the change detection work with. A city that could not be scraped gets
+the result of error_result, which has an 'error' key.
+
+Implementations:
+    wetteronline  One pollen page per city (pollen_scraper.WetterOnlineSource)
+    dwd           The national DWD feed, downloaded once (pollen_dwd.DWDSource)
+"""
+import datetime
+import logging
+from pollen_metrics import METRICS
+
+SOURCES = ('wetteronline', 'dwd')
+
+class PollenSource:
+    """
+    Base class of the data sources
+
+    Subclasses implement scrape, and override scrape_many when a batch can
+    be fetched more cheaply than city by city.
+    """
+
+    name = None
+
+    # Name credited in emails, e.g. 'wetteronline.de'
+    title = None
+
+    def page_url(self, city):
+        """
+        Get the public page readers can check a city's forecast on
+
+        Args:
+            city (str): City slug
+
+        Returns:
+            str: URL, None if the source has none
+        """
+        return None
+
+    def scrape(self, city):
+        """
+        Get the pollen data of one city
+
+        Args:
+            city (str): City slug
+
+        Returns:
+            dict: Pollen data, see the module docstring
+        """
+        raise NotImplementedError
+
+    def scrape_many(self, cities, max_workers=8):
+        """
+        Get the pollen data of several cities
+
+        Args:
+            cities (list): City slugs
+            max_workers (int): Cities fetched concurrently, where the source fetches per city
+
+        Returns:
+            list: Pollen data dicts, in the same order as `cities`
+        """
+        return [self.scrape(city) for city in cities]
+
+    def close(self):
+        """
+        Release what the source holds between runs
+        """
+
+def error_result(city, e):
+    """
+    Build the result of a city that could not be scraped
+
+    Args:
+        city (str): City slug
+        e (Exception): What went wrong
+
+    Returns:
+        dict: Pollen data with an 'error' key and a single error item
+    """
+    logging.error(f"Error scraping data: {str(e)}")
+    METRICS.inc('scrape_errors', city=city)
+    # Return error information
+    return {
+        'date': datetime.datetime.now().strftime("%Y-%m-%d"),
+        'title': f"Pollen Forecast for {city.capitalize()} (Scraping Failed)",
+        'pollen_items': [
+            {'type': f'Error: {str(e)}', 'concentration': '0'}
+        ],
+        'error': str(e),
+        'city': city
+    }
@@ -0,0 +1,130 @@
+"""
+Subscriber list loading
+
+A subscriber is a dict with 'email', 'city' and 'language'. Lists can be
+read from CSV (header row with email, city and optionally language), JSON
+(a list of objects, or an object with a "subscribers" list) or SQLite (a
+table with email, city and language columns). Free-text city names are
+resolved to pollen page slugs with the city registry (pollen_cities).
+
+An optional 'rules' column/key holds an alert rule such as
+"Birke >= 2 or Gräser >= 3" (see pollen_rules); such subscribers only get
+an email when their rule holds.
+"""
+import csv
+import json
+import logging
+import os
+import sqlite3
+from collections import Counter, OrderedDict
+from pollen_cities import UnknownCityError, resolve_cities
+from pollen_rules import parse_rule
+from pollen_templates import EMAIL_TEXTS
+
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+def normalize_subscriber(record, default_language='en'):
+    """
+    Clean up a subscriber record
+
+    Args:
+        record (dict): Raw record with 'email', 'city' and optionally
+            'language' and 'rules'
+        default_language (str): Language used when the record has none
+
+    Returns:
+        dict: Subscriber, or None if email or city is missing
+
+    Raises:
+        pollen_rules.RuleError: If the record has a rule that cannot be parsed
+        ValueError: If the record's language has no email texts
+    """
+    email = (record.get('email') or '').strip()
+    city = (record.get('city') or '').strip().lower()
+    if not email or not city:
+        return None
+    language = (record.get('language') or default_language).strip().lower()
+    if language not in EMAIL_TEXTS:
+        raise ValueError(f"Unsupported language '{language}', expected one of {', '.join(EMAIL_TEXTS)}")
+    subscriber = {'email': email, 'city': city, 'language': language}
+    rules = (record.get('rules') or '').strip()
+    if rules:
+        parse_rule(rules)
+        subscriber['rules'] = rules
+    return subscriber
+
+def load_subscribers(path, default_language='en', table='subscribers'):
+    """
+    Load a subscriber list
+
+    The format is chosen from the file extension (.csv, .json, .sqlite/.sqlite3/.db).
+
+    Args:
+        path (str): File path
+        default_language (str): Language for subscribers without one
+        table (str): Table name for SQLite files
+
+    Returns:
+        list: Subscribers with city slugs; records without email or city,
+            with an invalid rule or language, or with a city that is not in
+            the city registry, are skipped
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            records = list(csv.DictReader(f))
+    elif ext == '.json':
+        with open(path, encoding='utf-8') as f:
+            records = json.load(f)
+        if isinstance(records, dict):
+            records = records.get('subscribers', [])
+    elif ext in SQLITE_EXTENSIONS:
+        db = sqlite3.connect(path)
+        try:
+            db.row_factory = sqlite3.Row
+            columns = {row['name'] for row in db.execute(f'PRAGMA table_info("{table}")')}
+            select = 'email, city, language' + (', rules' if 'rules' in columns else '')
+            records = [dict(row) for row in db.execute(f'SELECT {select} FROM "{table}"')]
+        finally:
+            db.close()
+    else:
+        raise ValueError(f"Unsupported subscriber list format: {path}")
+
+    subscribers = []
+    for record in records:
+        try:
+            subscriber = normalize_subscriber(record, default_language)
+        except ValueError as e:
+            # Invalid rules (pollen_rules.RuleError) and languages
+            logging.warning(f"Skipping subscriber {record.get('email')}: {e}")
+            continue
+        if subscriber is None:
+            logging.warning(f"Skipping subscriber record without email or city: {record}")
+            continue
+        subscribers.append(subscriber)
+
+    # All city names in one bulk lookup, each distinct name is resolved once
+    resolved, unknown = resolve_cities(subscriber['city'] for subscriber in subscribers)
+    counts = Counter(subscriber['city'] for subscriber in subscribers if subscriber['city'] in unknown)
+    for city, suggestions in unknown.items():
+        logging.warning(f"Skipping {counts[city]} subscriber(s): {UnknownCityError(city, suggestions)}")
+    subscribers = [dict(subscriber, city=resolved[subscriber['city']])
+                   for subscriber in subscribers if subscriber['city'] in resolved]
+
+    logging.info(f"Loaded {len(subscribers)} subscribers from {path}")
+    return subscribers
+
+def group_by_city(subscribers):
+    """
+    Group subscribers by city
+
+    Args:
+        subscribers (list): Subscribers
+
+    Returns:
+        OrderedDict: City -> list of subscribers, in order of first appearance
+    """
+    groups = OrderedDict()
+    for subscriber in subscribers:
+        groups.setdefault(subscriber['city'], []).append(subscriber)
+    return groups
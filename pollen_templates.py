@@ -0,0 +1,357 @@
+"""
+Email templates
+
+Rendering is split in two steps. compile_email_template() does the
+per-language work once: it merges the static texts into the page skeleton
+and precomputes the table cells for every concentration level. The
+resulting EmailTemplate only has to fill in the city, the dates and the
+rows on each call. Compiled templates are cached by language.
+"""
+import datetime
+import functools
+import os
+
+POLLEN_TRANSLATIONS = {
+    'Ambrosia': {'en': 'Ragweed', 'zh': '豚草'},
+    'Ampfer': {'en': 'Sorrel', 'zh': '酸模'},
+    'Beifuß': {'en': 'Mugwort', 'zh': '艾蒿'},
+    'Birke': {'en': 'Birch', 'zh': '桦树'},
+    'Buche': {'en': 'Beech', 'zh': '山毛榉'},
+    'Erle': {'en': 'Alder', 'zh': '桤木'},
+    'Esche': {'en': 'Ash', 'zh': '梣树'},
+    'Gräser': {'en': 'Grasses', 'zh': '草'},
+    'Hasel': {'en': 'Hazel', 'zh': '榛树'},
+    'Pappel': {'en': 'Poplar', 'zh': '杨树'},
+    'Roggen': {'en': 'Rye', 'zh': '黑麦'},
+    'Ulme': {'en': 'Elm', 'zh': '榆树'},
+    'Wegerich': {'en': 'Plantain', 'zh': '车前草'},
+    'Weide': {'en': 'Willow', 'zh': '柳树'}
+}
+
+
+EMAIL_TEXTS = {
+    'en': {
+        'email_title': "Pollen Concentration Forecast for {city}",
+        'date': "Date: {today}",
+        'forecast_date': "Forecast Date",
+        'pollen_type': "Pollen Type",
+        'translation': "English Name",
+        'concentration': "Concentration Level",
+        'greeting': "Stay healthy!",
+        'forecast_days': "Next Days",
+        'footer_auto': "This email is generated by an automated system. Please do not reply.",
+        'footer_source': "Data Source: {source}",
+        'error_title': "Warning: Data Scraping Issue",
+        'error_check': "Please check if the website structure has changed or contact the script maintainer. You can visit the website manually to check the latest data:",
+        'levels': {
+            '0': '✅ None',
+            '1': '⚠️ Low',
+            '2': '🟠 Medium',
+            '3': '🔴 High'
+        }
+    },
+    'de': {
+        'email_title': "Pollenkonzentrationsprognose für {city}",
+        'date': "Datum: {today}",
+        'forecast_date': "Prognosedatum",
+        'pollen_type': "Pollentyp",
+        'translation': "Englischer Name",
+        'concentration': "Konzentrationsniveau",
+        'greeting': "Bleiben Sie gesund!",
+        'forecast_days': "Die nächsten Tage",
+        'footer_auto': "Diese E-Mail wird von einem automatisierten System generiert. Bitte antworten Sie nicht.",
+        'footer_source': "Datenquelle: {source}",
+        'error_title': "Warnung: Problem beim Datenabrufen",
+        'error_check': "Bitte überprüfen Sie, ob sich die Website-Struktur geändert hat, oder kontaktieren Sie den Skript-Betreuer. Sie können die Website manuell besuchen, um die neuesten Daten zu überprüfen:",
+        'levels': {
+            '0': '✅ Keine',
+            '1': '⚠️ Gering',
+            '2': '🟠 Mittel',
+            '3': '🔴 Stark'
+        }
+    },
+    'zh': {
+        'email_title': "{city}地区花粉浓度预报",
+        'date': "日期: {today}",
+        'forecast_date': "预报日期",
+        'pollen_type': "花粉类型",
+        'translation': "中文名称",
+        'concentration': "浓度等级",
+        'greeting': "祝您健康每一天！",
+        'forecast_days': "未来几天",
+        'footer_auto': "此邮件由自动系统生成，请勿回复。",
+        'footer_source': "数据来源: {source}",
+        'error_title': "警告：数据抓取遇到问题",
+        'error_check': "请检查网站结构是否已更改或联系脚本维护人员。您可以手动访问以下网站查看最新数据:",
+        'levels': {
+            '0': '✅ 无',
+            '1': '⚠️ 弱',
+            '2': '🟠 中',
+            '3': '🔴 强'
+        }
+    }
+}
+
+# Page skeleton; static texts are filled in when compiling, the slots
+# ({email_title}, {date}, {error_message}, {title}, {forecast_date_value}, {rows},
+# {days_table}, {footer_source}) on every render
+PAGE_SKELETON = """
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; color: #333; background-color: #f5f5f5; }}
+            h1 {{ color: #2c3e50; margin-top: 0; }}
+            h2 {{ color: #3498db; }}
+            .date {{ color: #7f8c8d; font-size: 0.9em; margin-bottom: 20px; }}
+            table {{ border-collapse: collapse; width: 100%; margin: 20px 0; background-color: white; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }}
+            th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
+            th {{ background-color: #f2f2f2; font-weight: bold; }}
+            tr:nth-child(even) {{ background-color: #f9f9f9; }}
+            .high {{ color: #e74c3c; font-weight: bold; }}
+            .medium {{ color: #f39c12; }}
+            .low {{ color: #27ae60; }}
+            .none {{ color: #7f8c8d; }}
+            .footer {{ margin-top: 30px; font-size: 0.8em; color: #7f8c8d; border-top: 1px solid #eee; padding-top: 15px; }}
+            .container {{ max-width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 5px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); }}
+            .header {{ background-color: #3498db; color: white; padding: 15px; border-radius: 5px 5px 0 0; margin: -20px -20px 20px; }}
+            .header h1 {{ color: white; margin: 0; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>{email_title}</h1>
+            </div>
+            <p class="date">{date}</p>
+            {error_message}
+            <h2>{title}</h2>
+            <p>{forecast_date}: {forecast_date_value}</p>
+            
+            <table>
+                <tr>
+                    <th>{pollen_type}</th>
+                    <th>{translation}</th>
+                    <th>{concentration}</th>
+                </tr>
+    {rows}
+            </table>{days_table}
+            <p>{greeting}</p>
+            <div class="footer">
+                <p>{footer_auto}</p>
+                <p>{footer_source}</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+ERROR_SKELETON = """
+        <div style="background-color: #ffebee; padding: 10px; border-left: 4px solid #f44336; margin-bottom: 20px;">
+            <h3 style="color: #d32f2f; margin-top: 0;">{error_title}</h3>
+            <p>{{error}}</p>
+            <p>{error_check}
+               <a href="{{url}}" target="_blank">{{source}}</a>
+            </p>
+        </div>
+        """
+
+ROW_START = """
+                <tr>
+                    <td>"""
+# Rows whose level changed since the last snapshot, see pollen_delta
+CHANGED_ROW_START = """
+                <tr style="background-color: #fff8e1; font-weight: bold;">
+                    <td>"""
+ROW_MIDDLE = """</td>
+                    <td>"""
+ROW_END = """</td>
+                    <td class="{css_class}">{level}</td>
+                </tr>
+        """
+
+# Compact table with one column per forecast day
+DAYS_TABLE_START = """
+            <h3>{forecast_days}</h3>
+            <table>
+                <tr>
+                    <th>{pollen_type}</th>"""
+DAYS_HEADER_CELL = """<th>{date}</th>"""
+DAYS_ROW_START = """
+                <tr>
+                    <td>{name}</td>"""
+DAYS_CELL = """<td class="{css_class}">{level}</td>"""
+DAYS_ROW_END = """</tr>"""
+DAYS_TABLE_END = """
+            </table>"""
+
+# Data source credited in the footer and linked from error emails, unless the caller names another one
+DEFAULT_SOURCE_NAME = 'wetteronline.de'
+DEFAULT_SOURCE_URL = 'https://www.wetteronline.de/pollen/{city}'
+
+# Marks the dynamic slots while splitting the compiled skeleton into static parts
+_SLOT = '\x00'
+
+CSS_CLASSES = {'3': 'high', '2': 'medium', '1': 'low'}
+
+class EmailTemplate:
+    """
+    Email template compiled for one language
+
+    Args:
+        language (str): Email language
+    """
+
+    def __init__(self, language):
+        self.language = language
+        text = EMAIL_TEXTS.get(language, EMAIL_TEXTS['en'])
+        self.levels = text['levels']
+        self.email_title = text['email_title']
+        self.date = text['date']
+
+        static = {key: value for key, value in text.items() if isinstance(value, str)}
+        self.footer_source = text['footer_source']
+        slots = dict.fromkeys(
+            ['email_title', 'date', 'error_message', 'title', 'forecast_date_value', 'rows', 'days_table',
+             'footer_source'], _SLOT
+        )
+        self.parts = PAGE_SKELETON.format(**dict(static, **slots)).split(_SLOT)
+        self.error_pattern = ERROR_SKELETON.format(**static)
+
+        # German name -> translated name
+        self.translations = {name: names.get(language, name) for name, names in POLLEN_TRANSLATIONS.items()}
+
+        # Concentration -> end of the table row
+        self.row_ends = {level: self._row_end(level) for level in self.levels}
+
+        self.days_table_start = DAYS_TABLE_START.format(**static)
+        # Concentration -> cell of the multi-day table
+        self.day_cells = {
+            level: DAYS_CELL.format(css_class=CSS_CLASSES.get(level, 'none'), level=level) for level in self.levels
+        }
+
+    def _row_end(self, concentration):
+        css_class = CSS_CLASSES.get(concentration, 'none')
+        return ROW_END.format(css_class=css_class, level=self.levels.get(concentration, concentration))
+
+    def render_rows(self, pollen_items, changes=None):
+        """
+        Render the table rows
+
+        Args:
+            pollen_items (list): Pollen items with 'type' and 'concentration'
+            changes (dict): Pollen type -> previous concentration; these rows
+                are highlighted and get an arrow showing the direction
+
+        Returns:
+            str: HTML table rows
+        """
+        # Sort by concentration, with higher concentrations at the top
+        sorted_items = sorted(pollen_items, key=lambda x: (x['concentration'] == '0', x['type']))
+
+        rows = []
+        for item in sorted_items:
+            concentration = item['concentration']
+            row_end = self.row_ends.get(concentration)
+            if row_end is None:
+                # Handle possible non-numeric concentration values, default to 0
+                if not (concentration.isdigit() and 0 <= int(concentration) <= 3):
+                    concentration = '0'
+                row_end = self._row_end(concentration)
+
+            pollen_name = item['type']
+            row_start = ROW_START
+            if changes and pollen_name in changes:
+                row_start = CHANGED_ROW_START
+                previous = changes[pollen_name]
+                rising = int(concentration) > (int(previous) if previous.isdigit() else 0)
+                head, cell_end, tail = row_end.rpartition('</td>')
+                row_end = head + (' ▲' if rising else ' ▼') + cell_end + tail
+            rows.append(row_start + pollen_name + ROW_MIDDLE + self.translations.get(pollen_name, pollen_name) + row_end)
+        return ''.join(rows)
+
+    def render_days_table(self, days):
+        """
+        Render the compact multi-day table
+
+        Pollen types are sorted by their highest level over the days, types
+        that stay at 0 on every day are left out.
+
+        Args:
+            days (list): Forecast days with 'date' and 'pollen_items'
+
+        Returns:
+            str: HTML table, empty for less than two days
+        """
+        if len(days) < 2:
+            return ''
+
+        levels = {}
+        for index, day in enumerate(days):
+            for item in day['pollen_items']:
+                concentration = item['concentration']
+                if concentration not in self.day_cells:
+                    concentration = '0'
+                levels.setdefault(item['type'], ['0'] * len(days))[index] = concentration
+
+        rows = [(max(day_levels), name) for name, day_levels in levels.items() if max(day_levels) != '0']
+        if not rows:
+            return ''
+
+        parts = [self.days_table_start]
+        parts.extend(DAYS_HEADER_CELL.format(date=day['date'] or '') for day in days)
+        parts.append(DAYS_ROW_END)
+        for _, name in sorted(rows, key=lambda row: (-int(row[0]), row[1])):
+            parts.append(DAYS_ROW_START.format(name=self.translations.get(name, name)))
+            parts.extend(self.day_cells[level] for level in levels[name])
+            parts.append(DAYS_ROW_END)
+        parts.append(DAYS_TABLE_END)
+        return ''.join(parts)
+
+    def render(self, data, days=1, source_name=None, source_url=None):
+        """
+        Render the email
+
+        Args:
+            data (dict): Pollen data
+            days (int): Number of forecast days in the multi-day table,
+                1 to leave the table out
+            source_name (str): Data source credited in the footer, defaults to wetteronline.de
+            source_url (str): Page linked when scraping failed, defaults to the city's wetteronline.de page
+
+        Returns:
+            str: HTML formatted email content
+        """
+        city = data.get('city', os.environ.get('CITY_NAME', 'Berlin'))
+        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        source_name = source_name or DEFAULT_SOURCE_NAME
+
+        error_message = ""
+        if 'error' in data:
+            url = source_url or DEFAULT_SOURCE_URL.format(city=city.lower())
+            error_message = self.error_pattern.format(error=data['error'], url=url, source=source_name)
+
+        p = self.parts
+        return ''.join((
+            p[0], self.email_title.format(city=city),
+            p[1], self.date.format(today=today),
+            p[2], error_message,
+            p[3], data['title'],
+            p[4], data['date'],
+            p[5], self.render_rows(data['pollen_items'], data.get('changes')),
+            p[6], self.render_days_table(data.get('days', [])[:days]) if days > 1 else '',
+            p[7], self.footer_source.format(source=source_name),
+            p[8],
+        ))
+
+@functools.lru_cache(maxsize=16)
+def compile_email_template(language):
+    """
+    Get the compiled email template for a language
+
+    Args:
+        language (str): Email language, unsupported languages use the English texts
+
+    Returns:
+        EmailTemplate: Compiled template, cached per language
+    """
+    return EmailTemplate(language)
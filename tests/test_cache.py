@@ -0,0 +1,95 @@
+import sqlite3
+import time
+
+import pytest
+
+import pollen_scraper
+from benchmark import StubPollenServer
+from pollen_cache import ResponseCache
+
+PARSED = {'date': 'Heute', 'title': 'Pollenflug', 'pollen_items': [], 'days': []}
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    yield cache
+    cache.close()
+
+def test_store_and_lookup(cache):
+    cache.store('http://x/a', {'ETag': '"1"', 'Last-Modified': 'Mon, 13 Apr 2026 08:00:00 GMT'}, b'page', PARSED, 0.25)
+    entry = cache.lookup('http://x/a')
+    assert entry.body == b'page'
+    assert entry.parsed == PARSED
+    assert entry.parse_seconds == 0.25
+    assert cache.is_fresh(entry)
+    assert cache.conditional_headers(entry) == {
+        'If-None-Match': '"1"', 'If-Modified-Since': 'Mon, 13 Apr 2026 08:00:00 GMT'
+    }
+    assert cache.conditional_headers(None) == {}
+    assert cache.lookup('http://x/b') is None
+
+def test_savings_are_counted(cache):
+    cache.store('http://x/a', {'ETag': '"1"'}, b'12345', PARSED, 0.25)
+    entry = cache.lookup('http://x/a')
+    cache.record_hit(entry)
+    cache.revalidated(entry, {'ETag': '"2"'})
+    assert cache.stats['hits'] == 1
+    assert cache.stats['revalidations'] == 1
+    assert cache.stats['bytes_saved'] == 10
+    assert cache.stats['parse_seconds_saved'] == pytest.approx(0.5)
+    assert cache.lookup('http://x/a').etag == '"2"'
+
+def test_expired_entries_are_dropped(cache):
+    cache.ttl = 10
+    cache.store('http://x/a', {}, b'page', PARSED)
+    cache._db.execute("UPDATE responses SET stored_at = ?", (time.time() - 60,))
+    assert cache.lookup('http://x/a') is None
+    assert cache.stats['evictions'] == 1
+
+def test_stale_entries_need_revalidation(cache):
+    cache.fresh_for = 10
+    cache.store('http://x/a', {}, b'page', PARSED)
+    entry = cache.lookup('http://x/a')
+    entry.stored_at -= 60
+    assert not cache.is_fresh(entry)
+
+def test_least_recently_used_is_evicted(cache):
+    cache.max_bytes = 10
+    cache.store('http://x/a', {}, b'aaaa', PARSED)
+    cache.store('http://x/b', {}, b'bbbb', PARSED)
+    cache._db.execute("UPDATE responses SET accessed_at = accessed_at - 60 WHERE url = 'http://x/b'")
+    cache.lookup('http://x/a')
+    cache.store('http://x/c', {}, b'cccc', PARSED)
+    assert cache.lookup('http://x/b') is None
+    assert cache.lookup('http://x/a') is not None
+    assert cache.lookup('http://x/c') is not None
+
+def test_old_cache_file_is_upgraded(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE responses (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB NOT NULL, "
+               "parsed TEXT NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+    db.execute("INSERT INTO responses VALUES ('http://x/a', NULL, NULL, x'00', '{}', 1, ?, ?)",
+               (time.time(), time.time()))
+    db.commit()
+    db.close()
+    cache = ResponseCache(path)
+    assert cache.lookup('http://x/a').parse_seconds == 0
+    cache.close()
+
+def test_scrape_through_cache(cache, monkeypatch):
+    with StubPollenServer() as stub:
+        monkeypatch.setattr(pollen_scraper, 'POLLEN_BASE_URL', stub.base_url)
+        first = pollen_scraper.scrape_pollen_data('berlin', cache=cache)
+        assert cache.stats['misses'] == 1
+        # Stale: revalidated with a 304, nothing downloaded or parsed again
+        cache.fresh_for = 0
+        assert pollen_scraper.scrape_pollen_data('berlin', cache=cache)['pollen_items'] == first['pollen_items']
+        assert cache.stats['revalidations'] == 1
+        # Fresh: served without a request
+        cache.fresh_for = 3600
+        pollen_scraper.scrape_pollen_data('berlin', cache=cache)
+        assert cache.stats['hits'] == 1
+        assert stub.requests == 2
+        assert stub.bytes_sent == len(stub.pages[0])
+        assert cache.stats['parse_seconds_saved'] > 0
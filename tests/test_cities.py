@@ -0,0 +1,118 @@
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pollen_cities
+from pollen_cities import UnknownCityError, normalize_city, resolve_cities, resolve_city
+
+# Real towns a letter or two away from another indexed city
+NEAR_MISSES = {
+    'Amberg': 'amberg',
+    'Langen': 'langen',
+    'Lingen': 'lingen',
+    'Neubrandenburg': 'neubrandenburg',
+}
+
+# Misspelled names and the city they should be suggested for, never resolved to
+MISSPELLINGS = {
+    'Bamburg': 'bamberg',
+    'Erlangn': 'erlangen',
+    'Solingn': 'solingen',
+}
+
+def test_normalize_city():
+    assert normalize_city('  München ') == 'muenchen'
+    assert normalize_city('Frankfurt (Oder)') == 'frankfurt-oder'
+    assert normalize_city('Düsseldorf') == 'duesseldorf'
+    assert normalize_city('Besançon') == 'besancon'
+
+@pytest.mark.parametrize('name, slug', [
+    ('München', 'muenchen'),
+    ('muenchen', 'muenchen'),
+    ('Munchen', 'muenchen'),
+    ('Frankfurt am Main', 'frankfurt'),
+    ('Cologne', 'koeln'),
+    ('Bamberg', 'bamberg'),
+    ('Erlangen', 'erlangen'),
+])
+def test_exact_and_alias(name, slug):
+    assert resolve_city(name, strict=True) == slug
+
+@pytest.mark.parametrize('name', sorted(NEAR_MISSES))
+def test_near_misses_resolve_to_themselves(name):
+    assert resolve_city(name, strict=True) == NEAR_MISSES[name]
+
+@pytest.mark.parametrize('name', sorted(MISSPELLINGS))
+def test_no_fuzzy_substitution(name, caplog):
+    slug = normalize_city(name)
+    with caplog.at_level(logging.WARNING):
+        assert resolve_city(name, strict=False) == slug
+    assert MISSPELLINGS[name] in caplog.text
+    with pytest.raises(UnknownCityError) as error:
+        resolve_city(name, strict=True)
+    assert MISSPELLINGS[name] in error.value.suggestions
+
+def test_unindexed_city_passes_through(caplog):
+    with caplog.at_level(logging.WARNING):
+        resolved, unknown = resolve_cities(['Bad Wildbad', 'bad wildbad', 'München'], strict=False)
+    assert resolved == {'Bad Wildbad': 'bad-wildbad', 'bad wildbad': 'bad-wildbad', 'München': 'muenchen'}
+    assert unknown == {}
+    # One warning per distinct name
+    assert caplog.text.count('using bad-wildbad as is') == 1
+
+def test_strict_rejects_unindexed():
+    resolved, unknown = resolve_cities(['Bad Wildbad', 'Köln'], strict=True)
+    assert resolved == {'Köln': 'koeln'}
+    assert list(unknown) == ['Bad Wildbad']
+
+def strict_default(setting):
+    # STRICT as set at import time, with POLLEN_STRICT_CITIES unset (None) or set to `setting`
+    env = {name: value for name, value in os.environ.items() if name != 'POLLEN_STRICT_CITIES'}
+    if setting is not None:
+        env['POLLEN_STRICT_CITIES'] = setting
+    code = 'import pollen_cities; print(pollen_cities.STRICT)'
+    return subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(pollen_cities.__file__), env=env,
+                          capture_output=True, text=True, check=True).stdout.strip() == 'True'
+
+def test_default_is_strict(monkeypatch):
+    assert strict_default(None) is True
+    assert strict_default('false') is False
+    monkeypatch.setattr(pollen_cities, 'STRICT', True)
+    with pytest.raises(UnknownCityError) as error:
+        resolve_city('Erlangn')
+    assert 'erlangen' in error.value.suggestions
+    monkeypatch.setattr(pollen_cities, 'STRICT', False)
+    assert resolve_city('Erlangn') == 'erlangn'
+
+def test_empty_name_is_rejected():
+    with pytest.raises(UnknownCityError):
+        resolve_city('  ', strict=False)
+
+def test_write_index(tmp_path):
+    path = str(tmp_path / 'cities.json')
+    pollen_cities.write_index([
+        {'slug': 'muenchen', 'name': 'München', 'state': 'Bayern', 'aliases': ['Munich']},
+        {'slug': 'koeln', 'name': 'Köln', 'state': 'Nordrhein-Westfalen'},
+    ], path)
+    assert resolve_cities(['Munich', 'Koln', 'Bonn'], strict=True, path=path) == (
+        {'Munich': 'muenchen', 'Koln': 'koeln'}, {'Bonn': []}
+    )
+    assert pollen_cities.city_info('koeln', path=path)['state'] == 'Nordrhein-Westfalen'
+    with pytest.raises(ValueError):
+        pollen_cities.write_index([
+            {'slug': 'a', 'name': 'Same', 'state': 'X'},
+            {'slug': 'b', 'name': 'Same', 'state': 'Y'},
+        ], str(tmp_path / 'ambiguous.json'))
+
+def test_tracked_city_list_is_indexed(tmp_path):
+    path = str(tmp_path / 'cities.json')
+    cities_csv = os.path.join(os.path.dirname(pollen_cities.INDEX_PATH), 'pollen_cities.csv')
+    assert pollen_cities.main([cities_csv, path]) == 0
+    with open(path, encoding='utf-8') as built, open(pollen_cities.INDEX_PATH, encoding='utf-8') as shipped:
+        assert built.read() == shipped.read()
+    assert resolve_cities(['Sylt', 'Westerland', 'Lingen (Ems)'], strict=True, path=path) == (
+        {'Sylt': 'sylt', 'Westerland': 'sylt', 'Lingen (Ems)': 'lingen'}, {}
+    )
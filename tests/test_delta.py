@@ -0,0 +1,72 @@
+import pytest
+
+import pollen_scraper
+from pollen_delta import REASON_BELOW_THRESHOLD, REASON_UNCHANGED, ChangeDetector, level_value
+
+def scraped(city, **levels):
+    return {'city': city, 'pollen_items': [{'type': name, 'concentration': level} for name, level in levels.items()]}
+
+@pytest.fixture
+def detector(tmp_path):
+    with ChangeDetector(str(tmp_path / 'delta.sqlite')) as delta:
+        yield delta
+
+def test_level_value():
+    assert level_value('3') == 3
+    assert level_value('') == 0
+    assert level_value('n/a') == 0
+
+def test_first_scrape_is_sent(detector):
+    assert detector.compare(scraped('berlin', Birke='2')) == {'send': True, 'reason': None, 'changes': {}}
+
+def test_unchanged_is_skipped(detector):
+    detector.update(scraped('Berlin', Birke='2', Erle='0'))
+    assert detector.compare(scraped('berlin', Birke='2', Erle='0')) == {
+        'send': False, 'reason': REASON_UNCHANGED, 'changes': {}
+    }
+    decision = detector.compare(scraped('berlin', Birke='3', Erle='0'))
+    assert decision == {'send': True, 'reason': None, 'changes': {'Birke': '2'}}
+    # A pollen type missing from the snapshot counts as level 0
+    assert detector.compare(scraped('berlin', Birke='2', Erle='0', Hasel='1'))['changes'] == {'Hasel': '0'}
+
+def test_min_change_and_threshold(tmp_path):
+    with ChangeDetector(str(tmp_path / 'delta.sqlite'), min_change=2) as delta:
+        delta.update(scraped('berlin', Birke='1'))
+        assert delta.compare(scraped('berlin', Birke='2'))['reason'] == REASON_BELOW_THRESHOLD
+        assert delta.compare(scraped('berlin', Birke='3'))['changes'] == {'Birke': '1'}
+    with ChangeDetector(str(tmp_path / 'threshold.sqlite'), threshold=2) as delta:
+        delta.update(scraped('berlin', Birke='2'))
+        # Moves that stay on one side of the threshold do not count
+        assert delta.compare(scraped('berlin', Birke='3'))['reason'] == REASON_BELOW_THRESHOLD
+        assert delta.compare(scraped('berlin', Birke='1'))['changes'] == {'Birke': '2'}
+
+def test_errors_are_always_sent(detector):
+    detector.update(scraped('berlin', Birke='2'))
+    assert detector.compare({'city': 'berlin', 'error': 'upstream down'})['send']
+    detector.update({'city': 'berlin', 'error': 'upstream down'})
+    detector.update(dict(scraped('berlin', Birke='0'), default_data=True))
+    assert not detector.compare(scraped('berlin', Birke='2'))['send']
+
+def test_snapshots_persist(tmp_path):
+    path = str(tmp_path / 'delta.sqlite')
+    with ChangeDetector(path) as delta:
+        delta.update(scraped('berlin', Birke='2'))
+    with ChangeDetector(path) as delta:
+        assert not delta.compare(scraped('berlin', Birke='2'))['send']
+
+def test_select_changed_records_skips(detector):
+    detector.update(scraped('berlin', Birke='2'))
+    detector.update(scraped('koeln', Birke='1'))
+    pollen_data = {
+        'berlin': scraped('berlin', Birke='2'),
+        'koeln': scraped('koeln', Birke='3'),
+        'hamburg': scraped('hamburg', Birke='0'),
+    }
+    recipients = {'berlin': ['a@example.com', 'b@example.com'], 'koeln': ['c@example.com'], 'hamburg': []}
+    selected = pollen_scraper.select_changed(pollen_data, recipients, detector)
+    assert sorted(selected) == ['hamburg', 'koeln']
+    assert selected['koeln']['changes'] == {'Birke': '1'}
+    assert 'changes' not in selected['hamburg']
+    assert [(skip['city'], skip['recipient'], skip['reason']) for skip in detector.skipped()] == [
+        ('berlin', 'a@example.com', REASON_UNCHANGED), ('berlin', 'b@example.com', REASON_UNCHANGED)
+    ]
@@ -0,0 +1,133 @@
+import datetime
+import json
+import os
+
+import pytest
+
+import pollen_cities
+import pollen_dwd
+from conftest import FIXTURES
+
+ISSUED = datetime.date(2026, 4, 14)
+
+with open(os.path.join(FIXTURES, 'dwd_s31fg.json'), encoding='utf-8') as f:
+    FEED = json.load(f)
+
+class FixtureSource(pollen_dwd.DWDSource):
+    # Reads the saved feed instead of downloading it
+    def __init__(self, today=ISSUED, feed=FEED):
+        super().__init__(today=today)
+        self.document = feed
+        self.downloads = 0
+
+    def _download(self):
+        self.downloads += 1
+        if self.document is None:
+            raise ConnectionError('feed unavailable')
+        self.feed = pollen_dwd.parse_feed(self.document)
+
+def levels(data, day=0):
+    return {item['type']: item['concentration'] for item in data['days'][day]['pollen_items']}
+
+def test_parse_feed():
+    feed = pollen_dwd.parse_feed(FEED)
+    assert feed['issued'] == ISSUED
+    berlin = feed['regions'][(50, -1)]
+    assert berlin['name'] == 'Brandenburg und Berlin'
+    # "2-3" is rounded up and recorded as such, "3" is exact
+    assert berlin['days'][0]['Birke'] == '3'
+    assert berlin['ranges'][0]['Birke'] == '2-3'
+    assert berlin['days'][1]['Birke'] == '3'
+    assert 'Birke' not in berlin['ranges'][1]
+    assert berlin['days'][0]['Beifuß'] == '0'
+    assert berlin['days'][0]['Gräser'] == '1'
+    # No forecast for the day after tomorrow
+    assert berlin['days'][2] is None
+
+def test_every_registry_city_is_mapped():
+    regions = pollen_dwd.parse_feed(FEED)['regions']
+    cities = pollen_cities.load_index()['cities']
+    # Cities without a partregion of their own use their state's region
+    assert set(pollen_dwd.CITY_REGIONS) <= set(cities)
+    assert {city: key for city, key in pollen_dwd.CITY_REGIONS.items() if key not in regions} == {}
+    assert set(info['state'] for info in cities.values()) <= set(pollen_dwd.STATE_REGIONS)
+    assert set(pollen_dwd.STATE_REGIONS.values()) <= {region_id for region_id, _ in regions}
+
+def test_scrape_city():
+    data = FixtureSource().scrape('berlin')
+    assert data['city'] == 'berlin'
+    assert data['region'] == 'Brandenburg und Berlin'
+    assert data['title'] == 'Pollenflug-Gefahrenindex für Berlin (Brandenburg und Berlin)'
+    assert not data['region_approximated']
+    assert data['date'] == 'Heute, 14.04.'
+    assert [day['date'] for day in data['days']] == ['Heute, 14.04.', 'Morgen, 15.04.']
+    assert data['pollen_items'] == data['days'][0]['pollen_items']
+    assert data['rounded_levels'] == {'Birke': '2-3', 'Erle': '0-1', 'Gräser': '0-1'}
+    assert data['days'][1]['rounded_levels'] == {'Esche': '0-1'}
+
+def test_state_fallback_is_marked(monkeypatch):
+    monkeypatch.delitem(pollen_dwd.CITY_REGIONS, 'leipzig')
+    data = FixtureSource().scrape('leipzig')
+    assert data['region'] == 'Sachsen'
+    assert data['region_approximated']
+    assert data['title'] == 'Pollenflug-Gefahrenindex für Leipzig (höchster Wert in Sachsen)'
+    # Highest level of Tiefland Sachsen and Mittelgebirge Sachsen
+    assert levels(data)['Birke'] == '3'
+    assert data['rounded_levels']['Birke'] == '2-3'
+    assert levels(data, 1)['Esche'] == '2'
+    # Birke is 2 in both parts tomorrow, exactly
+    assert levels(data, 1)['Birke'] == '2'
+    assert 'Birke' not in data['days'][1]['rounded_levels']
+
+def test_highest_prefers_exact_level():
+    parts = [
+        {'days': [{'Birke': '2'}, None, None], 'ranges': [{'Birke': '1-2'}, {}, {}]},
+        {'days': [{'Birke': '2'}, None, None], 'ranges': [{}, {}, {}]},
+        {'days': [{'Birke': '1'}, None, None], 'ranges': [{}, {}, {}]},
+    ]
+    assert pollen_dwd._highest(parts) == ([{'Birke': '2'}, None, None], [{}, {}, {}])
+
+def test_state_without_partregions_is_exact():
+    # Neubrandenburg has no entry of its own, Mecklenburg-Vorpommern is a single region
+    assert 'neubrandenburg' not in pollen_dwd.CITY_REGIONS
+    data = FixtureSource().scrape('neubrandenburg')
+    assert data['region'] == FixtureSource().scrape('rostock')['region']
+    assert not data['region_approximated']
+    assert 'höchster Wert' not in data['title']
+
+def test_unknown_city_is_an_error():
+    data = FixtureSource().scrape('bad-wildbad')
+    assert 'error' in data
+
+def test_days_are_aligned_to_today():
+    # Before the feed of the 15th is out, its "tomorrow" is today
+    data = FixtureSource(today=ISSUED + datetime.timedelta(days=1)).scrape('berlin')
+    assert [day['date'] for day in data['days']] == ['Heute, 15.04.']
+    assert levels(data)['Esche'] == '1'
+
+def test_outdated_feed_is_an_error():
+    data = FixtureSource(today=ISSUED + datetime.timedelta(days=2)).scrape('berlin')
+    assert 'no forecast' in data['error']
+
+def test_scrape_many_downloads_once():
+    source = FixtureSource()
+    results = source.scrape_many(['berlin', 'muenchen', 'hamburg'])
+    assert [data['city'] for data in results] == ['berlin', 'muenchen', 'hamburg']
+    assert not any('error' in data for data in results)
+    assert source.downloads == 1
+
+def test_failed_download():
+    results = FixtureSource(feed=None).scrape_many(['berlin', 'koeln'])
+    assert [data['error'] for data in results] == ['feed unavailable'] * 2
+
+def test_failed_refresh_keeps_copy():
+    source = FixtureSource()
+    source.load()
+    source.document = None
+    source.loaded_at -= source.max_age
+    assert source.scrape('berlin')['region'] == 'Brandenburg und Berlin'
+    assert source.downloads == 2
+
+@pytest.mark.parametrize('value, level', [('0', '0'), ('0-1', '1'), ('1-2', '2'), ('2-3', '3'), ('3', '3')])
+def test_levels_round_up(value, level):
+    assert pollen_dwd.LEVELS[value] == level
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+import requests
+
+from benchmark import StubPollenServer
+from pollen_fetch import (CircuitBreaker, CircuitOpenError, DeadlineExceeded, FetchPolicy, parse_retry_after,
+                          read_body)
+
+def policy(**overrides):
+    options = {'connect_timeout': 2.0, 'read_timeout': 2.0, 'max_retries': 3, 'backoff': 0.01, 'max_backoff': 0.02}
+    options.update(overrides)
+    return FetchPolicy(**options)
+
+def fail_first(n, **fault):
+    # Fault callback failing the first n requests of every path
+    return lambda path, count: fault if count <= n else None
+
+@pytest.fixture
+def session():
+    with requests.Session() as session:
+        yield session
+
+@pytest.mark.parametrize('fault, reason', [
+    ({'status': 503}, '503'),
+    ({'close': True}, 'connection'),
+    ({'truncate': 100}, 'body'),
+])
+def test_retries_until_success(session, fault, reason):
+    with StubPollenServer(fault=fail_first(2, **fault)) as stub:
+        response = policy().fetch(session, f"{stub.base_url}/berlin")
+        assert response.status_code == 200
+        assert b'pollen' in response.content
+        assert stub.path_requests['/pollen/berlin'] == 3
+
+def test_gives_up_after_retries(session):
+    with StubPollenServer(fault=fail_first(10, status=502)) as stub:
+        response = policy(max_retries=2).fetch(session, f"{stub.base_url}/berlin")
+        assert response.status_code == 502
+        assert stub.requests == 3
+
+def test_truncated_body_raises_after_retries(session):
+    breaker = CircuitBreaker(min_requests=100)
+    with StubPollenServer(fault=fail_first(10, truncate=100)) as stub:
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            policy(max_retries=1, breaker=breaker).fetch(session, f"{stub.base_url}/berlin")
+        assert stub.requests == 2
+        host = stub.base_url.split('/')[2]
+        assert list(breaker._hosts[host]['outcomes']) == [True, True]
+
+def test_retry_after_is_waited_for(session):
+    with StubPollenServer(fault=fail_first(1, status=429, headers={'Retry-After': '1'})) as stub:
+        start = time.monotonic()
+        response = policy().fetch(session, f"{stub.base_url}/berlin")
+        assert response.status_code == 200
+        assert time.monotonic() - start >= 1.0
+
+def test_long_retry_after_is_given_up_on(session):
+    with StubPollenServer(fault=fail_first(1, status=429, headers={'Retry-After': '120'})) as stub:
+        response = policy(max_retry_after=60).fetch(session, f"{stub.base_url}/berlin")
+        assert response.status_code == 429
+        assert stub.requests == 1
+
+def test_parse_retry_after():
+    assert parse_retry_after('7') == 7.0
+    assert parse_retry_after('') is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+def test_circuit_opens_and_rejects(session):
+    breaker = CircuitBreaker(window=4, min_requests=4, failure_ratio=0.75, reset_after=60)
+    with StubPollenServer(fault=fail_first(100, status=503)) as stub:
+        fetch_policy = policy(max_retries=0, breaker=breaker)
+        for city in ['a', 'b', 'c', 'd']:
+            assert fetch_policy.fetch(session, f"{stub.base_url}/{city}").status_code == 503
+        with pytest.raises(CircuitOpenError):
+            fetch_policy.fetch(session, f"{stub.base_url}/e")
+        assert stub.requests == 4
+
+def test_throttling_counts_as_failure(session):
+    breaker = CircuitBreaker(window=2, min_requests=2, failure_ratio=1.0)
+    with StubPollenServer(fault=fail_first(100, status=429, headers={'Retry-After': '0'})) as stub:
+        fetch_policy = policy(max_retries=0, breaker=breaker)
+        fetch_policy.fetch(session, f"{stub.base_url}/a")
+        fetch_policy.fetch(session, f"{stub.base_url}/b")
+        with pytest.raises(CircuitOpenError):
+            fetch_policy.fetch(session, f"{stub.base_url}/c")
+
+def test_half_open_trial(monkeypatch):
+    breaker = CircuitBreaker(window=2, min_requests=2, failure_ratio=1.0, reset_after=10)
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    breaker.record_failure('h')
+    breaker.record_failure('h')
+    assert not breaker.allow('h')
+    now[0] += 10
+    # One trial request, a second one waits for its outcome
+    assert breaker.allow('h')
+    assert not breaker.allow('h')
+    breaker.record_success('h')
+    assert not breaker.is_open('h')
+    assert breaker.allow('h')
+
+def test_deadline_before_fetch(session):
+    with pytest.raises(DeadlineExceeded):
+        policy().fetch(session, 'http://127.0.0.1:9/pollen/berlin', deadline=time.monotonic() - 1)
+
+def test_deadline_while_reading_body(session):
+    # About 4 seconds for the page at this bandwidth
+    with StubPollenServer(bandwidth=20000) as stub:
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            policy(read_timeout=5.0).fetch(session, f"{stub.base_url}/berlin", deadline=time.monotonic() + 0.3)
+        assert time.monotonic() - start < 1.5
+
+def test_stream_leaves_body_unread(session):
+    with StubPollenServer() as stub:
+        response = policy(stream=True).fetch(session, f"{stub.base_url}/berlin")
+        try:
+            assert not response._content_consumed
+            assert b'pollen' in read_body(response)
+        finally:
+            response.close()
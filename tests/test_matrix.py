@@ -0,0 +1,86 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import pollen_matrix
+from pollen_matrix import MISSING, POLLEN_TYPES, PollenMatrix
+
+def scraped(city, *days):
+    return {'city': city, 'days': [
+        {'date': f"day {i}", 'pollen_items': [{'type': name, 'concentration': level} for name, level in levels.items()]}
+        for i, levels in enumerate(days)
+    ]}
+
+RESULTS = [
+    scraped('berlin', {'Birke': '2', 'Erle': '0'}, {'Birke': '3', 'Erle': '0'}),
+    scraped('muenchen', {'Birke': '1', 'Gräser': '3'}, {'Birke': '1', 'Gräser': '2'}),
+    scraped('augsburg', {'Birke': '3', 'Gräser': '0', 'Unbekannt': '3'}),
+    {'city': 'koeln', 'error': 'upstream down'},
+]
+
+@pytest.fixture
+def matrix():
+    return PollenMatrix.from_results(RESULTS)
+
+def test_from_results(matrix):
+    assert matrix.levels.shape == (4, len(POLLEN_TYPES), 2)
+    assert matrix.dates == ['day 0', 'day 1']
+    assert matrix.level('berlin', 'Birke', 1) == 3
+    # Shorter forecasts, failed scrapes and types without a level are missing
+    assert matrix.level('augsburg', 'Birke', 1) is None
+    assert matrix.level('koeln', 'Birke') is None
+    assert matrix.level('berlin', 'Hasel') is None
+    assert matrix.pollen_items('muenchen') == [{'type': 'Birke', 'concentration': '1'},
+                                               {'type': 'Gräser', 'concentration': '3'}]
+
+def test_state_aggregation(matrix):
+    states, highest = matrix.state_max()
+    _, means = matrix.state_mean()
+    assert states == ['Bayern', 'Berlin', 'Nordrhein-Westfalen']
+    birke = POLLEN_TYPES.index('Birke')
+    assert highest[:, birke].tolist() == [3, 2, MISSING]
+    assert means[0, birke] == pytest.approx(2.0)
+    assert np.isnan(means[2, birke])
+
+def test_hotspots(matrix):
+    assert matrix.hotspots(2, pollen_type='Birke') == {'Birke': [('augsburg', 3), ('berlin', 2)]}
+    top = matrix.hotspots(5)
+    assert top['Gräser'] == [('muenchen', 3)]
+    assert top['Erle'] == []
+
+def test_deltas_and_changes(matrix):
+    birke, graeser = POLLEN_TYPES.index('Birke'), POLLEN_TYPES.index('Gräser')
+    deltas = matrix.deltas()
+    assert deltas.shape == (4, len(POLLEN_TYPES), 1)
+    assert deltas[0, birke, 0] == 1
+    assert deltas[1, graeser, 0] == -1
+    assert deltas[2, birke, 0] == 0
+    earlier = PollenMatrix.from_results([scraped('muenchen', {'Birke': '3'}), scraped('hamburg', {'Birke': '1'})])
+    changes = matrix.changes_since(earlier)
+    assert changes.shape == (4, len(POLLEN_TYPES))
+    assert changes[1, birke] == -2
+    # Cities the earlier snapshot does not have
+    assert not changes[0].any()
+
+def test_save_and_load(matrix, tmp_path):
+    path = str(tmp_path / 'national.pollen')
+    matrix.save(path)
+    for mmap in (True, False):
+        loaded = PollenMatrix.load(path, mmap=mmap)
+        assert loaded.cities == matrix.cities
+        assert loaded.dates == matrix.dates
+        assert loaded.created_at == matrix.created_at
+        assert np.array_equal(loaded.levels, matrix.levels)
+    with pytest.raises(ValueError):
+        (tmp_path / 'other.pollen').write_bytes(b'not a matrix')
+        PollenMatrix.load(str(tmp_path / 'other.pollen'))
+
+def test_main(matrix, tmp_path, capsys):
+    path = str(tmp_path / 'national.pollen')
+    matrix.save(path)
+    assert pollen_matrix.main(['--file', path, 'states', '--type', 'Birke']) == 0
+    assert 'Bayern' in capsys.readouterr().out
+    assert pollen_matrix.main(['--file', path, 'top', '--type', 'Gräser']) == 0
+    assert capsys.readouterr().out == 'Gräser: muenchen (3)\n'
+    assert pollen_matrix.main(['--file', path, 'states', '--type', 'Kaktus']) == 1
+    assert pollen_matrix.main(['--file', str(tmp_path / 'missing.pollen'), 'info']) == 1
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmark import StubPollenServer
+from pollen_metrics import Metrics, instrument_http_adapter
+
+def test_observe_and_count():
+    metrics = Metrics()
+    metrics.observe('parse', 0.5, city='berlin')
+    metrics.observe('parse', 0.25, city='berlin')
+    metrics.observe('smtp_send', 0.1, recipient='a@example.com')
+    metrics.inc('emails_sent', 3)
+    metrics.inc('fetch_retries', city='koeln', reason='status')
+    metrics.inc('fetch_retries', city='koeln', reason='status')
+    snap = metrics.snapshot()
+    assert snap['stages']['parse'] == {'count': 2, 'seconds': 0.75, 'max_seconds': 0.5}
+    assert snap['cities'] == {'berlin': {'parse': 0.75}}
+    assert snap['recipients'] == {'a@example.com': {'smtp_send': 0.1}}
+    assert snap['counters'] == [
+        {'name': 'emails_sent', 'labels': {}, 'value': 3},
+        {'name': 'fetch_retries', 'labels': {'city': 'koeln', 'reason': 'status'}, 'value': 2},
+    ]
+    metrics.reset()
+    assert metrics.snapshot()['stages'] == {}
+
+def test_timer_records_failures():
+    metrics = Metrics()
+    with pytest.raises(RuntimeError):
+        with metrics.timer('download', city='berlin'):
+            raise RuntimeError('down')
+    assert metrics.snapshot()['stages']['download']['count'] == 1
+    assert 'download' in metrics.snapshot()['cities']['berlin']
+
+def test_prometheus_format():
+    metrics = Metrics()
+    metrics.observe('render', 0.002, city='Frankfurt "Main"')
+    metrics.observe('smtp_send', 0.1, recipient='a@example.com')
+    metrics.inc('emails_sent', 2)
+    metrics.inc('serve_requests', status=200)
+    text = metrics.to_prometheus()
+    assert 'pollen_stage_seconds_total{stage="render"} 0.002000' in text
+    assert 'pollen_stage_count_total{stage="smtp_send"} 1' in text
+    assert 'pollen_city_stage_seconds_total{city="Frankfurt \\"Main\\"",stage="render"} 0.002000' in text
+    assert 'pollen_emails_sent_total 2' in text
+    assert 'pollen_serve_requests_total{status="200"} 1' in text
+    # Recipients are only in the JSON output
+    assert 'a@example.com' not in text
+    assert text.endswith('\n')
+
+def test_write(tmp_path):
+    metrics = Metrics()
+    metrics.inc('emails_sent')
+    metrics.write(str(tmp_path / 'pollen.json'))
+    metrics.write(str(tmp_path / 'pollen.prom'))
+    with open(tmp_path / 'pollen.json', encoding='utf-8') as f:
+        assert json.load(f)['counters'][0]['value'] == 1
+    assert 'pollen_emails_sent_total 1' in (tmp_path / 'pollen.prom').read_text(encoding='utf-8')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['pollen.json', 'pollen.prom']
+
+def test_instrumented_adapter_times_new_connections():
+    metrics = Metrics()
+    session = requests.Session()
+    session.mount('http://', instrument_http_adapter(HTTPAdapter(), metrics))
+    with StubPollenServer() as stub:
+        for _ in range(3):
+            session.get(f"{stub.base_url}/berlin").raise_for_status()
+    session.close()
+    snap = metrics.snapshot()
+    # Keep-alive: one connection for all requests
+    assert snap['stages']['http_connect']['count'] == 1
+    assert snap['counters'] == [{'name': 'http_connections', 'labels': {}, 'value': 1}]
@@ -0,0 +1,75 @@
+import email
+import email.header
+
+from benchmark import SMTPSink
+from pollen_mime import UNDISCLOSED_RECIPIENTS, PreparedMessage, html_to_text, split_recipients
+from pollen_smtp import SMTPPool
+
+HTML = '<html><head><style>p {color: red}</style></head><body><h1>Pollen</h1><p>Birke: <b>hoch</b></p></body></html>'
+
+def decoded(header):
+    return str(email.header.make_header(email.header.decode_header(header)))
+
+def prepared(**kwargs):
+    return PreparedMessage(HTML, 'alert@example.com', 'Pollen Alert', 'Pollen in Köln', **kwargs)
+
+def test_render_adds_per_recipient_headers():
+    message = prepared()
+    first = email.message_from_bytes(message.render('a@example.com'))
+    second = email.message_from_bytes(message.render('b@example.com', message_id='<fixed@example.com>'))
+    assert first['To'] == 'a@example.com'
+    assert second['To'] == 'b@example.com'
+    assert second['Message-ID'] == '<fixed@example.com>'
+    assert first['Message-ID'].endswith('@example.com>')
+    assert first['Date'] and first['From'] == 'Pollen Alert <alert@example.com>'
+    assert decoded(first['Subject']) == 'Pollen in Köln'
+    # The body is serialized once and shared by every recipient
+    assert message.render('a@example.com').endswith(message.data)
+    assert first.get_payload()[0].get_payload(decode=True).decode('utf-8') == HTML
+
+def test_non_ascii_to_is_encoded():
+    rendered = prepared().render('Jürgen <j@example.com>')
+    assert rendered.isascii()
+    assert decoded(email.message_from_bytes(rendered)['To']) == 'Jürgen <j@example.com>'
+
+def test_plain_text_alternative():
+    message = email.message_from_bytes(prepared(plain_text=True).render('a@example.com'))
+    assert message.get_content_subtype() == 'alternative'
+    text, html = message.get_payload()
+    assert text.get_payload(decode=True).decode('utf-8').splitlines() == ['Pollen', 'Birke: hoch']
+    assert html.get_content_type() == 'text/html'
+
+def test_html_to_text():
+    assert html_to_text('<table><tr><td>Birke</td><td>3</td></tr><tr><td>Erle</td><td>1</td></tr></table>') == (
+        'Birke 3\nErle 1\n'
+    )
+
+def test_digest_ignores_the_boundary():
+    first, second = prepared(), prepared()
+    assert first.data != second.data
+    assert first.digest == second.digest
+    assert prepared(plain_text=True).digest != first.digest
+
+def test_restore():
+    message = prepared()
+    restored = PreparedMessage.restore(message.data, message.from_addr, message.digest)
+    assert restored.digest == message.digest
+    assert restored.render('a@example.com', '<id@example.com>') == message.render('a@example.com', '<id@example.com>')
+
+def test_split_recipients():
+    recipients = [f"{i}@example.com" for i in range(5)]
+    assert split_recipients(recipients) == [[r] for r in recipients]
+    assert split_recipients(recipients, 2) == [recipients[0:2], recipients[2:4], recipients[4:]]
+    assert split_recipients(recipients, 0) == [[r] for r in recipients]
+
+def test_send_prepared_in_one_transaction(monkeypatch):
+    message = prepared()
+    sent = []
+    monkeypatch.setattr(PreparedMessage, 'render', lambda self, to, message_id=None: sent.append(to)
+                        or b'To: x\r\n' + self.data)
+    with SMTPSink() as sink:
+        with SMTPPool(sink.email_config()) as pool:
+            pool.send_prepared(message, ['a@example.com', 'b@example.com', 'c@example.com'])
+            pool.send_prepared(message, ['d@example.com'])
+    assert (sink.messages, sink.recipients) == (2, 4)
+    assert sent == [UNDISCLOSED_RECIPIENTS, 'd@example.com']
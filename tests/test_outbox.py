@@ -0,0 +1,143 @@
+import datetime
+import smtplib
+
+import pytest
+
+from pollen_mime import PreparedMessage
+from pollen_outbox import FAILED, PENDING, SENDING, SENT, Outbox, default_run_id
+
+class Crash(BaseException):
+    # The process dying while sending
+    pass
+
+class FakePool:
+    # Records the sends of SMTPPool.send_batch and answers with queued errors
+    def __init__(self, errors=(), crash_after=None):
+        self.errors = list(errors)
+        self.sent = []
+        self.crash_after = crash_after
+
+    def send_batch(self, messages):
+        if self.crash_after is not None and len(self.sent) >= self.crash_after:
+            raise Crash()
+        results = []
+        for prepared, to_addrs, to, message_id in messages:
+            error = self.errors.pop(0) if self.errors else None
+            if error is None:
+                self.sent.append((prepared.digest, tuple(to_addrs), message_id))
+            results.append(error)
+        return results
+
+@pytest.fixture
+def outbox(tmp_path):
+    with Outbox(str(tmp_path / 'outbox.sqlite'), run_id='run-1', max_wait=0) as outbox:
+        yield outbox
+
+def message(subject='Pollen'):
+    return PreparedMessage('<p>Birke: hoch</p>', 'alerts@example.com', 'Pollen Alert', subject)
+
+def test_same_run_is_idempotent(outbox):
+    prepared = message()
+    keys = outbox.enqueue_many([(prepared, ['a@example.com']), (prepared, ['b@example.com'])])
+    assert outbox.enqueue_many([(prepared, ['a@example.com'])]) == keys[:1]
+    assert outbox.status()[PENDING] == 2
+    pool = FakePool()
+    assert outbox.drain(pool)['sent'] == 2
+    # Re-running the same job after it sent does not send again
+    outbox.enqueue_many([(prepared, ['a@example.com'])])
+    assert outbox.drain(pool)['sent'] == 0
+    assert len(pool.sent) == 2
+
+def test_new_run_sends_again(outbox):
+    prepared = message()
+    first = outbox.enqueue_many([(prepared, ['a@example.com'])])
+    outbox.drain(FakePool())
+    outbox.start_run('run-2')
+    second = outbox.enqueue_many([(prepared, ['a@example.com'])])
+    assert first != second
+    assert outbox.states(first + second) == {first[0]: SENT, second[0]: PENDING}
+
+def test_message_key():
+    prepared = message()
+    key = Outbox.message_key(prepared, ['b@example.com', 'a@example.com'], 'run-1')
+    assert key == Outbox.message_key(prepared, ['a@example.com', 'b@example.com'], 'run-1')
+    assert key != Outbox.message_key(prepared, ['a@example.com', 'b@example.com'], 'run-2')
+    assert key != Outbox.message_key(message('Other'), ['a@example.com', 'b@example.com'], 'run-1')
+
+def test_abandoned_lease_is_released(outbox):
+    keys = outbox.enqueue_many([(message(), ['a@example.com'])])
+    rows = outbox._claim(10)
+    assert len(rows) == 1
+    assert outbox.states(keys) == {keys[0]: SENDING}
+    # Still leased: not claimed twice
+    assert outbox._claim(10) == []
+    outbox.lease = -1
+    pool = FakePool()
+    assert outbox.drain(pool)['sent'] == 1
+    # Sent again with the Message-ID of the first claim
+    assert pool.sent[0][2] == rows[0][4]
+
+def test_temporary_error_is_retried(outbox):
+    keys = outbox.enqueue_many([(message(), ['a@example.com'])])
+    stats = outbox.drain(FakePool([smtplib.SMTPResponseException(451, b'try later')]))
+    assert stats == {'sent': 0, 'retried': 1, 'failed': 0}
+    assert outbox.states(keys) == {keys[0]: PENDING}
+    assert outbox.next_due() > 0
+    assert outbox.status()['errors'][0]['attempts'] == 1
+
+def test_permanent_error_fails(outbox):
+    keys = outbox.enqueue_many([(message(), ['a@example.com'])])
+    stats = outbox.drain(FakePool([smtplib.SMTPResponseException(550, b'no such user')]))
+    assert stats == {'sent': 0, 'retried': 0, 'failed': 1}
+    assert outbox.states(keys) == {keys[0]: FAILED}
+    assert outbox.retry_failed() == 1
+    assert outbox.drain(FakePool())['sent'] == 1
+    assert outbox.states(keys) == {keys[0]: SENT}
+
+def test_out_of_attempts_fails(outbox):
+    outbox.max_attempts = 1
+    outbox.enqueue_many([(message(), ['a@example.com'])])
+    stats = outbox.drain(FakePool([smtplib.SMTPServerDisconnected('gone')]))
+    assert stats['failed'] == 1
+
+def test_body_survives_reopen(tmp_path):
+    path = str(tmp_path / 'outbox.sqlite')
+    prepared = message()
+    with Outbox(path, run_id='run-1') as outbox:
+        outbox.enqueue_many([(prepared, ['a@example.com'])])
+    pool = FakePool()
+    with Outbox(path, run_id='run-2', max_wait=0) as outbox:
+        assert outbox.drain(pool)['sent'] == 1
+    assert pool.sent[0][0] == prepared.digest
+
+def test_purge(outbox):
+    outbox.enqueue_many([(message(), ['a@example.com'])])
+    outbox.drain(FakePool())
+    assert outbox.purge(-1) == 1
+    assert outbox.status()[SENT] == 0
+
+def test_default_run_id():
+    assert default_run_id('subscribers.csv') == default_run_id('subscribers.csv')
+    assert default_run_id('subscribers.csv') != default_run_id('berlin')
+    slot = datetime.datetime(2026, 4, 17, 6, 0)
+    assert default_run_id('berlin', slot) == '2026-04-17T06:00 berlin'
+    assert default_run_id('berlin', slot) != default_run_id('berlin', slot + datetime.timedelta(hours=12))
+
+def test_restart_after_crash_sends_once(tmp_path):
+    path = str(tmp_path / 'outbox.sqlite')
+    emails = [(message(), [f'{name}@example.com']) for name in 'abcd']
+    pool = FakePool(crash_after=2)
+    # First process: sends two emails, one batch each, then dies while sending the third
+    outbox = Outbox(path, run_id=default_run_id('subscribers.csv'), batch_size=1, max_wait=0)
+    outbox.enqueue_many(emails)
+    with pytest.raises(Crash):
+        outbox.drain(pool)
+    outbox.close()
+    # Restart without a run id given: drain what is left, render and enqueue the same emails again, drain
+    pool.crash_after = None
+    with Outbox(path, run_id=default_run_id('subscribers.csv'), lease=-1, max_wait=0) as outbox:
+        outbox.drain(pool, max_wait=0)
+        outbox.enqueue_many(emails)
+        outbox.drain(pool)
+        assert outbox.status()[SENT] == 4
+    assert sorted(to_addrs for _, to_addrs, _ in pool.sent) == [(f'{name}@example.com',) for name in 'abcd']
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import pollen_parser
+import pollen_scraper
+from benchmark import StubPollenServer, load_fixtures
+
+@pytest.fixture(autouse=True)
+def stop_pool():
+    yield
+    pollen_parser.shutdown_pool()
+
+@pytest.fixture
+def two_cores(monkeypatch):
+    # The pool is only started on hosts with more than one core
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+
+def test_no_pool_without_workers():
+    assert pollen_parser.get_pool(0) is None
+
+def test_no_pool_on_one_core(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 1)
+    assert pollen_parser.get_pool(4) is None
+
+def test_pool_is_shared_and_shut_down(two_cores):
+    pool = pollen_parser.get_pool(2)
+    assert pool is not None
+    assert pollen_parser.get_pool(2) is pool
+    pollen_parser.shutdown_pool()
+    assert pollen_parser._pool is None
+
+def test_pool_results_match_threads(two_cores, monkeypatch):
+    cities = [f"city{i}" for i in range(12)]
+    with StubPollenServer(pages=load_fixtures()) as stub:
+        monkeypatch.setattr(pollen_scraper, 'POLLEN_BASE_URL', stub.base_url)
+        in_threads = pollen_scraper.scrape_many(cities, parse_workers=0)
+        in_processes = pollen_scraper.scrape_many(cities, parse_workers=2)
+    assert in_processes == in_threads
+    assert not any('error' in data for data in in_processes)
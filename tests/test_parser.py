@@ -0,0 +1,50 @@
+import glob
+import os
+
+import pytest
+
+import pollen_parser
+from conftest import FIXTURES
+
+PAGES = sorted(glob.glob(os.path.join(FIXTURES, 'pollen_*.html')))
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+@pytest.mark.parametrize('path', PAGES, ids=os.path.basename)
+def test_engines_agree(path):
+    html = read(path)
+    expected = pollen_parser.parse_pollen_page(html, 'html.parser')
+    assert expected['pollen_items']
+    for engine in pollen_parser.ENGINES:
+        if engine == 'lxml' and not pollen_parser._lxml_available():
+            continue
+        assert pollen_parser.parse_pollen_page(html, engine) == expected, engine
+
+@pytest.mark.parametrize('path', PAGES, ids=os.path.basename)
+def test_stream_matches_whole_page(path):
+    html = read(path)
+    chunks = [html[i:i + 1000] for i in range(0, len(html), 1000)]
+    page, received, stopped_early = pollen_parser.parse_pollen_stream(chunks)
+    assert page == pollen_parser.parse_pollen_page(html, 'html.parser')
+    assert html.startswith(received)
+    assert stopped_early == (received != html)
+
+def test_forecast_days():
+    page = pollen_parser.parse_pollen_page(read(os.path.join(FIXTURES, 'pollen_muenchen_days.html')))
+    assert len(page['days']) == 3
+    assert page['pollen_items'] == page['days'][0]['pollen_items']
+
+def test_backup_parsing():
+    page = pollen_parser.parse_pollen_page(read(os.path.join(FIXTURES, 'pollen_koeln_backup.html')))
+    assert page['backup_used']
+    assert page['pollen_items']
+
+def test_resolve_engine(monkeypatch):
+    assert pollen_parser.resolve_engine('strainer') == 'strainer'
+    with pytest.raises(ValueError):
+        pollen_parser.resolve_engine('nope')
+    monkeypatch.setattr(pollen_parser, '_lxml_available', lambda: False)
+    assert pollen_parser.resolve_engine('auto') == 'strainer'
+    assert pollen_parser.resolve_engine('lxml') == 'strainer'
@@ -0,0 +1,68 @@
+import itertools
+import random
+
+import pytest
+
+from pollen_rules import RuleError, RuleIndex, city_levels, parse_rule, rule_matches
+
+def data(city, **levels):
+    return {
+        'city': city,
+        'pollen_items': [{'type': pollen_type, 'concentration': str(level)}
+                         for pollen_type, level in levels.items()]
+    }
+
+def test_parse_rule():
+    assert parse_rule('Birke >= 2') == ((('Birke', frozenset({2, 3})),),)
+    assert parse_rule('birke > 2 OR Gräser = 1') == (
+        (('Birke', frozenset({3})),),
+        (('Gräser', frozenset({1})),),
+    )
+    assert parse_rule('Erle ≥ 1 and Hasel >= 2') == (
+        (('Erle', frozenset({1, 2, 3})), ('Hasel', frozenset({2, 3}))),
+    )
+    # The same type twice in one alternative: both conditions must hold
+    assert parse_rule('Birke >= 1 and Birke = 2') == ((('Birke', frozenset({2})),),)
+
+@pytest.mark.parametrize('text', ['Birke', 'Birke >= 4', 'Palme >= 1', 'Birke >= 1 or', 'Birke <= 2'])
+def test_parse_rule_errors(text):
+    with pytest.raises(RuleError):
+        parse_rule(text)
+
+def test_city_levels():
+    assert city_levels(data('berlin', Birke=2, Erle=0)) == {'Birke': 2, 'Erle': 0}
+    assert city_levels(dict(data('berlin', Birke=2), error='timeout')) == {}
+    assert city_levels(dict(data('berlin', Birke=2), default_data=True)) == {}
+    assert city_levels(data('berlin', Birke=2), day=1) == {}
+
+def test_index_matches():
+    subscribers = [
+        {'email': 'a', 'city': 'berlin'},
+        {'email': 'b', 'city': 'berlin', 'rules': 'Birke >= 2'},
+        {'email': 'c', 'city': 'berlin', 'rules': 'Birke >= 3 or Gräser >= 1'},
+        {'email': 'd', 'city': 'berlin', 'rules': 'Birke >= 1 and Erle >= 1'},
+        {'email': 'e', 'city': 'koeln', 'rules': 'Birke >= 1'},
+        {'email': 'f', 'city': 'koeln'},
+    ]
+    index = RuleIndex(subscribers)
+    matched = index.match({'berlin': data('berlin', Birke=2, Erle=0, Gräser=0)})
+    assert [s['email'] for s in matched] == ['a', 'b']
+    matched = index.match({'berlin': data('berlin', Birke=1, Erle=1), 'koeln': data('koeln', Birke=0)})
+    assert [s['email'] for s in matched] == ['a', 'd', 'f']
+    # Subscribers with a rule never match a failed scrape
+    matched = index.match({'koeln': dict(data('koeln', Birke=3), error='timeout')})
+    assert [s['email'] for s in matched] == ['f']
+
+def test_index_agrees_with_rule_matches():
+    rng = random.Random(4)
+    types = ['Birke', 'Erle', 'Gräser', 'Hasel']
+    rules = [None, 'Birke >= 2', 'Erle = 1 or Hasel > 1', 'Gräser >= 1 and Birke >= 1',
+             'Birke ≥ 3 and Erle >= 2 or Hasel = 0', 'Birke >= 0']
+    subscribers = [{'email': str(i), 'city': rng.choice(['berlin', 'koeln']), 'rules': rng.choice(rules)}
+                   for i in range(300)]
+    index = RuleIndex(subscribers)
+    for levels in itertools.product(range(4), repeat=len(types)):
+        scraped = {'berlin': data('berlin', **dict(zip(types, levels)))}
+        expected = [s for s in subscribers if s['city'] in scraped and
+                    (not s['rules'] or rule_matches(parse_rule(s['rules']), city_levels(scraped[s['city']])))]
+        assert index.match(scraped) == expected
@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+
+from pollen_schedule import CronSchedule, Scheduler, parse_cron_field, read_schedule_file
+
+def at(*args):
+    return datetime.datetime(*args)
+
+def test_parse_cron_field():
+    assert parse_cron_field('*', 0, 4) == {0, 1, 2, 3, 4}
+    assert parse_cron_field('*/15', 0, 59) == {0, 15, 30, 45}
+    assert parse_cron_field('1-5', 0, 7) == {1, 2, 3, 4, 5}
+    assert parse_cron_field('0,30', 0, 59) == {0, 30}
+    assert parse_cron_field('8-18/4', 0, 23) == {8, 12, 16}
+    assert parse_cron_field('50/5', 0, 59) == {50, 55}
+
+@pytest.mark.parametrize('field', ['60', '5-1', '*/0', 'x'])
+def test_invalid_cron_field(field):
+    with pytest.raises(ValueError):
+        parse_cron_field(field, 0, 59)
+
+def test_next_after():
+    weekdays = CronSchedule('30 6 * * 1-5')
+    # 2026-10-16 is a Friday
+    assert weekdays.next_after(at(2026, 10, 16, 6, 0)) == at(2026, 10, 16, 6, 30)
+    assert weekdays.next_after(at(2026, 10, 16, 6, 30)) == at(2026, 10, 19, 6, 30)
+    assert CronSchedule('@monthly').next_after(at(2026, 12, 31, 12, 0)) == at(2027, 1, 1, 0, 0)
+    assert CronSchedule('0 12 29 2 *').next_after(at(2026, 3, 1)) == at(2028, 2, 29, 12, 0)
+    # Sunday is 0 or 7
+    assert CronSchedule('0 8 * * 7').next_after(at(2026, 10, 16)) == at(2026, 10, 18, 8, 0)
+
+def test_day_or_weekday():
+    # The 20th or any Monday, whichever comes first
+    schedule = CronSchedule('0 9 20 * 1')
+    assert schedule.next_after(at(2026, 10, 16)) == at(2026, 10, 19, 9, 0)
+    assert schedule.next_after(at(2026, 10, 19, 9, 0)) == at(2026, 10, 20, 9, 0)
+
+@pytest.mark.parametrize('expr', ['0 6 * *', '0 6 31 2 *'])
+def test_invalid_schedule(expr):
+    with pytest.raises(ValueError):
+        CronSchedule(expr).next_after(at(2026, 1, 1))
+
+def test_read_schedule_file(tmp_path):
+    path = tmp_path / 'schedule.txt'
+    path.write_text(
+        "# minute hour day month weekday  cities\n"
+        "0 6 * * *     berlin, hamburg\n"
+        "\n"
+        "30 7 * * 1-5  *  # everyone\n"
+        "@hourly muenchen\n",
+        encoding='utf-8'
+    )
+    entries = read_schedule_file(str(path))
+    assert [(schedule.expr, cities) for schedule, cities in entries] == [
+        ('0 6 * * *', ['berlin', 'hamburg']),
+        ('30 7 * * 1-5', None),
+        ('@hourly', ['muenchen']),
+    ]
+
+class Immediately:
+    # Due when planned, so the scheduler runs its jobs in turn right away
+    def next_after(self, dt):
+        return dt
+
+def test_scheduler_passes_the_slot():
+    scheduler = Scheduler()
+    slots = []
+
+    def job(slot):
+        slots.append(slot)
+        if len(slots) == 2:
+            scheduler.stop()
+
+    def failing(slot):
+        raise RuntimeError('boom')
+
+    scheduler.add('failing', Immediately(), failing)
+    scheduler.add('job', Immediately(), job)
+    scheduler.run()
+    assert len(slots) == 2
+    assert all(isinstance(slot, datetime.datetime) for slot in slots)
+    assert slots[0] < slots[1]
+    # The failing job keeps being scheduled
+    assert scheduler.jobs[0]['runs'] >= 1
+    assert scheduler.jobs[1]['runs'] == 2
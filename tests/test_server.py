@@ -0,0 +1,136 @@
+import asyncio
+import json
+import threading
+import time
+
+import pollen_cities
+from pollen_server import PollenServer
+
+def data(city):
+    return {'city': city, 'title': f"Pollen {city}", 'date': 'Heute',
+            'pollen_items': [{'type': 'Birke', 'concentration': '2'}]}
+
+class Upstream:
+    # Blocking scrape and render callables that count their calls
+    def __init__(self, delay=0.0, error=False):
+        self.delay = delay
+        self.error = error
+        self.scrapes = []
+        self.renders = []
+        self.render_threads = set()
+
+    def scrape(self, city):
+        time.sleep(self.delay)
+        self.scrapes.append(city)
+        return dict(data(city), error='upstream down') if self.error else data(city)
+
+    def render(self, data, language, days):
+        self.renders.append((data['city'], language, days))
+        self.render_threads.add(threading.current_thread().name)
+        return f"<h1>{data['title']}</h1><p>{language} {days}</p>"
+
+async def get(port, path, method='GET'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, body
+
+def serve(upstream, test, **options):
+    # Run a test coroutine against a server on a free port
+    async def run():
+        server = PollenServer(upstream.scrape, upstream.render, languages=('en', 'de'), **options)
+        port = await server.start(port=0)
+        try:
+            return await test(server, port)
+        finally:
+            await server.stop()
+    return asyncio.run(run())
+
+def test_json_miss_then_hit():
+    upstream = Upstream()
+
+    async def test(server, port):
+        status, headers, body = await get(port, '/pollen/München')
+        assert status == 200
+        assert headers['X-Cache'] == 'miss'
+        assert json.loads(body) == data('muenchen')
+        status, headers, _ = await get(port, '/pollen/muenchen')
+        assert headers['X-Cache'] == 'hit'
+
+    serve(upstream, test)
+    assert upstream.scrapes == ['muenchen']
+
+def test_concurrent_misses_share_one_fetch():
+    upstream = Upstream(delay=0.2)
+
+    async def test(server, port):
+        results = await asyncio.gather(*[get(port, '/pollen/berlin') for _ in range(10)])
+        assert [status for status, _, _ in results] == [200] * 10
+
+    serve(upstream, test)
+    assert upstream.scrapes == ['berlin']
+
+def test_html_is_rendered_once_per_language_and_days_off_the_loop():
+    upstream = Upstream()
+
+    async def test(server, port):
+        for _ in range(3):
+            status, headers, body = await get(port, '/pollen/berlin.html?language=de&days=2')
+            assert status == 200
+            assert headers['Content-Type'] == 'text/html; charset=utf-8'
+            assert body == b'<h1>Pollen berlin</h1><p>de 2</p>'
+        await get(port, '/pollen/berlin.html')
+
+    serve(upstream, test)
+    assert upstream.renders == [('berlin', 'de', 2), ('berlin', 'en', 1)]
+    assert all(name.startswith('pollen-render') for name in upstream.render_threads)
+
+def test_refresh_drops_renderings():
+    upstream = Upstream()
+
+    async def test(server, port):
+        await get(port, '/pollen/berlin.html')
+        server.entries['berlin']['fetched_at'] -= server.ttl
+        _, headers, _ = await get(port, '/pollen/berlin.html')
+        assert headers['X-Cache'] == 'stale'
+        await asyncio.sleep(0.05)
+        _, headers, _ = await get(port, '/pollen/berlin.html')
+        assert headers['X-Cache'] == 'hit'
+
+    serve(upstream, test, ttl=60)
+    assert upstream.scrapes == ['berlin', 'berlin']
+    assert upstream.renders == [('berlin', 'en', 1), ('berlin', 'en', 1)]
+
+def test_errors(monkeypatch):
+    monkeypatch.setattr(pollen_cities, 'STRICT', True)
+
+    async def test(server, port):
+        status, _, body = await get(port, '/pollen/Bamburg')
+        assert status == 404
+        assert 'bamberg' in json.loads(body)['suggestions']
+        assert (await get(port, '/pollen/berlin.html?language=fr'))[0] == 400
+        assert (await get(port, '/pollen/berlin.html?days=9'))[0] == 400
+        assert (await get(port, '/other'))[0] == 404
+        assert (await get(port, '/pollen/berlin', method='POST'))[0] == 405
+        status, _, body = await get(port, '/pollen/berlin')
+        assert status == 502
+        assert json.loads(body) == {'error': 'upstream down', 'city': 'berlin'}
+
+    serve(Upstream(error=True), test)
+
+def test_head_and_metrics():
+    async def test(server, port):
+        status, headers, body = await get(port, '/pollen/berlin', method='HEAD')
+        assert status == 200
+        assert body == b''
+        assert int(headers['Content-Length']) > 0
+        status, headers, body = await get(port, '/metrics')
+        assert status == 200
+        assert b'serve_requests' in body
+
+    serve(Upstream(), test)
@@ -0,0 +1,65 @@
+import smtplib
+import time
+
+import pollen_scraper
+from benchmark import SMTPSink
+from pollen_smtp import SMTPPool, is_connection_error
+
+def messages(config, n):
+    return [pollen_scraper.build_message('<p>Birke</p>', dict(config, email_to=f"{i}@example.com"))
+            for i in range(n)]
+
+def test_connections_are_reused():
+    with SMTPSink() as sink:
+        config = sink.email_config()
+        with SMTPPool(config, max_connections=2) as pool:
+            assert pool.send_batch(messages(config, 10)) == [None] * 10
+    assert sink.messages == 10
+    assert 1 <= sink.connections <= 2
+    assert sink.logins == sink.connections
+    assert pool.stats['sent'] == 10
+
+def test_connection_is_replaced_after_max_messages():
+    with SMTPSink() as sink:
+        config = sink.email_config()
+        with SMTPPool(config, max_connections=1, max_messages_per_connection=3) as pool:
+            assert pool.send_batch(messages(config, 7)) == [None] * 7
+    assert sink.messages == 7
+    assert sink.connections == 3
+
+def test_reconnects_when_the_server_drops_the_connection():
+    with SMTPSink(drop_after=2) as sink:
+        config = sink.email_config()
+        with SMTPPool(config, max_connections=1) as pool:
+            assert pool.send_batch(messages(config, 5)) == [None] * 5
+    assert sink.messages == 5
+    assert sink.connections == 3
+    assert pool.stats['reconnects'] == 2
+
+def test_failures_are_returned_per_message():
+    with SMTPSink(drop_after=0) as sink:
+        config = sink.email_config()
+        with SMTPPool(config, max_connections=1, max_retries=1) as pool:
+            errors = pool.send_batch(messages(config, 2))
+    assert all(is_connection_error(error) for error in errors)
+    assert sink.messages == 0
+    assert pool.stats['failed'] == 2
+    # One attempt and one retry per message
+    assert sink.connections == 4
+
+def test_idle_connections_expire():
+    with SMTPSink() as sink:
+        config = sink.email_config()
+        with SMTPPool(config, max_connections=1, max_idle=0.01) as pool:
+            pool.send_batch(messages(config, 1))
+            time.sleep(0.05)
+            pool.send_batch(messages(config, 1))
+    assert sink.connections == 2
+    assert pool.stats['expired'] == 1
+
+def test_is_connection_error():
+    assert is_connection_error(smtplib.SMTPServerDisconnected())
+    assert is_connection_error(ConnectionResetError())
+    assert is_connection_error(smtplib.SMTPSenderRefused(421, b'closing', 'a@example.com'))
+    assert not is_connection_error(smtplib.SMTPSenderRefused(550, b'no', 'a@example.com'))
+    assert not is_connection_error(ValueError())
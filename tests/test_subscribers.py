@@ -0,0 +1,129 @@
+import json
+import logging
+import sqlite3
+
+import pytest
+
+import pollen_scraper
+from benchmark import SMTPSink
+from pollen_sources import PollenSource
+from pollen_subscribers import group_by_city, load_subscribers, normalize_subscriber
+
+ROWS = [
+    {'email': 'a@example.com', 'city': 'München', 'language': 'de'},
+    {'email': 'b@example.com', 'city': 'Köln', 'language': ''},
+    {'email': 'c@example.com', 'city': 'muenchen', 'language': 'EN ', 'rules': 'Birke >= 2'},
+]
+
+class FakeSource(PollenSource):
+    # Fixed levels for every city, counting the cities asked for
+    name = 'fake'
+    title = 'example.com'
+
+    def __init__(self, birke='3'):
+        self.birke = birke
+        self.scraped = []
+
+    def scrape(self, city):
+        self.scraped.append(city)
+        return {'city': city, 'title': f"Pollen {city}", 'date': 'Heute',
+                'pollen_items': [{'type': 'Birke', 'concentration': self.birke}]}
+
+def write_csv(path, rows, columns=('email', 'city', 'language', 'rules')):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(','.join(columns) + '\n')
+        for row in rows:
+            f.write(','.join(row.get(column, '') for column in columns) + '\n')
+
+def test_normalize_subscriber():
+    assert normalize_subscriber({'email': ' a@example.com ', 'city': 'Berlin', 'language': 'DE '}) == {
+        'email': 'a@example.com', 'city': 'berlin', 'language': 'de'
+    }
+    assert normalize_subscriber({'email': 'a@example.com', 'city': ''}) is None
+    assert normalize_subscriber({'email': 'a@example.com', 'city': 'x'}, default_language='zh')['language'] == 'zh'
+
+@pytest.mark.parametrize('language', ['ger', 'english', 'fr'])
+def test_unsupported_language(language):
+    with pytest.raises(ValueError):
+        normalize_subscriber({'email': 'a@example.com', 'city': 'berlin', 'language': language})
+
+@pytest.mark.parametrize('ext', ['csv', 'json', 'sqlite'])
+def test_formats(tmp_path, ext):
+    path = str(tmp_path / f"subscribers.{ext}")
+    if ext == 'csv':
+        write_csv(path, ROWS)
+    elif ext == 'json':
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'subscribers': ROWS}, f)
+    else:
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE subscribers (email TEXT, city TEXT, language TEXT, rules TEXT)")
+        db.executemany("INSERT INTO subscribers VALUES (:email, :city, :language, :rules)",
+                       [dict({'rules': None}, **row) for row in ROWS])
+        db.commit()
+        db.close()
+    assert load_subscribers(path) == [
+        {'email': 'a@example.com', 'city': 'muenchen', 'language': 'de'},
+        {'email': 'b@example.com', 'city': 'koeln', 'language': 'en'},
+        {'email': 'c@example.com', 'city': 'muenchen', 'language': 'en', 'rules': 'Birke >= 2'},
+    ]
+
+def test_sqlite_without_rules_column(tmp_path):
+    path = str(tmp_path / 'subscribers.db')
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE subscribers (email TEXT, city TEXT, language TEXT)")
+    db.execute("INSERT INTO subscribers VALUES ('a@example.com', 'Berlin', 'de')")
+    db.commit()
+    db.close()
+    assert load_subscribers(path) == [{'email': 'a@example.com', 'city': 'berlin', 'language': 'de'}]
+
+def test_invalid_records_are_skipped(tmp_path, caplog):
+    path = str(tmp_path / 'subscribers.csv')
+    write_csv(path, ROWS + [
+        {'email': 'bad-rule@example.com', 'city': 'Berlin', 'rules': 'Birke >> 2'},
+        {'email': 'bad-language@example.com', 'city': 'Berlin', 'language': 'ger'},
+        {'email': '', 'city': 'Berlin'},
+    ])
+    with caplog.at_level(logging.WARNING):
+        subscribers = load_subscribers(path)
+    assert [s['email'] for s in subscribers] == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert 'Skipping subscriber bad-rule@example.com' in caplog.text
+    assert "Skipping subscriber bad-language@example.com: Unsupported language 'ger'" in caplog.text
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        load_subscribers(str(tmp_path / 'subscribers.txt'))
+
+def test_group_by_city():
+    subscribers = [{'email': 'a', 'city': 'x'}, {'email': 'b', 'city': 'y'}, {'email': 'c', 'city': 'x'}]
+    assert {city: [s['email'] for s in members] for city, members in group_by_city(subscribers).items()} == {
+        'x': ['a', 'c'], 'y': ['b']
+    }
+
+def test_dispatch_scrapes_and_renders_once(monkeypatch):
+    renders = []
+    render = pollen_scraper.format_email_content
+    monkeypatch.setattr(pollen_scraper, 'format_email_content',
+                        lambda data, language, *args: renders.append((data['city'], language))
+                        or render(data, language, *args))
+    subscribers = [{'email': f"{i}@example.com", 'city': ['berlin', 'koeln'][i % 2],
+                    'language': 'de' if i % 3 == 0 else 'en'} for i in range(12)]
+    subscribers.append({'email': 'rule@example.com', 'city': 'berlin', 'language': 'en', 'rules': 'Birke = 1'})
+    source = FakeSource()
+    with SMTPSink() as sink:
+        stats = pollen_scraper.dispatch_subscribers(subscribers, sink.email_config(), source=source)
+    assert sorted(source.scraped) == ['berlin', 'koeln']
+    assert sorted(renders) == [('berlin', 'de'), ('berlin', 'en'), ('koeln', 'de'), ('koeln', 'en')]
+    assert stats['render']['count'] == 4
+    assert stats['send']['count'] == 12
+    assert stats['below_rules'] == 1
+    assert stats['failed'] == []
+    assert sink.recipients == 12
+
+def test_dispatch_shares_transactions():
+    subscribers = [{'email': f"{i}@example.com", 'city': 'berlin', 'language': 'en'} for i in range(10)]
+    with SMTPSink() as sink:
+        stats = pollen_scraper.dispatch_subscribers(subscribers, sink.email_config(recipients_per_message=4),
+                                                    source=FakeSource())
+    assert stats['send']['count'] == 10
+    assert (sink.messages, sink.recipients) == (3, 10)